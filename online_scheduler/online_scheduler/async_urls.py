@@ -0,0 +1,14 @@
+from django.urls import include, path
+
+from service_agency.urls import async_urlpatterns
+
+from .urls import urlpatterns as sync_urlpatterns
+
+# URLconf of the requests served by the ASGI handler, set per request by
+# AsyncURLconfMiddleware. The agency paths go to the async handlers, every
+# other path resolves like in online_scheduler/urls.py.
+
+urlpatterns = [
+    path("agency/", include(async_urlpatterns)),
+    *sync_urlpatterns,
+]
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 
+from decouple import config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'service_agency.middleware.AsyncURLconfMiddleware',
+    'service_agency.middleware.TimingMiddleware',
+    'service_agency.middleware.ReplicaRoutingMiddleware',
+    'service_agency.middleware.IdempotencyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +58,9 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'online_scheduler.urls'
+# requests served by the ASGI handler resolve against this URLconf, which
+# maps the same paths to the async views of service_agency/async_views.py
+ASYNC_URLCONF = 'online_scheduler.async_urls'
 
 TEMPLATES = [
     {
@@ -72,6 +81,11 @@ TEMPLATES = [
 REST_FRAMEWORK = {
     # YOUR SETTINGS
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # orjson backed when it is installed, same output as the stock renderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'service_agency.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -80,6 +94,10 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
     # OTHER SETTINGS
+    # slot and end_slot share the slot grid as one enum
+    'ENUM_NAME_OVERRIDES': {
+        'SlotEnum': 'service_agency.availability.ALL_SLOTS',
+    },
 }
 
 WSGI_APPLICATION = 'online_scheduler.wsgi.application'
@@ -95,6 +113,149 @@ DATABASES = {
     }
 }
 
+# production sqlite profile for deployments with several worker processes,
+# see service_agency/sqlite/base.py. WAL lets readers run next to the writer,
+# synchronous=NORMAL only syncs at checkpoints (a power loss can drop the last
+# commits but never corrupts the file), a writer waits up to
+# SQLITE_BUSY_TIMEOUT seconds for the lock and atomic blocks take it up front
+
+SQLITE_PRODUCTION = config('SQLITE_PRODUCTION', default=False, cast=bool)
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=20, cast=float)
+SQLITE_CACHE_KB = config('SQLITE_CACHE_KB', default=65536, cast=int)
+SQLITE_PRODUCTION_PROFILE = {
+    'ENGINE': 'service_agency.sqlite',
+    'OPTIONS': {
+        'timeout': SQLITE_BUSY_TIMEOUT,
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            f'PRAGMA cache_size=-{SQLITE_CACHE_KB};'
+            'PRAGMA temp_store=MEMORY'
+        ),
+    },
+}
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(SQLITE_PRODUCTION_PROFILE)
+
+# availability, listing and search reads go to the replica when
+# DATABASE_REPLICA_NAME names one, a client that wrote in the last
+# READ_PIN_SECONDS keeps reading from the primary
+
+DATABASE_REPLICA_NAME = config('DATABASE_REPLICA_NAME', default='')
+if DATABASE_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATABASE_REPLICA_NAME,
+        'TEST': {'MIRROR': 'default'},
+    }
+READ_DATABASE = 'replica' if DATABASE_REPLICA_NAME else 'default'
+READ_PIN_SECONDS = config('READ_PIN_SECONDS', default=5, cast=int)
+DATABASE_ROUTERS = ['service_agency.routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# locmem is per process, point default at a shared backend such as redis or
+# memcached in production so every worker sees the same availability versions
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+AVAILABILITY_CACHE_ALIAS = 'default'
+AVAILABILITY_CACHE_TIMEOUT = 300
+
+# identical concurrent availability reads share one computation: "process"
+# within a worker, "cache" across workers through a lock in the cache above,
+# "off" to compute every miss. Waiters compute themselves after
+# AVAILABILITY_COALESCE_WAIT_SECONDS.
+AVAILABILITY_COALESCE = config('AVAILABILITY_COALESCE', default='process')
+AVAILABILITY_COALESCE_WAIT_SECONDS = config('AVAILABILITY_COALESCE_WAIT_SECONDS', default=2, cast=float)
+
+# operator ids seen to exist are kept per worker for OPERATOR_CACHE_TTL
+# seconds, at most OPERATOR_CACHE_SIZE of them
+OPERATOR_CACHE_TTL = config('OPERATOR_CACHE_TTL', default=300, cast=int)
+OPERATOR_CACHE_SIZE = config('OPERATOR_CACHE_SIZE', default=100000, cast=int)
+
+# writes sent with an Idempotency-Key header run once, retries within
+# IDEMPOTENCY_TTL seconds get the stored response. A duplicate that arrives
+# while the first is still running waits up to IDEMPOTENCY_WAIT_SECONDS, the
+# in-flight marker of a worker that died expires after IDEMPOTENCY_LOCK_SECONDS
+
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=24 * 60 * 60, cast=int)
+IDEMPOTENCY_WAIT_SECONDS = config('IDEMPOTENCY_WAIT_SECONDS', default=10, cast=float)
+IDEMPOTENCY_LOCK_SECONDS = config('IDEMPOTENCY_LOCK_SECONDS', default=60, cast=int)
+
+
+# Change feed
+# booking changes are written to the booking_event outbox and tailed through
+# agency/bookings/events. A long poll waits up to FEED_MAX_WAIT_SECONDS, an
+# event stream runs for FEED_STREAM_SECONDS under ASGI and for
+# FEED_SYNC_STREAM_SECONDS under WSGI, where it holds a worker, before the
+# client reconnects and sends a comment every FEED_HEARTBEAT_SECONDS while idle. Writes of other
+# workers are seen within FEED_POLL_SECONDS. archive_bookings deletes events
+# older than FEED_RETENTION_DAYS.
+
+FEED_MAX_WAIT_SECONDS = config('FEED_MAX_WAIT_SECONDS', default=30, cast=int)
+FEED_STREAM_SECONDS = config('FEED_STREAM_SECONDS', default=300, cast=int)
+FEED_SYNC_STREAM_SECONDS = config('FEED_SYNC_STREAM_SECONDS', default=30, cast=int)
+FEED_HEARTBEAT_SECONDS = config('FEED_HEARTBEAT_SECONDS', default=15, cast=float)
+FEED_POLL_SECONDS = config('FEED_POLL_SECONDS', default=0.5, cast=float)
+FEED_RETENTION_DAYS = config('FEED_RETENTION_DAYS', default=7, cast=int)
+
+
+# Slots
+# bookings start on a SLOT_MINUTES grid (a divisor of 1440) and cover one or
+# more slots up to MAX_BOOKING_MINUTES
+
+SLOT_MINUTES = config('SLOT_MINUTES', default=60, cast=int)
+MAX_BOOKING_MINUTES = config('MAX_BOOKING_MINUTES', default=60, cast=int)
+
+
+# Archive
+# archive_bookings moves bookings of days older than ARCHIVE_AFTER_DAYS and
+# cancelled bookings made more than ARCHIVE_CANCELLED_AFTER_DAYS ago out of
+# the booking table
+
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=180, cast=int)
+ARCHIVE_CANCELLED_AFTER_DAYS = config('ARCHIVE_CANCELLED_AFTER_DAYS', default=30, cast=int)
+
+# Identifiers
+# booking and operator ids embed a worker id between 0 and 1023 that no two
+# live processes may share. Every process leases a free one by locking a file
+# in ID_WORKER_DIR, next to the database with SQLITE_PRODUCTION. Unset
+# (development) the worker id is taken from the pid
+
+ID_WORKER_DIR = config('ID_WORKER_DIR', default=f"{DATABASES['default']['NAME']}.workers" if SQLITE_PRODUCTION else '')
+
+
+# Logging
+# https://docs.djangoproject.com/en/4.2/topics/logging/
+# structured request and booking logs are opt-in, set AGENCY_LOG_LEVEL=INFO
+# for one JSON line per request or DEBUG to also log slot checks
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'service_agency.log.JsonFormatter'},
+    },
+    'handlers': {
+        'agency': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'service_agency': {
+            'handlers': ['agency'],
+            'level': config('AGENCY_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
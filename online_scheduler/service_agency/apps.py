@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
 
 
 class ServiceAgencyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'service_agency'
+
+    def ready(self):
+        from . import cache, ids, operators, slots
+        from .metrics import install_query_recorder
+        from .models import Operator
+
+        slots.check_settings()
+        cache.check_settings()
+        ids.check_settings()
+        connection_created.connect(install_query_recorder, dispatch_uid="service_agency_query_recorder")
+        post_delete.connect(operators.forget_deleted, sender=Operator, dispatch_uid="service_agency_operator_deleted")
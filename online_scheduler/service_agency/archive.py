@@ -0,0 +1,74 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import Booking, BookingArchive, BookingEvent
+
+# moves bookings from the hot booking table to booking_archive. Every chunk
+# is copied and deleted in one transaction, so an interrupted run leaves no
+# half moved rows and the next run simply picks up what is still left.
+
+ARCHIVED_FIELDS = (
+    "timestamp",
+    "booking_id",
+    "legacy_id",
+    "operator_id",
+    "status",
+    "booking_date",
+    "start_time",
+    "end_time",
+    "is_rescheduled",
+    "is_cancelled",
+)
+
+
+class AlreadyArchived(IntegrityError):
+    # raised by archive_chunk when a booking_id or legacy_id of the chunk is
+    # already in booking_archive. The chunk is rolled back, so the hot rows
+    # stay where they are instead of being deleted without a copy.
+    def __init__(self, booking_ids):
+        super().__init__(f"already archived: {', '.join(str(booking_id) for booking_id in booking_ids)}")
+        self.booking_ids = booking_ids
+
+
+def archive_condition(before_date, cancelled_before):
+    # bookings of days before before_date, and cancelled bookings made
+    # before cancelled_before whatever their date
+    return Q(booking_date__lt=before_date) | Q(status="cancelled", timestamp__lt=cancelled_before)
+
+
+def archive_chunk(condition, after=None, chunk_size=1000):
+    # moves up to chunk_size matching bookings with a booking_id above after,
+    # returns how many were moved and the last booking_id
+    bookings = Booking.objects.select_for_update().filter(condition).order_by("booking_id")
+    if after is not None:
+        bookings = bookings.filter(booking_id__gt=after)
+    with transaction.atomic():
+        rows = list(bookings.values(*ARCHIVED_FIELDS)[:chunk_size])
+        if not rows:
+            return 0, after
+        booking_ids = [row["booking_id"] for row in rows]
+        legacy_ids = [row["legacy_id"] for row in rows if row["legacy_id"] is not None]
+        archived = list(BookingArchive.objects.filter(
+            Q(booking_id__in=booking_ids) | Q(legacy_id__in=legacy_ids)
+        ).values_list("booking_id", flat=True))
+        if archived:
+            raise AlreadyArchived(sorted(archived))
+        BookingArchive.objects.bulk_create([BookingArchive(**row) for row in rows])
+        Booking.objects.filter(booking_id__in=booking_ids).delete()
+    return len(rows), rows[-1]["booking_id"]
+
+
+def prune_events_chunk(before, chunk_size=1000):
+    # deletes up to chunk_size change feed events recorded before `before`,
+    # oldest first, returns how many were deleted. Event ids grow with time,
+    # so the walk along the primary key stops at the first recent event.
+    with transaction.atomic():
+        last = None
+        for event_id, timestamp in BookingEvent.objects.order_by("id").values_list("id", "timestamp")[:chunk_size]:
+            if timestamp >= before:
+                break
+            last = event_id
+        if last is None:
+            return 0
+        deleted, _ = BookingEvent.objects.filter(id__lte=last).delete()
+    return deleted
@@ -0,0 +1,156 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import ValidationError
+from django.views import View
+
+from . import events, fastpath, metrics, operators
+from .bookings import book, cancel, reschedule
+from .serializer import (BookingDataSerializer, BookingFeedSerializer, OperatorSerializer, RescheduleSerializer,
+                         ViewBookingSerializer)
+from .views import afeed_operator, aview_slots, event_stream_response, feed_offset
+
+# the handlers of views.py for the ASGI deployment, served on the same paths
+# through settings.ASYNC_URLCONF, see AsyncURLconfMiddleware. DRF 3.14 has no
+# async views, so these are plain Django views with the same request and
+# response contract.
+#
+# Reads (availability, operator lookups, the feed) use the async ORM and
+# cache API. Writes run the shared functions of bookings.py and operators.py
+# in a thread of the default executor (see in_thread) on that thread's own
+# connection and transaction, so they do not queue behind each other and the
+# reads on the single thread that runs thread sensitive code. The feed waits
+# for events on the event loop, so a long poll or a stream holds no thread.
+
+
+def in_thread(function):
+    # function as a coroutine function that runs in an executor thread. The
+    # thread's connections are closed or kept before and after the call like
+    # those of a request, following CONN_MAX_AGE.
+    def run(*args):
+        close_old_connections()
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+abook = in_thread(book)
+areschedule = in_thread(reschedule)
+acancel = in_thread(cancel)
+aadd_operator = in_thread(operators.add)
+
+
+class AsyncAPIView(View):
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # like DRF APIView the endpoints are not protected by CSRF
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    def validate(self, serializer_class, data, fast=True):
+        # returns the validated data or the 400 response DRF would send, with
+        # fast well formed requests skip the serializer like in
+        # views.validated. Serializers the fast path does not compile, like
+        # the ones views.py validates inline, must pass fast=False.
+        with metrics.phase("validation"):
+            validated = fastpath.validate(serializer_class, data) if fast else None
+            if validated is not None:
+                return validated, None
+            serializer = serializer_class(data=data)
+            valid = serializer.is_valid()
+        if not valid:
+            return None, JsonResponse(serializer.errors, status=400)
+        return serializer.validated_data, None
+
+    def body(self, request):
+        try:
+            return json.loads(request.body or b"{}"), None
+        except ValueError as exc:
+            return None, JsonResponse({"detail": f"JSON parse error - {exc}"}, status=400)
+
+
+class AsyncSlotBooking(AsyncAPIView):
+    replica_methods = ("GET",)
+    idempotent_methods = ("POST", "PATCH")
+
+    async def post(self, request):
+        payload, error = self.body(request)
+        if error:
+            return error
+        data, error = self.validate(BookingDataSerializer, payload)
+        if error:
+            return error
+        body, code = await abook(data)
+        return JsonResponse(body, status=code)
+
+    async def patch(self, request):
+        payload, error = self.body(request)
+        if error:
+            return error
+        data, error = self.validate(RescheduleSerializer, payload)
+        if error:
+            return error
+        body, code = await areschedule(data)
+        return JsonResponse(body, status=code)
+
+    async def get(self, request):
+        data, error = self.validate(ViewBookingSerializer, request.GET)
+        if error:
+            return error
+        body, code, headers = await aview_slots(data, request.headers.get("If-None-Match"))
+        if body is None:
+            return HttpResponse(status=code, headers=headers)
+        return JsonResponse(body, status=code, headers=headers)
+
+
+class AsyncCancelBooking(AsyncAPIView):
+    idempotent_methods = ("DELETE",)
+
+    async def delete(self, request, booking_id):
+        body, code = await acancel(booking_id)
+        return JsonResponse(body, status=code)
+
+
+class AsyncAddOperator(AsyncAPIView):
+    idempotent_methods = ("POST",)
+
+    async def post(self, request):
+        payload, error = self.body(request)
+        if error:
+            return error
+        data, error = self.validate(OperatorSerializer, payload, fast=False)
+        if error:
+            return error
+        body, code = await aadd_operator(data["name"])
+        return JsonResponse(body, status=code)
+
+
+class AsyncBookingFeed(AsyncAPIView):
+    async def get(self, request):
+        data, error = self.validate(BookingFeedSerializer, request.GET)
+        if error:
+            return error
+        try:
+            after = feed_offset(data.get("after"), request.headers.get("Last-Event-ID"))
+        except ValidationError as exc:
+            return JsonResponse(exc.detail, status=400)
+        operator_id, error = await afeed_operator(data)
+        if error:
+            return JsonResponse(error[0], status=error[1])
+
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            return event_stream_response(events.astream(after, operator_id, data["limit"]))
+
+        found = await events.aread(after, operator_id, data["limit"], data["wait"])
+        return JsonResponse({
+            "sCode": 200,
+            "message": "Booking events",
+            "events": [events.as_dict(event) for event in found],
+            "cursor": found[-1].id if found else after,
+        })
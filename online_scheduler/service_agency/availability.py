@@ -0,0 +1,177 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import cache, utilization
+from .models import OperatorAvailability
+from .slots import all_slots, interval_bits
+
+# the slot grid follows settings.SLOT_MINUTES, see slots.py
+ALL_SLOTS = all_slots()
+
+
+class SlotTaken(IntegrityError):
+    # raised by mark_booked when a minute of the interval is already booked,
+    # callers treat it like a violated booking constraint
+    pass
+
+
+def get_day(operator_id, booking_date, using=None):
+    # (version, mask) of a day, a day without a row is free at version 0
+    row = OperatorAvailability.objects.using(using).filter(
+        operator_id=operator_id, booking_date=booking_date
+    ).values_list("version", "booked_minutes").first()
+    return (row[0], int(row[1], 16)) if row else (0, 0)
+
+
+async def aget_day(operator_id, booking_date, using=None):
+    # get_day for the async views
+    row = await OperatorAvailability.objects.using(using).filter(
+        operator_id=operator_id, booking_date=booking_date
+    ).values_list("version", "booked_minutes").afirst()
+    return (row[0], int(row[1], 16)) if row else (0, 0)
+
+
+def etag(booking_date, version, view_booked_slots):
+    # availability responses change with the day's version, the view and the
+    # slot grid, the date keeps "today" requests apart across midnight
+    return f'"{booking_date:%Y%m%d}-{version}-{int(view_booked_slots)}-{settings.SLOT_MINUTES}"'
+
+
+def _every_day(start_date, end_date, masks):
+    days = (end_date - start_date).days + 1
+    return [
+        (day, masks.get(day, 0))
+        for day in (start_date + timedelta(days=offset) for offset in range(days))
+    ]
+
+
+def get_masks(operator_id, start_date, end_date):
+    # masks for every day of the range in one query, days without a row are free
+    masks = {
+        booking_date: int(mask, 16)
+        for booking_date, mask in OperatorAvailability.objects.filter(
+            operator_id=operator_id, booking_date__range=(start_date, end_date)
+        ).values_list("booking_date", "booked_minutes")
+    }
+    return _every_day(start_date, end_date, masks)
+
+
+async def aget_masks(operator_id, start_date, end_date):
+    # get_masks for the async views
+    rows = OperatorAvailability.objects.filter(
+        operator_id=operator_id, booking_date__range=(start_date, end_date)
+    ).values_list("booking_date", "booked_minutes")
+    masks = {booking_date: int(mask, 16) async for booking_date, mask in rows}
+    return _every_day(start_date, end_date, masks)
+
+
+def _swap_mask(operator_id, booking_date, change):
+    # compare and swap on the day's row, retried until no other writer
+    # changed the mask between our read and our update. Returns the change
+    # in booked minutes as {(operator_id, booking_date): minutes} for
+    # utilization.add.
+    day = OperatorAvailability.objects.filter(operator_id=operator_id, booking_date=booking_date)
+    while True:
+        current = day.values_list("booked_minutes", flat=True).first()
+        if current is None:
+            # the first write of the day creates the row with its mask, a
+            # concurrent first write makes us read the row it created
+            before, mask = 0, change(0)
+            try:
+                with transaction.atomic():
+                    OperatorAvailability.objects.create(
+                        operator_id=operator_id, booking_date=booking_date, booked_minutes=format(mask, "x"), version=1,
+                    )
+                break
+            except IntegrityError:
+                continue
+        before = int(current, 16)
+        mask = change(before)
+        if day.filter(booked_minutes=current).update(booked_minutes=format(mask, "x"), version=F("version") + 1):
+            break
+    cache.invalidate(operator_id, booking_date)
+    return {(operator_id, booking_date): mask.bit_count() - before.bit_count()}
+
+
+def _booking(operator_id, booking_date, start, end, freed=0):
+    # the change of mark_booked, freed are the minutes released by the same
+    # write before the interval is booked
+    bits = interval_bits(start, end)
+
+    def book(mask):
+        mask &= ~freed
+        if mask & bits:
+            raise SlotTaken(f"{start}-{end} overlaps a booking of {operator_id} on {booking_date}")
+        return mask | bits
+
+    return book
+
+
+def mark_booked(operator_id, booking_date, start, end):
+    # books the minutes [start, end), must run inside the transaction that
+    # writes the booking row
+    utilization.add(_swap_mask(operator_id, booking_date, _booking(operator_id, booking_date, start, end)))
+
+
+def mark_free(operator_id, booking_date, start, end):
+    # must run inside the transaction that writes the booking row
+    bits = interval_bits(start, end)
+    utilization.add(_swap_mask(operator_id, booking_date, lambda mask: mask & ~bits))
+
+
+def mark_moved(operator_id, previous_date, previous, booking_date, current):
+    # frees the minutes previous of previous_date and books the minutes
+    # current of booking_date, both (start, end). A move within the day is
+    # one swap of its mask, and either way the utilization rows are updated
+    # once with both changes.
+    freed = interval_bits(*previous)
+    if previous_date == booking_date:
+        deltas = _swap_mask(operator_id, booking_date, _booking(operator_id, booking_date, *current, freed=freed))
+    else:
+        deltas = _swap_mask(operator_id, previous_date, lambda mask: mask & ~freed)
+        deltas.update(_swap_mask(operator_id, booking_date, _booking(operator_id, booking_date, *current)))
+    utilization.add(deltas)
+
+
+def lock_days(operator_ids, booking_dates):
+    # fetch and lock the availability rows touched by a batch, rows that do
+    # not exist yet are created unsaved with an empty mask by the caller
+    return _locked(OperatorAvailability.objects.select_for_update().filter(
+        operator_id__in=set(operator_ids), booking_date__in=set(booking_dates)
+    ))
+
+
+def lock_day_range(operator_id, start_date, end_date):
+    # lock_days for every existing day of the operator in the range, with a
+    # bounded number of parameters however long the range is
+    return _locked(OperatorAvailability.objects.select_for_update().filter(
+        operator_id=operator_id, booking_date__range=(start_date, end_date)
+    ))
+
+
+def _locked(days):
+    days = {(day.operator_id, day.booking_date): day for day in days}
+    # booked minutes as locked, save_days adds the difference to the
+    # utilization rows
+    for day in days.values():
+        day.locked_minutes = day.mask.bit_count()
+    return days
+
+
+def save_days(days):
+    # the rows of old days were locked by lock_days
+    for day in days:
+        day.version += 1
+    new_days = [day for day in days if day.pk is None]
+    old_days = [day for day in days if day.pk is not None]
+    OperatorAvailability.objects.bulk_create(new_days, batch_size=500)
+    OperatorAvailability.objects.bulk_update(old_days, ["booked_minutes", "version"], batch_size=500)
+    utilization.add({
+        (day.operator_id, day.booking_date): day.mask.bit_count() - getattr(day, "locked_minutes", 0)
+        for day in days
+    })
+    for day in days:
+        cache.invalidate(day.operator_id, day.booking_date)
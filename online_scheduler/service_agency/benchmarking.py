@@ -0,0 +1,132 @@
+import contextlib
+import logging
+import math
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from . import ids, utilization
+from .slots import interval_bits, slot_minutes, slot_starts, to_time
+from .models import Booking, Operator, OperatorAvailability
+
+# helpers shared by the benchmark management commands
+
+
+@contextlib.contextmanager
+def test_database(profile=None):
+    # benchmarks run against a throwaway database created like the test
+    # runner does, so they never touch the configured one. With a profile
+    # ("default" or "production", see file_database) it is a migrated sqlite
+    # file instead, for benchmarks whose writers run in several threads.
+    setup_test_environment(debug=False)
+    with contextlib.ExitStack() as stack:
+        if profile is None:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            stack.callback(connection.creation.destroy_test_db, old_name, verbosity=0)
+        else:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+            stack.enter_context(file_database(profile, os.path.join(directory, f"{profile}.sqlite3")))
+            call_command("migrate", verbosity=0, interactive=False)
+        # 4xx answers are part of the workload, keep them out of the output
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            reset()
+            yield
+        finally:
+            request_logger.setLevel(level)
+    teardown_test_environment()
+
+
+@contextlib.contextmanager
+def file_database(profile, path):
+    # points the default alias at a fresh file with the stock sqlite settings
+    # or the production profile, writers forked inside the block inherit it
+    original = connections.settings["default"]
+    database = {**original, "NAME": path, "ENGINE": "django.db.backends.sqlite3", "OPTIONS": {}}
+    if profile == "production":
+        database.update(settings.SQLITE_PRODUCTION_PROFILE)
+    connections["default"].close()
+    del connections["default"]
+    connections.settings["default"] = database
+    try:
+        yield
+    finally:
+        connections["default"].close()
+        del connections["default"]
+        connections.settings["default"] = original
+
+
+def reset():
+    # empties the database and caches between benchmark runs
+    call_command("flush", verbosity=0, interactive=False)
+    for cache in caches.all():
+        cache.clear()
+
+
+def seed(rng, operators, days, density):
+    # creates operators with bookings on the last `days` days, every slot of
+    # the grid is booked with probability `density`, along with their
+    # availability and utilization rows. Returns operator ids, dates and the
+    # ids of the seeded bookings
+    today = timezone.now().date()
+    operator_ids = [str(ids.next_id()) for _ in range(operators)]
+    dates = [today - timedelta(days=offset) for offset in range(days)]
+    Operator.objects.bulk_create(
+        [Operator(id=operator_id, operator_name=f"operator {operator_id}") for operator_id in operator_ids],
+        batch_size=1000,
+    )
+
+    bookings = []
+    masks = []
+    for operator_id in operator_ids:
+        for booking_date in dates:
+            day = OperatorAvailability(operator_id=operator_id, booking_date=booking_date)
+            mask = 0
+            for start in slot_starts():
+                if rng.random() < density:
+                    end = start + slot_minutes()
+                    mask |= interval_bits(start, end)
+                    bookings.append(Booking(
+                        booking_id=ids.next_id(),
+                        operator_id=operator_id,
+                        booking_date=booking_date,
+                        start_time=to_time(start),
+                        end_time=to_time(end),
+                        status="booked",
+                    ))
+            day.mask = mask
+            masks.append(day)
+    Booking.objects.bulk_create(bookings, batch_size=1000)
+    OperatorAvailability.objects.bulk_create(masks, batch_size=1000)
+    # the utilization rows the writes would have kept, so that reschedules
+    # and cancels of seeded bookings update rows that exist
+    utilization.add({(int(day.operator_id), day.booking_date): day.mask.bit_count() for day in masks})
+    return operator_ids, dates, [str(booking.booking_id) for booking in bookings]
+
+
+def percentile(values, p):
+    # nearest rank percentile of an already sorted list
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
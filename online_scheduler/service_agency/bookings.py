@@ -0,0 +1,385 @@
+import logging
+from datetime import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import serializers, status
+
+from . import events, ids, metrics, operators
+from .availability import lock_day_range, lock_days, mark_booked, mark_free, mark_moved, save_days
+from .slots import MINUTES_PER_DAY, booking_interval, interval_bits, max_booking_minutes, slot_minutes, to_time
+from .models import Booking, BookingArchive, Operator, OperatorAvailability
+from .serializer import BookingDataSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def generate_id():
+    return ids.next_id()
+
+
+@metrics.phase("validation")
+def check_slot_times(booking_start_time, booking_end_time, duration_message="Booking should be for max 1 hour"):
+    # returns the error body and status for an invalid slot, None otherwise.
+    # duration_message is kept for the default one hour grid, other grids
+    # explain the allowed durations
+    start, end = booking_interval(booking_start_time, booking_end_time)
+    size = slot_minutes()
+    longest = max_booking_minutes()
+
+    # to check if start time should be end time
+    if start > end:
+        return (
+            {"sCode": 412, "message": "Start time must be earlier than end time",},
+            status.HTTP_412_PRECONDITION_FAILED,
+        )
+
+    minutes = end - start
+    logger.debug("slot times checked", extra={
+        "start_time": str(booking_start_time), "end_time": str(booking_end_time), "minutes": minutes,
+    })
+
+    # to check that the booking covers whole slots and is not too long
+    if minutes <= 0 or minutes % size or minutes > longest:
+        if not size == longest == 60:
+            duration_message = f"Booking should be for whole {size} minute slots and max {longest} minutes"
+        return (
+            {"sCode": 422, "message": duration_message,},
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if start % size or booking_start_time.second or booking_end_time.second:
+        return (
+            {"sCode": 422, "message": f"Booking must start on a {size} minute slot boundary",},
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return None
+
+
+def insert_booking(operator_id, booking_date, booking_start_time, booking_end_time):
+    # inserts the booking and marks its minutes as taken in one transaction,
+    # an overlapping booking raises SlotTaken
+    params = {
+        "operator_id" : operator_id,
+        "booking_date": booking_date,
+        "start_time": booking_start_time,
+        "end_time": booking_end_time,
+        "status": "booked"
+    }
+
+    for attempt in range(ids.ID_ATTEMPTS):
+        booking_id = generate_id()
+        try:
+            with transaction.atomic():
+                booking = Booking.objects.create(booking_id=booking_id, **params)
+                mark_booked(operator_id, booking_date, *booking_interval(booking_start_time, booking_end_time))
+                events.record([events.event("created", booking)])
+            break
+        except IntegrityError:
+            # an id handed out twice is not a taken slot, try a new one
+            if attempt + 1 < ids.ID_ATTEMPTS and Booking.objects.filter(booking_id=booking_id).exists():
+                logger.warning("booking id %s already taken, retrying with a new one", booking_id)
+                continue
+            return (
+                {"sCode": 400, "message": "Booking already exists, please slelect some other slot or date",},
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+    return (
+        {"sCode": 200, "message": "Booking succesfully created", "booking_id": str(booking_id)},
+        status.HTTP_200_OK,
+    )
+
+
+def move_booking(booking_id, booking_date, booking_start_time, booking_end_time):
+    # moves an active booking with one conditional update, the rescheduled
+    # event written first carries the slot it moves from. An overlapping
+    # booking raises SlotTaken or violates booking_active_slot_unique.
+    try:
+        with transaction.atomic():
+            moved = events.record_move(booking_id, booking_date, booking_start_time, booking_end_time)
+            # a concurrent cancel can get in between on backends that do not
+            # lock the whole database for the transaction
+            if moved is None or not Booking.objects.filter(booking_id=booking_id, status="booked").update(
+                start_time = booking_start_time,
+                end_time = booking_end_time,
+                booking_date=booking_date,
+                is_rescheduled = True
+            ):
+                transaction.set_rollback(True)
+                return (
+                    {"sCode": 404, "message": "Booking doesnot exists",},
+                    status.HTTP_404_NOT_FOUND,
+                )
+            mark_moved(
+                moved.operator_id,
+                moved.previous_date, booking_interval(moved.previous_start_time, moved.previous_end_time),
+                booking_date, booking_interval(booking_start_time, booking_end_time),
+            )
+    except IntegrityError:
+        # if the slot is already booked ask user to choose other slot
+        return (
+            {"sCode": 400, "message": "Please select some other slot or date"},
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    return (
+        {"sCode": 200, "message": "Booking rescheduled successfully"},
+        status.HTTP_200_OK,
+    )
+
+
+def cancel_booking(booking):
+    # cancels the booking and frees the slot in one transaction
+    with transaction.atomic():
+        cancelled = Booking.objects.filter(booking_id=booking.booking_id, status="booked").update(
+            is_cancelled = True,
+            status="cancelled"
+        )
+        # a concurrent cancel got there first
+        if not cancelled:
+            return (
+                {"sCode": 412, "message": "Booking already cancelled",},
+                status.HTTP_404_NOT_FOUND,
+            )
+        mark_free(booking.operator_id, booking.booking_date, *booking_interval(booking.start_time, booking.end_time))
+        events.record([events.event("cancelled", booking)])
+
+    return (
+        {"sCode": 200, "message": "Booking cancelled successfully"},
+        status.HTTP_200_OK,
+    )
+
+
+# the booking requests of views.py as functions of the validated data that
+# return the response body and status, shared by the sync views and the
+# async views of async_views.py
+
+
+def book(data):
+    operator_id = ids.resolve(Operator, data["operator_id"])
+
+    #check if operator exits, known operators are answered from the registry
+    if not operators.exists(operator_id):
+        return (
+            {"sCode": 404, "message": "Operator not registered",},
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    # to check if the slot is valid and for 1 hour
+    error = check_slot_times(data["start_time"], data["end_time"])
+    if error:
+        return error
+
+    # add booking to DB and mark the slot as taken in the same transaction
+    return insert_booking(operator_id, data["booking_date"], data["start_time"], data["end_time"])
+
+
+def reschedule(data):
+    # check if the slot is valid and for 1 hour
+    error = check_slot_times(data["start_time"], data["end_time"], "Booking should be for 1 hour")
+    if error:
+        return error
+
+    # move the booking with one conditional update
+    booking_id = ids.resolve(Booking, data["booking_id"])
+    return move_booking(booking_id, data["booking_date"], data["start_time"], data["end_time"])
+
+
+def cancel(booking_id):
+    # check if the booking exist in DB
+    booking = Booking.objects.filter(booking_id=ids.resolve(Booking, booking_id)).first()
+
+    if booking is None:
+        return (
+            {"sCode": 404, "message": "Booking doesnot exists",},
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    # check if booking is already cancelled
+    if booking.status == "cancelled":
+        return (
+            {"sCode": 412, "message": "Booking already cancelled",},
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    # update booking info and free the slot in the same transaction
+    return cancel_booking(booking)
+
+
+def overlapping(bookings, start, end):
+    # narrows a booking queryset to bookings that overlap the minutes
+    # [start, end) of their day. A booking overlaps when it starts before the
+    # window ends and ends after it starts, no booking is longer than
+    # MAX_BOOKING_MINUTES so only a bounded range of start times is read.
+    bookings = bookings.filter(
+        start_time__gte=to_time(max(0, start - max_booking_minutes() + 1)),
+    ).filter(Q(end_time__gt=to_time(start)) | Q(end_time=time(0)))
+    if end < MINUTES_PER_DAY:
+        bookings = bookings.filter(start_time__lt=to_time(end))
+    return bookings
+
+
+def cancel_bookings(operator_id, start_date, end_date, start=None, end=None):
+    # cancels every active booking of the operator from start_date to
+    # end_date, with start and end only those overlapping the minutes
+    # [start, end) of each day. One UPDATE cancels them and their minutes are
+    # freed on the availability rows in the same transaction. Returns the
+    # cancelled (booking_id, booking_date) pairs.
+    bookings = Booking.objects.filter(
+        operator_id=operator_id, booking_date__range=(start_date, end_date), status="booked"
+    )
+    if start is not None:
+        bookings = overlapping(bookings, start, end)
+
+    with transaction.atomic():
+        # the days are locked first, a concurrent booking of the range has
+        # to update one of them, so it can not add a row between the read
+        # and the UPDATE below. No statement binds one parameter per
+        # cancelled booking.
+        days = lock_day_range(operator_id, start_date, end_date)
+        rows = list(bookings.select_for_update().order_by("booking_date", "start_time").values_list(
+            "booking_id", "booking_date", "start_time", "end_time"
+        ).iterator(chunk_size=CANCEL_CHUNK_SIZE))
+        if not rows:
+            return []
+        bookings.update(is_cancelled=True, status="cancelled")
+        touched = {}
+        for _, booking_date, start_time, end_time in rows:
+            day = days.get((operator_id, booking_date))
+            if day is not None:
+                day.mask &= ~interval_bits(*booking_interval(start_time, end_time))
+                touched[booking_date] = day
+        save_days(list(touched.values()))
+        events.record([
+            events.event("cancelled", Booking(
+                booking_id=booking_id, operator_id=operator_id,
+                booking_date=booking_date, start_time=start_time, end_time=end_time,
+            ))
+            for booking_id, booking_date, start_time, end_time in rows
+        ])
+    return [(booking_id, booking_date) for booking_id, booking_date, _, _ in rows]
+
+
+# rows fetched at a time by the read of cancel_bookings
+CANCEL_CHUNK_SIZE = 500
+
+
+def create_bookings(payloads, keep_ids=False):
+    # books a list of BookingDataSerializer payloads with a constant number of
+    # queries, returns one result per payload in the same order. With keep_ids
+    # a payload can carry its own booking_id and a booked or cancelled status,
+    # which is how historical bookings are imported. A booking_id that is not
+    # a snowflake id is kept as legacy_id next to a new one. Imported bookings
+    # are not changes of the agency and add no events to the change feed.
+    results = [None] * len(payloads)
+    valid = []
+    # one serializer validates every payload, like a ListSerializer child, so
+    # its fields are built once per batch instead of once per payload
+    serializer = BookingDataSerializer()
+    for index, payload in enumerate(payloads):
+        try:
+            with metrics.phase("validation"):
+                data = dict(serializer.run_validation(payload))
+        except serializers.ValidationError as exc:
+            results[index] = {"index": index, "sCode": 400, "message": serializers.as_serializer_error(exc)}
+            continue
+        error = check_slot_times(data["start_time"], data["end_time"])
+        if error:
+            results[index] = {"index": index, **error[0]}
+            continue
+        data["booking_id"] = data["legacy_id"] = None
+        data["status"] = "booked"
+        if keep_ids:
+            given_id = str(payload.get("booking_id") or "") or None
+            if given_id is not None:
+                data["booking_id"] = ids.parse(given_id)
+                if data["booking_id"] is None:
+                    data["legacy_id"] = given_id
+            data["status"] = payload.get("status") or "booked"
+            if data["status"] not in ("booked", "cancelled"):
+                results[index] = {"index": index, "sCode": 400, "message": {"status": [f'"{data["status"]}" is not a valid choice.']}}
+                continue
+        valid.append((index, data))
+
+    # a concurrent writer can take a slot or create an availability row between
+    # our read and our insert, in that case the batch is checked again against
+    # fresh rows
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _book_valid(valid, results, announce=not keep_ids)
+            break
+        except IntegrityError:
+            if attempt:
+                raise
+    return results
+
+
+def _book_valid(valid, results, announce=True):
+    if not valid:
+        return
+    resolved = ids.resolve_many(Operator, {data["operator_id"] for _, data in valid})
+    operator_ids = set(resolved.values()) - {None}
+    registered = operators.registered(operator_ids)
+    days = lock_days(operator_ids, [data["booking_date"] for _, data in valid])
+    given_ids = [data["booking_id"] for _, data in valid if data["booking_id"] is not None]
+    legacy_ids = [data["legacy_id"] for _, data in valid if data["legacy_id"] is not None]
+    # an archived booking keeps its ids, a booking imported again after it
+    # was archived must not reuse them
+    taken_ids = set()
+    taken_legacy_ids = set()
+    for model in (Booking, BookingArchive):
+        if given_ids:
+            taken_ids.update(model.objects.filter(booking_id__in=given_ids).values_list("booking_id", flat=True))
+        if legacy_ids:
+            taken_legacy_ids.update(model.objects.filter(legacy_id__in=legacy_ids).values_list("legacy_id", flat=True))
+
+    bookings = []
+    touched = {}
+    for index, data in valid:
+        operator_id = resolved[data["operator_id"]]
+        booking_date = data["booking_date"]
+        if operator_id not in registered:
+            results[index] = {"index": index, "sCode": 404, "message": "Operator not registered"}
+            continue
+        if data["booking_id"] in taken_ids or data["legacy_id"] in taken_legacy_ids:
+            results[index] = {"index": index, "sCode": 400, "message": "Booking id already exists"}
+            continue
+
+        # cancelled bookings do not hold their slot
+        if data["status"] == "booked":
+            key = (operator_id, booking_date)
+            day = days.get(key)
+            if day is None:
+                day = days[key] = OperatorAvailability(operator_id=operator_id, booking_date=booking_date)
+            bits = interval_bits(*booking_interval(data["start_time"], data["end_time"]))
+            if day.mask & bits:
+                results[index] = {
+                    "index": index,
+                    "sCode": 400,
+                    "message": "Booking already exists, please slelect some other slot or date",
+                }
+                continue
+            day.mask |= bits
+            touched[key] = day
+
+        booking_id = data["booking_id"] if data["booking_id"] is not None else generate_id()
+        taken_ids.add(booking_id)
+        if data["legacy_id"] is not None:
+            taken_legacy_ids.add(data["legacy_id"])
+        bookings.append(Booking(
+            booking_id=booking_id,
+            legacy_id=data["legacy_id"],
+            operator_id=operator_id,
+            booking_date=booking_date,
+            start_time=data["start_time"],
+            end_time=data["end_time"],
+            status=data["status"],
+            is_cancelled=data["status"] == "cancelled",
+        ))
+        results[index] = {"index": index, "sCode": 200, "message": "Booking succesfully created", "booking_id": str(booking_id)}
+
+    Booking.objects.bulk_create(bookings, batch_size=500)
+    save_days(touched.values())
+    if announce:
+        events.record([events.event("created", booking) for booking in bookings])
@@ -0,0 +1,253 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+# computed slot lists are cached per (operator_id, booking_date) under a
+# version number that every booking write bumps, so stale entries are never
+# read again and simply expire.
+#
+# Misses are coalesced: while one request computes a slot list, identical
+# requests wait for it and share the result instead of running the same
+# query. AVAILABILITY_COALESCE is "process" for one computation per worker
+# process, "cache" to also hold a lock in the cache so that one process
+# computes for all, or "off".
+
+COALESCE_MODES = ("off", "process", "cache")
+POLL_SECONDS = 0.01
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+_flights = {}
+# flights of the async lookups, per event loop
+_async_flights = {}
+
+
+def check_settings():
+    if settings.AVAILABILITY_COALESCE not in COALESCE_MODES:
+        raise ImproperlyConfigured(f"AVAILABILITY_COALESCE must be one of {', '.join(COALESCE_MODES)}")
+
+
+def _cache():
+    return caches[settings.AVAILABILITY_CACHE_ALIAS]
+
+
+def _version_key(operator_id, booking_date):
+    return f"availability:version:{operator_id}:{booking_date}"
+
+
+def _slots_key(operator_id, booking_date, version, view_booked_slots):
+    # booked slot lists follow the slot grid, a new SLOT_MINUTES gets new keys
+    return (f"availability:day:{operator_id}:{booking_date}:{version}:{int(view_booked_slots)}:"
+            f"{settings.SLOT_MINUTES}")
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def get_version(operator_id, booking_date):
+    cache = _cache()
+    key = _version_key(operator_id, booking_date)
+    version = cache.get(key)
+    if version is None:
+        # a lost version starts from the clock so that entries cached under
+        # an older version can not be picked up again
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(operator_id, booking_date):
+    cache = _cache()
+    key = _version_key(operator_id, booking_date)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _bump_version(operator_id, booking_date):
+    cache = _cache()
+    key = _version_key(operator_id, booking_date)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def get_slots(operator_id, booking_date, view_booked_slots, compute):
+    # returns the cached result or stores the result of compute(), which is
+    # the (version, slots) pair of the day
+    version = get_version(operator_id, booking_date)
+    return _lookup(_slots_key(operator_id, booking_date, version, view_booked_slots), compute)
+
+
+def get_slots_at(operator_id, booking_date, version, view_booked_slots, compute):
+    # like get_slots for a day already read from a replica, keyed on the
+    # version of that row instead of the write counter. A lagging replica
+    # then caches the slots of its own older version and never fills the
+    # entry of a newer write.
+    return _lookup(f"{_slots_key(operator_id, booking_date, version, view_booked_slots)}:row", compute)
+
+
+def _lookup(key, compute):
+    cache = _cache()
+    slots = cache.get(key)
+    if slots is not None:
+        _count("hits")
+        return slots
+    return _single_flight(key, lambda: _compute(cache, key, compute))
+
+
+async def aget_slots(operator_id, booking_date, view_booked_slots, compute):
+    # get_slots for the async views, compute is a coroutine function
+    version = await aget_version(operator_id, booking_date)
+    return await _alookup(_slots_key(operator_id, booking_date, version, view_booked_slots), compute)
+
+
+async def aget_slots_at(operator_id, booking_date, version, view_booked_slots, compute):
+    # get_slots_at for the async views, compute is a coroutine function
+    return await _alookup(f"{_slots_key(operator_id, booking_date, version, view_booked_slots)}:row", compute)
+
+
+async def _alookup(key, compute):
+    cache = _cache()
+    slots = await cache.aget(key)
+    if slots is not None:
+        _count("hits")
+        return slots
+    return await _asingle_flight(key, lambda: _acompute(cache, key, compute))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        # stays None when the computation failed
+        self.slots = None
+
+
+def _single_flight(key, compute):
+    # the first caller for a key runs compute, callers that arrive meanwhile
+    # wait for it and share its result. They compute themselves when it
+    # failed or took longer than AVAILABILITY_COALESCE_WAIT_SECONDS.
+    if settings.AVAILABILITY_COALESCE == "off":
+        return compute()
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        if flight.done.wait(settings.AVAILABILITY_COALESCE_WAIT_SECONDS) and flight.slots is not None:
+            _count("coalesced")
+            return flight.slots
+        return compute()
+    try:
+        flight.slots = compute()
+    finally:
+        with _lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.slots
+
+
+def _compute(cache, key, compute):
+    # runs compute and caches its result, in "cache" mode only the process
+    # holding the lock computes and the others poll for its result
+    if settings.AVAILABILITY_COALESCE == "cache":
+        lock_key = f"{key}:computing"
+        if cache.add(lock_key, 1, timeout=settings.AVAILABILITY_COALESCE_WAIT_SECONDS):
+            try:
+                return _store(cache, key, compute())
+            finally:
+                cache.delete(lock_key)
+        deadline = time.monotonic() + settings.AVAILABILITY_COALESCE_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(POLL_SECONDS)
+            slots = cache.get(key)
+            if slots is not None:
+                _count("coalesced")
+                return slots
+            # the holder failed, compute without the lock
+            if cache.get(lock_key) is None:
+                break
+    return _store(cache, key, compute())
+
+
+def _store(cache, key, slots):
+    _count("misses")
+    cache.set(key, slots, timeout=settings.AVAILABILITY_CACHE_TIMEOUT)
+    return slots
+
+
+async def _asingle_flight(key, compute):
+    # _single_flight for the async lookups, callers of one event loop wait
+    # on a future instead of a thread event
+    if settings.AVAILABILITY_COALESCE == "off":
+        return await compute()
+    loop = asyncio.get_running_loop()
+    flight = _async_flights.get((loop, key))
+    if flight is not None:
+        try:
+            slots = await asyncio.wait_for(asyncio.shield(flight), settings.AVAILABILITY_COALESCE_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            slots = None
+        if slots is not None:
+            _count("coalesced")
+            return slots
+        return await compute()
+    flight = _async_flights[(loop, key)] = loop.create_future()
+    slots = None
+    try:
+        slots = await compute()
+    finally:
+        del _async_flights[(loop, key)]
+        flight.set_result(slots)
+    return slots
+
+
+async def _acompute(cache, key, compute):
+    # _compute for the async lookups
+    if settings.AVAILABILITY_COALESCE == "cache":
+        lock_key = f"{key}:computing"
+        if await cache.aadd(lock_key, 1, timeout=settings.AVAILABILITY_COALESCE_WAIT_SECONDS):
+            try:
+                return await _astore(cache, key, await compute())
+            finally:
+                await cache.adelete(lock_key)
+        deadline = time.monotonic() + settings.AVAILABILITY_COALESCE_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_SECONDS)
+            slots = await cache.aget(key)
+            if slots is not None:
+                _count("coalesced")
+                return slots
+            if await cache.aget(lock_key) is None:
+                break
+    return await _astore(cache, key, await compute())
+
+
+async def _astore(cache, key, slots):
+    _count("misses")
+    await cache.aset(key, slots, timeout=settings.AVAILABILITY_CACHE_TIMEOUT)
+    return slots
+
+
+def invalidate(operator_id, booking_date):
+    # the version is bumped once the booking write is committed
+    transaction.on_commit(lambda: _bump_version(operator_id, booking_date))
+
+
+def stats():
+    with _lock:
+        hits, misses, coalesced = _stats["hits"], _stats["misses"], _stats["coalesced"]
+    total = hits + misses + coalesced
+    # coalesced lookups waited for another request's computation
+    return {"hits": hits, "misses": misses, "coalesced": coalesced, "hit_ratio": hits / total if total else 0.0}
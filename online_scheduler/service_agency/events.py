@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Booking, BookingEvent
+
+# the change feed: every booking write adds BookingEvent rows in its own
+# transaction and consumers tail the table by id. Sqlite runs one writer at a
+# time, so events commit in id order and an offset never skips an event that
+# commits later. Waiting readers of this worker are woken when a write
+# commits, writes of other workers are found by polling every
+# FEED_POLL_SECONDS.
+
+_changed = threading.Condition()
+_generation = 0
+
+
+def event(kind, booking, previous=None):
+    # an unsaved event for the booking's current slot, previous is the
+    # booking before a reschedule
+    return BookingEvent(
+        kind=kind,
+        booking_id=booking.booking_id,
+        operator_id=booking.operator_id,
+        booking_date=booking.booking_date,
+        start_time=booking.start_time,
+        end_time=booking.end_time,
+        previous_date=previous.booking_date if previous else None,
+        previous_start_time=previous.start_time if previous else None,
+        previous_end_time=previous.end_time if previous else None,
+    )
+
+
+def record(events):
+    # must run inside the transaction of the change
+    if not events:
+        return
+    BookingEvent.objects.bulk_create(events, batch_size=500)
+    transaction.on_commit(notify)
+
+
+def record_move(booking_id, booking_date, start_time, end_time):
+    # writes the "rescheduled" event of an active booking and returns it, None
+    # when the booking is not active. The slot it moves from is copied from
+    # the booking row by the INSERT ... SELECT itself, so the move needs no
+    # read before its conditional UPDATE. Must run inside the transaction of
+    # the move, before that UPDATE.
+    moved = BookingEvent(
+        timestamp=timezone.now(),
+        kind="rescheduled",
+        booking_id=booking_id,
+        booking_date=booking_date,
+        start_time=start_time,
+        end_time=end_time,
+    )
+    if not _returns_from_insert_select():
+        previous = Booking.objects.select_for_update().filter(booking_id=booking_id, status="booked").first()
+        if previous is None:
+            return None
+        moved.operator_id = previous.operator_id
+        moved.previous_date = previous.booking_date
+        moved.previous_start_time = previous.start_time
+        moved.previous_end_time = previous.end_time
+        record([moved])
+        return moved
+
+    def column(name):
+        return connection.ops.quote_name(BookingEvent._meta.get_field(name).column)
+
+    def prepared(name):
+        return BookingEvent._meta.get_field(name).get_db_prep_value(getattr(moved, name), connection)
+
+    returned = ("operator_id", "previous_date", "previous_start_time", "previous_end_time")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {connection.ops.quote_name(BookingEvent._meta.db_table)} "
+            f"({', '.join(column(name) for name in _MOVE_COLUMNS)}) "
+            f"SELECT %s, %s, booking_id, operator_id, %s, %s, %s, booking_date, start_time, end_time "
+            f"FROM {connection.ops.quote_name(Booking._meta.db_table)} WHERE booking_id = %s AND status = %s "
+            f"RETURNING {column('id')}, {', '.join(column(name) for name in returned)}",
+            [prepared("timestamp"), prepared("kind"), prepared("booking_date"), prepared("start_time"),
+             prepared("end_time"), booking_id, "booked"],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    moved.id = row[0]
+    for name, value in zip(returned, row[1:]):
+        setattr(moved, name, BookingEvent._meta.get_field(name).to_python(value))
+    transaction.on_commit(notify)
+    return moved
+
+
+def _returns_from_insert_select():
+    # can_return_columns_from_insert only promises that Django can read back
+    # the primary key of its own inserts, Oracle does that with RETURNING ...
+    # INTO and the SQL above is not valid there. Sqlite (3.35 and later, which
+    # is what the flag checks on sqlite) and PostgreSQL take it as written.
+    if connection.vendor == "sqlite":
+        return connection.features.can_return_columns_from_insert
+    return connection.vendor == "postgresql"
+
+
+# column order of the INSERT ... SELECT of record_move
+_MOVE_COLUMNS = (
+    "timestamp", "kind", "booking_id", "operator_id", "booking_date", "start_time", "end_time",
+    "previous_date", "previous_start_time", "previous_end_time",
+)
+
+
+def notify():
+    global _generation
+    with _changed:
+        _generation += 1
+        _changed.notify_all()
+
+
+def as_dict(event):
+    data = {
+        "offset": event.id,
+        "kind": event.kind,
+        "booking_id": str(event.booking_id),
+        "operator_id": str(event.operator_id),
+        "booking_date": str(event.booking_date),
+        "start_time": str(event.start_time),
+        "end_time": str(event.end_time),
+        "timestamp": event.timestamp.isoformat(),
+    }
+    if event.previous_date is not None:
+        data["previous"] = {
+            "booking_date": str(event.previous_date),
+            "start_time": str(event.previous_start_time),
+            "end_time": str(event.previous_end_time),
+        }
+    return data
+
+
+def _events(after, operator_id, limit):
+    events = BookingEvent.objects.filter(id__gt=after)
+    if operator_id is not None:
+        events = events.filter(operator_id=operator_id)
+    return events.order_by("id")[:limit]
+
+
+def read(after, operator_id=None, limit=100, wait=0):
+    # events after the offset, with wait the call blocks up to that many
+    # seconds until there is one
+    deadline = time.monotonic() + wait
+    while True:
+        seen = _generation
+        events = list(_events(after, operator_id, limit))
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        with _changed:
+            _changed.wait_for(lambda: _generation != seen, min(remaining, settings.FEED_POLL_SECONDS))
+
+
+async def aread(after, operator_id=None, limit=100, wait=0):
+    # async variant of read, the commit notification is checked between
+    # short sleeps since a Condition would block the event loop
+    deadline = time.monotonic() + wait
+    while True:
+        seen = _generation
+        events = [event async for event in _events(after, operator_id, limit)]
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        poll_until = time.monotonic() + min(remaining, settings.FEED_POLL_SECONDS)
+        while _generation == seen and time.monotonic() < poll_until:
+            await asyncio.sleep(0.05)
+
+
+def _message(event):
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(as_dict(event))}\n\n"
+
+
+def stream(after, operator_id=None, limit=100):
+    # Server-Sent Events from the offset, the client reconnects with the last
+    # id it saw in Last-Event-ID. Every second of the stream holds a WSGI
+    # worker, so it ends after FEED_SYNC_STREAM_SECONDS, long streams are
+    # served by astream under ASGI
+    deadline = time.monotonic() + min(settings.FEED_SYNC_STREAM_SECONDS, settings.FEED_STREAM_SECONDS)
+    yield "retry: 1000\n\n"
+    while time.monotonic() < deadline:
+        wait = min(settings.FEED_HEARTBEAT_SECONDS, deadline - time.monotonic())
+        events = read(after, operator_id, limit, wait)
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            yield _message(event)
+        after = events[-1].id
+
+
+async def astream(after, operator_id=None, limit=100):
+    # the stream of the ASGI feed, it waits on the event loop and runs for
+    # FEED_STREAM_SECONDS
+    deadline = time.monotonic() + settings.FEED_STREAM_SECONDS
+    yield "retry: 1000\n\n"
+    while time.monotonic() < deadline:
+        wait = min(settings.FEED_HEARTBEAT_SECONDS, deadline - time.monotonic())
+        events = await aread(after, operator_id, limit, wait)
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for event in events:
+            yield _message(event)
+        after = events[-1].id
@@ -0,0 +1,70 @@
+import csv
+import json
+
+from .models import Booking, BookingArchive
+
+EXPORT_FIELDS = (
+    "booking_id",
+    "operator_id",
+    "status",
+    "booking_date",
+    "start_time",
+    "end_time",
+    "is_rescheduled",
+    "is_cancelled",
+    "timestamp",
+)
+CHUNK_SIZE = 2000
+
+
+def export_querysets(operator_id=None, start_date=None, end_date=None, status=None, include_archived=False):
+    # the hot bookings, followed by the archived ones when asked for
+    models = [Booking, BookingArchive] if include_archived else [Booking]
+    querysets = []
+    for model in models:
+        bookings = model.objects.all()
+        if operator_id is not None:
+            bookings = bookings.filter(operator_id=operator_id)
+        if start_date:
+            bookings = bookings.filter(booking_date__gte=start_date)
+        if end_date:
+            bookings = bookings.filter(booking_date__lte=end_date)
+        if status:
+            bookings = bookings.filter(status=status)
+        querysets.append(bookings.order_by("booking_id"))
+    return querysets
+
+
+def iter_rows(querysets, chunk_size=CHUNK_SIZE):
+    # server-side cursor where the backend has one, rows are fetched
+    # chunk_size at a time and never cached on the queryset
+    for bookings in querysets:
+        yield from bookings.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def ndjson_lines(rows):
+    # ids are 64-bit integers, like the API they are written as strings
+    for row in rows:
+        row = dict(zip(EXPORT_FIELDS, row))
+        row["booking_id"] = str(row["booking_id"])
+        row["operator_id"] = str(row["operator_id"])
+        yield json.dumps(row, default=str) + "\n"
+
+
+class _Line:
+    # csv.writer target that hands back the formatted line
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
@@ -0,0 +1,165 @@
+import functools
+import re
+from datetime import date, time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.validators import (MaxLengthValidator, MaxValueValidator, MinValueValidator,
+                                    ProhibitNullCharactersValidator)
+from rest_framework import ISO_8601, serializers
+from rest_framework.utils import html
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from . import ids
+from .serializer import IdField
+
+# precompiled validation for the hot booking and availability requests. The
+# fields of a serializer are compiled once into converters, a well formed
+# request is checked with a few regular expressions and turned into native
+# values in one pass. Anything else (other date and time formats, blanks,
+# wrong types, failed rules) returns None and goes through the serializer,
+# which stays the source of the error responses and of the OpenAPI schema.
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TIME = re.compile(r"(\d{2}):(\d{2}):(\d{2})")
+_INTEGER = re.compile(r"\d{1,19}")
+_MISSING = object()
+
+
+def _id_field(field):
+    # printable ascii without blanks, which passes the trimming, length and
+    # character checks of CharField unchanged
+    pattern = re.compile(rf"[!-~]{{1,{field.max_length}}}")
+
+    def convert(value):
+        if type(value) is not str or not pattern.fullmatch(value):
+            raise ValueError(value)
+        parsed = ids.parse(value)
+        return value if parsed is None else parsed
+    return convert
+
+
+def _date_field(field):
+    def convert(value):
+        if type(value) is not str or not _DATE.fullmatch(value):
+            raise ValueError(value)
+        return date.fromisoformat(value)
+    return convert
+
+
+def _time_field(field):
+    def convert(value):
+        match = type(value) is str and _TIME.fullmatch(value)
+        if not match:
+            raise ValueError(value)
+        hour, minute, second = match.groups()
+        return time(int(hour), int(minute), int(second))
+    return convert
+
+
+def _boolean_field(field):
+    true_values, false_values = field.TRUE_VALUES, field.FALSE_VALUES
+
+    def convert(value):
+        if value in true_values:
+            return True
+        if value in false_values:
+            return False
+        raise ValueError(value)
+    return convert
+
+
+def _integer_field(field):
+    # the bounds are the only validators of an IntegerField
+    low = -float("inf") if field.min_value is None else field.min_value
+    high = float("inf") if field.max_value is None else field.max_value
+
+    def convert(value):
+        if type(value) is str and _INTEGER.fullmatch(value):
+            value = int(value)
+        elif type(value) is not int:
+            raise ValueError(value)
+        if not low <= value <= high:
+            raise ValueError(value)
+        return value
+    return convert
+
+
+def _choice_field(field):
+    choices = field.choice_strings_to_values
+
+    def convert(value):
+        if type(value) is not str or value not in choices:
+            raise ValueError(value)
+        return choices[value]
+    return convert
+
+
+_CONVERTERS = {
+    IdField: _id_field,
+    serializers.DateField: _date_field,
+    serializers.TimeField: _time_field,
+    serializers.BooleanField: _boolean_field,
+    serializers.ChoiceField: _choice_field,
+    serializers.IntegerField: _integer_field,
+}
+
+# the validators DRF adds itself, which the converters check
+_VALIDATORS = {
+    IdField: {MaxLengthValidator, ProhibitNullCharactersValidator, ProhibitSurrogateCharactersValidator},
+    serializers.IntegerField: {MaxValueValidator, MinValueValidator},
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(serializer_class):
+    # (fields, serializer) where fields are (field, converter) pairs. Fields
+    # the converters do not reproduce exactly are refused, so a new field
+    # cannot silently change the contract.
+    serializer = serializer_class()
+    if serializer.validators:
+        raise ImproperlyConfigured(f"{serializer_class.__name__} has validators the fast path does not run")
+    fields = []
+    for name, field in serializer.fields.items():
+        make = _CONVERTERS.get(type(field))
+        date_formats = getattr(field, "input_formats", None)
+        if (
+            make is None
+            or field.source != name
+            or field.allow_null
+            or date_formats not in (None, [ISO_8601])
+            or getattr(field, "min_length", None) is not None
+            or not {type(validator) for validator in field.validators} <= _VALIDATORS.get(type(field), set())
+            or hasattr(serializer, f"validate_{name}")
+        ):
+            raise ImproperlyConfigured(f"{serializer_class.__name__}.{name} is not supported by the fast path")
+        fields.append((field, make(field)))
+    return tuple(fields), serializer
+
+
+def validate(serializer_class, data):
+    # the validated data of a well formed request, None when the serializer
+    # has to decide
+    fields, serializer = compiled(serializer_class)
+    if not isinstance(data, dict):
+        return None
+    # missing form and query fields take default_empty_html like in DRF,
+    # which makes an absent boolean False
+    form = html.is_html_input(data)
+    validated = {}
+    try:
+        for field, convert in fields:
+            value = data.get(field.field_name, _MISSING)
+            if value is _MISSING:
+                if form and field.default_empty_html is not serializers.empty:
+                    value = field.default_empty_html
+                elif field.default is not serializers.empty:
+                    validated[field.field_name] = field.get_default()
+                    continue
+                elif field.required:
+                    return None
+                else:
+                    continue
+            validated[field.field_name] = convert(value)
+        return serializer.validate(validated)
+    except (ValueError, TypeError, serializers.ValidationError):
+        return None
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+# write requests that carry an Idempotency-Key run once. The completed
+# response is kept for IDEMPOTENCY_TTL seconds and a retry with the same key,
+# method and path is answered from the cache without running the view again.
+# The first request holds an in-flight marker taken with cache.add, duplicates
+# that arrive meanwhile poll for its response instead of running in parallel.
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+
+_lock = threading.Lock()
+_stats = {"stored": 0, "replayed": 0, "waited": 0, "rejected": 0}
+
+
+def _cache():
+    return caches[settings.IDEMPOTENCY_CACHE_ALIAS]
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _error(code, message):
+    _count("rejected")
+    return JsonResponse({"sCode": code, "message": message}, status=code)
+
+
+class Claim:
+    def __init__(self, request, key):
+        digest = hashlib.sha256(f"{request.method} {request.path} {key}".encode()).hexdigest()
+        self.response_key = f"idempotency:response:{digest}"
+        self.marker_key = f"idempotency:inflight:{digest}"
+        # a key reused for a different body is refused rather than replayed
+        self.fingerprint = hashlib.sha256(request.body).hexdigest()
+        self.waited = False
+
+    def answer(self, stored):
+        if stored["fingerprint"] != self.fingerprint:
+            return _error(422, "Idempotency-Key was already used for a different request")
+        _count("replayed")
+        response = HttpResponse(stored["content"], status=stored["status"], content_type=stored["content_type"])
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    def check(self, stored, marker):
+        # called when another request holds the key, returns the response to
+        # send instead of running the view or None to keep waiting
+        if stored is not None:
+            return self.answer(stored)
+        if marker is not None and marker != self.fingerprint:
+            return _error(422, "Idempotency-Key was already used for a different request")
+        if not self.waited:
+            self.waited = True
+            _count("waited")
+        return None
+
+    def timed_out(self):
+        return _error(409, "A request with this Idempotency-Key is still in progress")
+
+    def record(self, response):
+        # stores a completed response, server errors and streams are not kept
+        # so that the retry runs again
+        if response.status_code < 500 and not response.streaming:
+            return {
+                "fingerprint": self.fingerprint,
+                "status": response.status_code,
+                "content": response.content,
+                "content_type": response["Content-Type"],
+            }
+        return None
+
+    def run(self, request, get_response):
+        cache = _cache()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            stored = cache.get(self.response_key)
+            if stored is not None:
+                return self.answer(stored)
+            if cache.add(self.marker_key, self.fingerprint, timeout=settings.IDEMPOTENCY_LOCK_SECONDS):
+                # the first request may have finished between the two calls
+                stored = cache.get(self.response_key)
+                if stored is not None:
+                    cache.delete(self.marker_key)
+                    return self.answer(stored)
+                break
+            response = self.check(cache.get(self.response_key), cache.get(self.marker_key))
+            if response is not None:
+                return response
+            if time.monotonic() >= deadline:
+                return self.timed_out()
+            time.sleep(POLL_SECONDS)
+        try:
+            response = get_response(request)
+            stored = self.record(response)
+            if stored is not None:
+                cache.set(self.response_key, stored, timeout=settings.IDEMPOTENCY_TTL)
+                _count("stored")
+        finally:
+            cache.delete(self.marker_key)
+        return response
+
+    async def arun(self, request, get_response):
+        # async variant of run
+        cache = _cache()
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            stored = await cache.aget(self.response_key)
+            if stored is not None:
+                return self.answer(stored)
+            if await cache.aadd(self.marker_key, self.fingerprint, timeout=settings.IDEMPOTENCY_LOCK_SECONDS):
+                stored = await cache.aget(self.response_key)
+                if stored is not None:
+                    await cache.adelete(self.marker_key)
+                    return self.answer(stored)
+                break
+            response = self.check(await cache.aget(self.response_key), await cache.aget(self.marker_key))
+            if response is not None:
+                return response
+            if time.monotonic() >= deadline:
+                return self.timed_out()
+            await asyncio.sleep(POLL_SECONDS)
+        try:
+            response = await get_response(request)
+            stored = self.record(response)
+            if stored is not None:
+                await cache.aset(self.response_key, stored, timeout=settings.IDEMPOTENCY_TTL)
+                _count("stored")
+        finally:
+            await cache.adelete(self.marker_key)
+        return response
+
+
+def claim(request):
+    # (claim, None) for a usable key, (None, error response) for a bad one
+    key = request.headers.get(HEADER, "")
+    if not key.strip() or len(key) > MAX_KEY_LENGTH:
+        return None, _error(400, f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters")
+    return Claim(request, key), None
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # no file locks on Windows, development uses the pid
+    fcntl = None
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# 64-bit snowflake style identifiers: 41 bits of milliseconds since EPOCH_MS,
+# 10 bits of worker id and a 12 bit sequence within the millisecond. New ids
+# grow with time, so inserts append to the end of the primary key index.
+# Clients see them as decimal strings, 19 digits at most.
+
+EPOCH_MS = 1672531200000  # 2023-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_ID = (1 << 63) - 1
+# an insert that hits an existing primary key is tried with a new id, this
+# many times in all
+ID_ATTEMPTS = 3
+
+
+def compose(timestamp_ms, worker, sequence):
+    return ((timestamp_ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker << SEQUENCE_BITS) | sequence
+
+
+def timestamp_ms(value):
+    # creation time of an id, milliseconds since the unix epoch
+    return (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+class Generator:
+    def __init__(self, worker):
+        if not 0 <= worker <= MAX_WORKER:
+            raise ValueError(f"worker id must be between 0 and {MAX_WORKER}")
+        self.worker = worker
+        self.last_ms = 0
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            now = time.time_ns() // 1_000_000
+            # a clock that steps back keeps using the last millisecond
+            if now <= self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # 4096 ids in one millisecond, borrow the next one
+                    self.last_ms += 1
+            else:
+                self.last_ms = now
+                self.sequence = 0
+            return compose(self.last_ms, self.worker, self.sequence)
+
+
+def check_settings():
+    # worker ids taken from the pid can collide, the multi-process
+    # production profile leases them in ID_WORKER_DIR
+    if not settings.ID_WORKER_DIR:
+        if settings.SQLITE_PRODUCTION:
+            raise ImproperlyConfigured("ID_WORKER_DIR must be set with SQLITE_PRODUCTION")
+    elif fcntl is None:
+        raise ImproperlyConfigured("ID_WORKER_DIR needs the file locks of the fcntl module")
+
+
+def lease_worker(directory):
+    # locks the file of a free worker id in directory and returns the id and
+    # the open file. The lock lasts as long as the file is open by this
+    # process, or a process forked from it, and goes away when they exit, so
+    # no two live processes on the host hold the same worker id.
+    os.makedirs(directory, exist_ok=True)
+    first = os.getpid() & MAX_WORKER
+    for offset in range(MAX_WORKER + 1):
+        worker = (first + offset) & MAX_WORKER
+        lease = open(os.path.join(directory, f"{worker}.lock"), "a")
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lease.close()
+            continue
+        return worker, lease
+    raise RuntimeError(f"all {MAX_WORKER + 1} worker ids in {directory} are taken")
+
+
+_generator = None
+_generator_lock = threading.Lock()
+_lease = None
+
+
+def next_id():
+    global _generator, _lease
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                if settings.ID_WORKER_DIR:
+                    worker, _lease = lease_worker(settings.ID_WORKER_DIR)
+                else:
+                    # development only, see check_settings
+                    worker = os.getpid() & MAX_WORKER
+                _generator = Generator(worker)
+    return _generator.next_id()
+
+
+def _forget_generator():
+    # a forked child leases its own worker id. Closing its copy of the
+    # parent's lease file leaves the parent's lock in place, the lock only
+    # goes away when every copy is closed.
+    global _generator, _generator_lock, _lease
+    if _lease is not None:
+        _lease.close()
+    _generator = None
+    _generator_lock = threading.Lock()
+    _lease = None
+
+
+os.register_at_fork(after_in_child=_forget_generator)
+
+
+def parse(value):
+    # the integer id of a decimal string, None for anything else, which
+    # covers the 24+ digit ids issued before this scheme
+    value = str(value)
+    if not (value.isascii() and value.isdigit()) or len(value) > 19:
+        return None
+    value = int(value)
+    return value if value <= MAX_ID else None
+
+
+def resolve(model, value):
+    # the primary key for an id sent by a client, ids from before the
+    # snowflake scheme are found through the model's legacy_id column.
+    # An unknown legacy id resolves to None, which matches no row.
+    if isinstance(value, int):
+        return value
+    parsed = parse(value)
+    if parsed is not None:
+        return parsed
+    return model.objects.filter(legacy_id=value).values_list("pk", flat=True).first()
+
+
+async def aresolve(model, value):
+    # resolve for the async views, a legacy id is looked up with the async ORM
+    if isinstance(value, int):
+        return value
+    parsed = parse(value)
+    if parsed is not None:
+        return parsed
+    return await model.objects.filter(legacy_id=value).values_list("pk", flat=True).afirst()
+
+
+def resolve_many(model, values):
+    # maps every value to its primary key or None with at most one query
+    resolved = {}
+    legacy = set()
+    for value in values:
+        parsed = value if isinstance(value, int) else parse(value)
+        if parsed is None:
+            legacy.add(value)
+        resolved[value] = parsed
+    if legacy:
+        resolved.update(model.objects.filter(legacy_id__in=legacy).values_list("legacy_id", "pk"))
+    return resolved
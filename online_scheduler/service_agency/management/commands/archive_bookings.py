@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from service_agency.archive import AlreadyArchived, archive_chunk, archive_condition, prune_events_chunk
+from service_agency.models import Booking, BookingEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves bookings of past days and long cancelled bookings from the "
+        "booking table to booking_archive in chunks. Each chunk is its own "
+        "transaction, an interrupted run is resumed by running it again. "
+        "Change feed events older than FEED_RETENTION_DAYS are deleted too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="archive bookings for days more than this many days ago")
+        parser.add_argument("--cancelled-older-than-days", type=int, default=settings.ARCHIVE_CANCELLED_AFTER_DAYS,
+                            help="archive cancelled bookings made more than this many days ago")
+        parser.add_argument("--events-older-than-days", type=int, default=settings.FEED_RETENTION_DAYS,
+                            help="delete change feed events recorded more than this many days ago")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="bookings moved per transaction")
+        parser.add_argument("--max-chunks", type=int, help="stop after this many chunks, the next run continues")
+        parser.add_argument("--dry-run", action="store_true", help="only count the bookings that would be moved")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        now = timezone.now()
+        condition = archive_condition(
+            now.date() - timedelta(days=options["older_than_days"]),
+            now - timedelta(days=options["cancelled_older_than_days"]),
+        )
+        events_before = now - timedelta(days=options["events_older_than_days"])
+        if options["dry_run"]:
+            self.stdout.write(f"{Booking.objects.filter(condition).count()} bookings would be archived")
+            self.stdout.write(f"{BookingEvent.objects.filter(timestamp__lt=events_before).count()} events would be deleted")
+            return
+
+        moved = chunks = 0
+        last = None
+        started = time.perf_counter()
+        while options["max_chunks"] is None or chunks < options["max_chunks"]:
+            try:
+                count, last = archive_chunk(condition, last, options["chunk_size"])
+            except AlreadyArchived as exc:
+                raise CommandError(f"{exc}, after archiving {moved} bookings. Resolve the duplicates and run again.")
+            if not count:
+                break
+            moved += count
+            chunks += 1
+            self.stdout.write(f"archived {moved} bookings, up to booking_id {last}")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"archived {moved} bookings in {chunks} chunks in {elapsed:.1f}s"))
+
+        deleted = 0
+        while True:
+            count = prune_events_chunk(events_before, options["chunk_size"])
+            if not count:
+                break
+            deleted += count
+        self.stdout.write(self.style.SUCCESS(f"deleted {deleted} change feed events"))
@@ -0,0 +1,178 @@
+import json
+import platform
+import random
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from service_agency.availability import ALL_SLOTS
+from service_agency.benchmarking import seed, summarize, test_database
+
+DEFAULT_MIX = "read=70,book=15,reschedule=8,cancel=7"
+OPERATIONS = ("read", "range", "search", "book", "reschedule", "cancel")
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway database and drives a mix of booking API calls "
+        "through the agency/ URLs, reporting throughput and latency "
+        "percentiles per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operators", type=int, default=100, help="operators to seed")
+        parser.add_argument("--days", type=int, default=14, help="days of bookings to seed, ending today")
+        parser.add_argument("--density", type=float, default=0.3, help="share of seeded slots that are booked")
+        parser.add_argument("--requests", type=int, default=5000, help="measured requests")
+        parser.add_argument("--warmup", type=int, default=200, help="requests run before measuring")
+        parser.add_argument("--mix", default=DEFAULT_MIX,
+                            help=f"operation weights, operations are {', '.join(OPERATIONS)}")
+        parser.add_argument("--seed", type=int, default=1, help="random seed, equal seeds give equal runs")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options["mix"])
+        with test_database():
+            rng = random.Random(options["seed"])
+            started = time.perf_counter()
+            operator_ids, dates, booking_ids = seed(rng, options["operators"], options["days"], options["density"])
+            seed_seconds = time.perf_counter() - started
+
+            run = Run(Client(), rng, operator_ids, dates, booking_ids)
+            for _ in range(options["warmup"]):
+                run.step(mix)
+            run.reset_timings()
+
+            started = time.perf_counter()
+            for _ in range(options["requests"]):
+                run.step(mix)
+            elapsed = time.perf_counter() - started
+
+        endpoints = {name: summarize(latencies, elapsed) for name, latencies in sorted(run.latencies.items())}
+        total = summarize([value for latencies in run.latencies.values() for value in latencies], elapsed)
+
+        self.stdout.write(f"seeded {len(operator_ids)} operators, {len(dates)} days, {len(booking_ids)} bookings "
+                          f"in {seed_seconds:.1f}s")
+        self.stdout.write(f"{'endpoint':<12}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, row in list(endpoints.items()) + [("total", total)]:
+            self.stdout.write(
+                f"{name:<12}{row['requests']:>10}{row['throughput_rps']:>10.1f}"
+                f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            )
+
+        if options["output"]:
+            result = {
+                "options": {key: options[key] for key in ("operators", "days", "density", "requests", "warmup", "seed")},
+                "mix": mix,
+                "environment": {
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "database": connection.vendor,
+                },
+                "elapsed_seconds": elapsed,
+                "endpoints": endpoints,
+                "total": total,
+                "status_codes": {name: dict(sorted(codes.items())) for name, codes in sorted(run.status_codes.items())},
+            }
+            with open(options["output"], "w") as output:
+                json.dump(result, output, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(","):
+            name, _, weight = part.partition("=")
+            name = name.strip()
+            if name not in OPERATIONS:
+                raise CommandError(f"unknown operation {name!r} in --mix")
+            try:
+                mix[name] = float(weight)
+            except ValueError:
+                raise CommandError(f"invalid weight {weight!r} for {name} in --mix")
+        if not sum(mix.values()) > 0:
+            raise CommandError("--mix needs at least one positive weight")
+        return mix
+
+
+class Run:
+    # issues one request per step and keeps track of the bookings it can
+    # still reschedule or cancel
+
+    def __init__(self, client, rng, operator_ids, dates, booking_ids):
+        self.client = client
+        self.rng = rng
+        self.operator_ids = operator_ids
+        self.dates = dates
+        self.booking_ids = list(booking_ids)
+        self.reset_timings()
+
+    def reset_timings(self):
+        self.latencies = {}
+        self.status_codes = {}
+
+    def step(self, mix):
+        operation = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        if operation in ("reschedule", "cancel") and not self.booking_ids:
+            operation = "book"
+        request = getattr(self, operation)()
+        begin = time.perf_counter()
+        response = request()
+        latency = time.perf_counter() - begin
+        self.latencies.setdefault(operation, []).append(latency)
+        codes = self.status_codes.setdefault(operation, {})
+        codes[str(response.status_code)] = codes.get(str(response.status_code), 0) + 1
+        if operation == "book" and response.status_code == 200:
+            self.booking_ids.append(response.json()["booking_id"])
+
+    def slot(self):
+        start_time, end_time = self.rng.choice(ALL_SLOTS).split("-")
+        return start_time, end_time
+
+    def read(self):
+        params = {
+            "operator_id": self.rng.choice(self.operator_ids),
+            "booking_date": str(self.rng.choice(self.dates)),
+            "view_booked_slots": self.rng.choice(["true", "false"]),
+        }
+        return lambda: self.client.get("/agency/slot_booking", params)
+
+    def range(self):
+        params = {
+            "operator_id": self.rng.choice(self.operator_ids),
+            "start_date": str(min(self.dates)),
+            "end_date": str(max(self.dates)),
+            "view_booked_slots": "false",
+        }
+        return lambda: self.client.get("/agency/slot_booking", params)
+
+    def search(self):
+        start_time, end_time = self.slot()
+        params = {"booking_date": str(self.rng.choice(self.dates)), "slot": f"{start_time}-{end_time}"}
+        return lambda: self.client.get("/agency/operator/available", params)
+
+    def book(self):
+        start_time, end_time = self.slot()
+        payload = {
+            "operator_id": self.rng.choice(self.operator_ids),
+            "booking_date": str(self.rng.choice(self.dates)),
+            "start_time": start_time,
+            "end_time": end_time,
+        }
+        return lambda: self.client.post("/agency/slot_booking", payload, content_type="application/json")
+
+    def reschedule(self):
+        start_time, end_time = self.slot()
+        payload = {
+            "booking_id": self.rng.choice(self.booking_ids),
+            "booking_date": str(self.rng.choice(self.dates)),
+            "start_time": start_time,
+            "end_time": end_time,
+        }
+        return lambda: self.client.patch("/agency/slot_booking", payload, content_type="application/json")
+
+    def cancel(self):
+        booking_id = self.booking_ids.pop(self.rng.randrange(len(self.booking_ids)))
+        return lambda: self.client.delete(f"/agency/cancel_booking/{booking_id}")
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+
+from service_agency.availability import ALL_SLOTS
+from service_agency.benchmarking import reset, seed, summarize, test_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares throughput of the WSGI handler and the ASGI handler, which "
+        "serves the async views on the same paths, on one worker with the same "
+        "workload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operators", type=int, default=50)
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--density", type=float, default=0.3)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=32,
+                            help="requests kept in flight by the ASGI worker")
+        parser.add_argument("--write-ratio", type=float, default=0.2)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        results = {}
+        # a production profile sqlite file, the ASGI worker writes from
+        # several threads at once
+        with test_database("production"):
+            for mode in ("wsgi", "asgi"):
+                # every mode gets the same freshly seeded database and workload
+                reset()
+                rng = random.Random(options["seed"])
+                operator_ids, dates, _ = seed(rng, options["operators"], options["days"], options["density"])
+                workload = self.workload(rng, operator_ids, dates, options)
+                if mode == "wsgi":
+                    results[mode] = self.run_wsgi(workload)
+                else:
+                    results[mode] = asyncio.run(self.run_asgi(workload, options["concurrency"]))
+                row = results[mode]
+                self.stdout.write(
+                    f"{mode}: {row['throughput_rps']:.1f} req/s  p50 {row['p50_ms']:.2f} ms  "
+                    f"p95 {row['p95_ms']:.2f} ms  p99 {row['p99_ms']:.2f} ms"
+                )
+        self.stdout.write(f"asgi/wsgi throughput: {results['asgi']['throughput_rps'] / results['wsgi']['throughput_rps']:.2f}x")
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump({"options": {k: options[k] for k in ("operators", "days", "density", "requests",
+                                                                 "concurrency", "write_ratio", "seed")},
+                           "results": results}, output, indent=2)
+
+    def workload(self, rng, operator_ids, dates, options):
+        # (method, path suffix, payload) tuples, paths are relative to agency/
+        requests = []
+        for _ in range(options["requests"]):
+            operator_id = rng.choice(operator_ids)
+            booking_date = str(rng.choice(dates))
+            if rng.random() < options["write_ratio"]:
+                start_time, end_time = rng.choice(ALL_SLOTS).split("-")
+                payload = {
+                    "operator_id": operator_id,
+                    "booking_date": booking_date,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                }
+                requests.append(("post", "slot_booking", payload))
+            else:
+                payload = {
+                    "operator_id": operator_id,
+                    "booking_date": booking_date,
+                    "view_booked_slots": rng.choice(["true", "false"]),
+                }
+                requests.append(("get", "slot_booking", payload))
+        return requests
+
+    def run_wsgi(self, workload):
+        client = Client()
+        latencies = []
+        started = time.perf_counter()
+        for method, path, payload in workload:
+            begin = time.perf_counter()
+            if method == "get":
+                client.get(f"/agency/{path}", payload)
+            else:
+                client.post(f"/agency/{path}", payload, content_type="application/json")
+            latencies.append(time.perf_counter() - begin)
+        return summarize(latencies, time.perf_counter() - started)
+
+    async def run_asgi(self, workload, concurrency):
+        client = AsyncClient()
+        latencies = []
+        pending = iter(workload)
+
+        async def worker():
+            for method, path, payload in pending:
+                begin = time.perf_counter()
+                if method == "get":
+                    await client.get(f"/agency/{path}", payload)
+                else:
+                    await client.post(f"/agency/{path}", payload, content_type="application/json")
+                latencies.append(time.perf_counter() - begin)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(latencies, time.perf_counter() - started)
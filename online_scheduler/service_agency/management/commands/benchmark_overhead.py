@@ -0,0 +1,139 @@
+import json
+import platform
+import timeit
+from datetime import date, timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from rest_framework.renderers import JSONRenderer
+
+from service_agency import fastpath, ids
+from service_agency.renderers import FastJSONRenderer, orjson
+from service_agency.serializer import (AvailableOperatorsSerializer, BookingDataSerializer, RescheduleSerializer,
+                                       ViewBookingSerializer)
+from service_agency.slots import booked_slots, free_slots, interval_bits
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmarks the per-request framework overhead of the hot "
+        "endpoints: request validation through the DRF serializers against "
+        "the compiled validators of fastpath.py, and response rendering "
+        "through the stock JSON renderer against FastJSONRenderer. Fails when "
+        "the two paths disagree on a validated request or rendered body."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000, help="calls per timing run")
+        parser.add_argument("--repeat", type=int, default=5, help="timing runs, the fastest counts")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options["iterations"] < 1 or options["repeat"] < 1:
+            raise CommandError("--iterations and --repeat must be positive")
+
+        results = {}
+        for name, (serializer_class, data, body) in cases().items():
+            expected = validate_with_serializer(serializer_class, data)
+            if fastpath.validate(serializer_class, data) != expected:
+                raise CommandError(f"{name}: the fast path validates the request differently")
+            if FastJSONRenderer().render(body) != JSONRenderer().render(body):
+                raise CommandError(f"{name}: FastJSONRenderer renders the response differently")
+
+            def before():
+                validate_with_serializer(serializer_class, data)
+                JSONRenderer().render(body)
+
+            def after():
+                fastpath.validate(serializer_class, data)
+                FastJSONRenderer().render(body)
+
+            row = {
+                "validate_before_us": measure(lambda: validate_with_serializer(serializer_class, data), options),
+                "validate_after_us": measure(lambda: fastpath.validate(serializer_class, data), options),
+                "render_before_us": measure(lambda: JSONRenderer().render(body), options),
+                "render_after_us": measure(lambda: FastJSONRenderer().render(body), options),
+                "total_before_us": measure(before, options),
+                "total_after_us": measure(after, options),
+            }
+            row["speedup"] = row["total_before_us"] / row["total_after_us"]
+            results[name] = row
+
+        self.stdout.write(f"microseconds per request, best of {options['repeat']} x {options['iterations']} calls"
+                          f"{'' if orjson else ' (orjson not installed, rendering uses the stock encoder)'}")
+        self.stdout.write(f"{'request':<14}{'validate':>18}{'render':>18}{'total':>18}{'speedup':>9}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<14}"
+                f"{row['validate_before_us']:>9.1f} ->{row['validate_after_us']:>6.1f}"
+                f"{row['render_before_us']:>9.1f} ->{row['render_after_us']:>6.1f}"
+                f"{row['total_before_us']:>9.1f} ->{row['total_after_us']:>6.1f}"
+                f"{row['speedup']:>8.1f}x"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump({
+                    "options": {key: options[key] for key in ("iterations", "repeat")},
+                    "environment": {
+                        "python": platform.python_version(),
+                        "django": django.get_version(),
+                        "orjson": orjson.__version__ if orjson else None,
+                    },
+                    "requests": results,
+                }, output, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+
+def validate_with_serializer(serializer_class, data):
+    serializer = serializer_class(data=data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+def measure(function, options):
+    best = min(timeit.repeat(function, number=options["iterations"], repeat=options["repeat"]))
+    return best / options["iterations"] * 1e6
+
+
+def cases():
+    # (serializer, request data, response body) of typical small requests,
+    # query strings arrive as a QueryDict like request.GET
+    operator_id = str(ids.next_id())
+    booking_id = str(ids.next_id())
+    day = date(2023, 10, 16)
+    mask = interval_bits(540, 600) | interval_bits(780, 900)
+    return {
+        "book": (
+            BookingDataSerializer,
+            {"operator_id": operator_id, "booking_date": str(day), "start_time": "10:00:00", "end_time": "11:00:00"},
+            {"sCode": 200, "message": "Booking succesfully created", "booking_id": booking_id},
+        ),
+        "reschedule": (
+            RescheduleSerializer,
+            {"booking_id": booking_id, "booking_date": str(day), "start_time": "12:00:00", "end_time": "13:00:00"},
+            {"sCode": 200, "message": "Booking rescheduled successfully"},
+        ),
+        "availability": (
+            ViewBookingSerializer,
+            QueryDict(f"operator_id={operator_id}&booking_date={day}&view_booked_slots=false"),
+            {"sCode": 200, "message": f"Bookings for {day} for {operator_id}", "booking_date": day,
+             "slots": free_slots(mask)},
+        ),
+        "range": (
+            ViewBookingSerializer,
+            QueryDict(f"operator_id={operator_id}&start_date={day}&end_date={day + timedelta(days=6)}"
+                      f"&view_booked_slots=true"),
+            {"sCode": 200, "message": f"Bookings from {day} to {day + timedelta(days=6)} for {operator_id}",
+             "days": [{"booking_date": day + timedelta(days=offset), "slots": booked_slots(mask)}
+                      for offset in range(7)]},
+        ),
+        "available": (
+            AvailableOperatorsSerializer,
+            QueryDict(f"booking_date={day}&slot=10:00:00-11:00:00"),
+            {"sCode": 200, "message": f"Operators available on {day}",
+             "operators": [{"operator_id": str(ids.next_id()), "operator_name": f"operator {index}"}
+                           for index in range(20)]},
+        ),
+    }
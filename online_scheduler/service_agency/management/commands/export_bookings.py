@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from service_agency import exports, ids
+from service_agency.models import Operator
+
+
+class Command(BaseCommand):
+    help = "Streams bookings as NDJSON or CSV to a file or stdout, reading them in fixed size chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(exports.FORMATS), default="ndjson")
+        parser.add_argument("--output", help="file to write, stdout by default")
+        parser.add_argument("--operator", help="only bookings of this operator_id")
+        parser.add_argument("--start-date", help="only bookings on or after this date (YYYY-MM-DD)")
+        parser.add_argument("--end-date", help="only bookings on or before this date (YYYY-MM-DD)")
+        parser.add_argument("--status", choices=["booked", "cancelled"])
+        parser.add_argument("--include-archived", action="store_true", help="also export archived bookings")
+        parser.add_argument("--chunk-size", type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ("start_date", "end_date"):
+            value = options[name]
+            dates[name] = parse_date(value) if value else None
+            if value and dates[name] is None:
+                raise CommandError(f"--{name.replace('_', '-')} must be a date in YYYY-MM-DD format")
+        operator_id = None
+        if options["operator"]:
+            operator_id = ids.resolve(Operator, options["operator"])
+            if operator_id is None:
+                raise CommandError(f"operator {options['operator']} is not registered")
+        bookings = exports.export_querysets(
+            operator_id=operator_id,
+            status=options["status"],
+            include_archived=options["include_archived"],
+            **dates,
+        )
+        lines, _ = exports.FORMATS[options["format"]]
+        output = open(options["output"], "w", newline="") if options["output"] else self.stdout
+        count = 0
+        try:
+            for line in lines(exports.iter_rows(bookings, options["chunk_size"])):
+                output.write(line)
+                count += 1
+        finally:
+            if options["output"]:
+                output.close()
+        if options["output"]:
+            # the csv header is not a booking
+            self.stderr.write(f"exported {count - (options['format'] == 'csv')} bookings to {options['output']}")
@@ -0,0 +1,148 @@
+import csv
+import itertools
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from service_agency import ids
+from service_agency.bookings import create_bookings, generate_id
+from service_agency.models import Operator
+from service_agency.serializer import OperatorSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams operators and bookings from CSV or JSONL files into the "
+        "database in chunks. Operator rows have a name and an optional id, "
+        "booking rows have operator_id, booking_date, start_time, end_time "
+        "and an optional booking_id and status (booked or cancelled). Ids "
+        "that are not 64-bit integers are kept as legacy ids. "
+        "Rejected rows are written to a separate JSONL file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operators", help="CSV or JSONL file with operators, imported first")
+        parser.add_argument("--bookings", help="CSV or JSONL file with bookings")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="input format, taken from the file extension by default")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="rows validated and inserted per transaction")
+        parser.add_argument("--rejects", help="JSONL file for rejected rows, defaults to <input>.rejects.jsonl")
+
+    def handle(self, *args, **options):
+        if not options["operators"] and not options["bookings"]:
+            raise CommandError("give --operators, --bookings or both")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        if options["operators"]:
+            self.run(options["operators"], options, self.import_operators)
+        if options["bookings"]:
+            self.run(options["bookings"], options, self.import_bookings)
+
+    def run(self, path, options, import_chunk):
+        rejects_path = options["rejects"] or f"{path}.rejects.jsonl"
+        imported = rejected = 0
+        started = time.perf_counter()
+        with open(path, newline="") as source, open(rejects_path, "a") as rejects:
+            rows = self.read_rows(source, options["format"] or self.guess_format(path))
+            while True:
+                chunk = list(itertools.islice(rows, options["chunk_size"]))
+                if not chunk:
+                    break
+                # rows that could not be parsed are rejected before validation
+                parsed = [(line, row) for line, row, error in chunk if error is None]
+                failed = [(line, row, error) for line, row, error in chunk if error is not None]
+                failed += import_chunk(parsed)
+                for line, row, error in failed:
+                    rejects.write(json.dumps({"line": line, "row": row, "errors": error}, default=str) + "\n")
+                rejected += len(failed)
+                imported += len(chunk) - len(failed)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{path}: {imported + rejected} rows, {imported} imported, {rejected} rejected, "
+                                  f"{(imported + rejected) / elapsed:.0f} rows/s")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{path}: imported {imported} rows, rejected {rejected} rows in {elapsed:.1f}s "
+            f"({(imported + rejected) / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+        if rejected:
+            self.stdout.write(f"rejected rows written to {rejects_path}")
+
+    def guess_format(self, path):
+        if path.endswith(".csv"):
+            return "csv"
+        if path.endswith((".jsonl", ".ndjson")):
+            return "jsonl"
+        raise CommandError(f"can not tell the format of {path}, pass --format")
+
+    def read_rows(self, source, file_format):
+        # yields (line number, row, parse error) one row at a time
+        if file_format == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, {key: value for key, value in row.items() if value not in (None, "")}, None
+            return
+        for line, text in enumerate(source, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as exc:
+                yield line, text.rstrip("\n"), f"invalid JSON: {exc}"
+                continue
+            if not isinstance(row, dict):
+                yield line, row, "row must be a JSON object"
+                continue
+            yield line, row, None
+
+    def import_bookings(self, parsed):
+        results = create_bookings([row for _, row in parsed], keep_ids=True)
+        return [
+            (line, row, result["message"])
+            for (line, row), result in zip(parsed, results)
+            if result["sCode"] != 200
+        ]
+
+    def import_operators(self, parsed):
+        failed = []
+        operators = []
+        for line, row in parsed:
+            serializer = OperatorSerializer(data=row)
+            if not serializer.is_valid():
+                failed.append((line, row, serializer.errors))
+                continue
+            given_id = str(row.get("id") or "") or None
+            operator_id = ids.parse(given_id) if given_id else None
+            legacy_id = given_id if given_id and operator_id is None else None
+            operators.append((line, row, Operator(
+                id=operator_id if operator_id is not None else generate_id(),
+                legacy_id=legacy_id,
+                operator_name=serializer.validated_data["name"],
+            )))
+
+        # duplicates against the database are found with three queries per chunk
+        with transaction.atomic():
+            taken_ids = set(Operator.objects.filter(
+                id__in=[operator.id for _, _, operator in operators]
+            ).values_list("id", flat=True))
+            taken_legacy_ids = set(Operator.objects.filter(
+                legacy_id__in=[operator.legacy_id for _, _, operator in operators if operator.legacy_id]
+            ).values_list("legacy_id", flat=True))
+            taken_names = set(Operator.objects.filter(
+                operator_name__in=[operator.operator_name for _, _, operator in operators]
+            ).values_list("operator_name", flat=True))
+            new_operators = []
+            for line, row, operator in operators:
+                if operator.id in taken_ids or operator.legacy_id in taken_legacy_ids:
+                    failed.append((line, row, "Operator id already exists"))
+                elif operator.operator_name in taken_names:
+                    failed.append((line, row, "Operator already exists"))
+                else:
+                    taken_ids.add(operator.id)
+                    if operator.legacy_id:
+                        taken_legacy_ids.add(operator.legacy_id)
+                    taken_names.add(operator.operator_name)
+                    new_operators.append(operator)
+            Operator.objects.bulk_create(new_operators, batch_size=1000)
+        return failed
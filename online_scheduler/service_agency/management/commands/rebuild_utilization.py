@@ -0,0 +1,71 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from service_agency import ids, utilization
+from service_agency.models import Booking, BookingArchive, Operator
+from service_agency.slots import booking_interval
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the operator_utilization rows from the active bookings, "
+        "archived ones included, a chunk of operators per transaction, and "
+        "reports how many stored rows had drifted. An interrupted run is "
+        "resumed with --after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=100, help="operators rebuilt per transaction")
+        parser.add_argument("--operator", help="rebuild only this operator")
+        parser.add_argument("--after", type=int, help="start after this operator id")
+        parser.add_argument("--dry-run", action="store_true", help="only count the rows that differ")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        operator_ids = Operator.objects.order_by("id").values_list("id", flat=True)
+        if options["operator"]:
+            operator_id = ids.resolve(Operator, options["operator"])
+            if operator_id is None:
+                raise CommandError(f"unknown operator {options['operator']}")
+            operator_ids = operator_ids.filter(id=operator_id)
+
+        rebuilt = drift = 0
+        last = options["after"]
+        started = time.perf_counter()
+        while True:
+            chunk = operator_ids if last is None else operator_ids.filter(id__gt=last)
+            chunk = list(chunk[:options["chunk_size"]])
+            if not chunk:
+                break
+            # the bookings are read and the rows replaced in one transaction,
+            # writes of the chunk's operators wait for it
+            with transaction.atomic():
+                drift += utilization.replace(chunk, booked_minutes(chunk))
+                if options["dry_run"]:
+                    transaction.set_rollback(True)
+            rebuilt += len(chunk)
+            last = chunk[-1]
+            self.stdout.write(f"rebuilt {rebuilt} operators, up to operator {last}")
+
+        elapsed = time.perf_counter() - started
+        verb = "would correct" if options["dry_run"] else "corrected"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {drift} utilization rows of {rebuilt} operators in {elapsed:.1f}s"
+        ))
+
+
+def booked_minutes(operator_ids):
+    # {(operator_id, date): booked minutes} of the operators' active bookings
+    minutes = Counter()
+    for model in (Booking, BookingArchive):
+        rows = model.objects.filter(operator_id__in=operator_ids, status="booked").values_list(
+            "operator_id", "booking_date", "start_time", "end_time"
+        )
+        for operator_id, booking_date, start_time, end_time in rows.iterator():
+            start, end = booking_interval(start_time, end_time)
+            minutes[operator_id, booking_date] += end - start
+    return minutes
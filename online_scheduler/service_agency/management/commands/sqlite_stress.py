@@ -0,0 +1,186 @@
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+from service_agency import ids, utilization
+from service_agency.benchmarking import file_database, summarize
+from service_agency.bookings import cancel_booking, insert_booking, move_booking
+from service_agency.models import Booking, Operator, OperatorAvailability, OperatorUtilization
+from service_agency.slots import booking_interval, interval_bits, slot_minutes, slot_starts, to_time
+
+PROFILES = ("default", "production")
+
+
+class Command(BaseCommand):
+    help = (
+        "Forks writer processes that book, reschedule and cancel against one "
+        "sqlite file and reports write throughput, latency and \"database is "
+        "locked\" errors for the stock sqlite settings and for the production "
+        "profile (SQLITE_PRODUCTION_PROFILE). Fails when the production "
+        "profile sees lock errors or the availability masks and utilization "
+        "aggregates do not match the bookings afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8, help="writer processes")
+        parser.add_argument("--operations", type=int, default=200, help="writes per worker")
+        parser.add_argument("--operators", type=int, default=4,
+                            help="operators the writers share, fewer means more contention")
+        parser.add_argument("--days", type=int, default=30, help="days the bookings are spread over")
+        parser.add_argument("--profile", choices=PROFILES + ("both",), default="both")
+        parser.add_argument("--seed", type=int, default=1, help="random seed, equal seeds give equal workloads")
+        parser.add_argument("--output", help="write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise CommandError("sqlite_stress forks its writers, which this platform does not support")
+        for name in ("workers", "operations", "operators", "days"):
+            if options[name] < 1:
+                raise CommandError(f"--{name} must be positive")
+        profiles = PROFILES if options["profile"] == "both" else (options["profile"],)
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in profiles:
+                with file_database(profile, os.path.join(directory, f"{profile}.sqlite3")):
+                    results[profile] = self.run(options)
+
+        self.stdout.write(f"{options['workers']} workers x {options['operations']} writes on "
+                          f"{options['operators']} operators and {options['days']} days")
+        self.stdout.write(f"{'profile':<12}{'writes':>8}{'ok':>8}{'rejected':>10}{'locked':>8}"
+                          f"{'ok/s':>10}{'p50 ms':>10}{'p99 ms':>10}  masks")
+        for profile, row in results.items():
+            self.stdout.write(
+                f"{profile:<12}{row['writes']:>8}{row['ok']:>8}{row['rejected']:>10}{row['locked']:>8}"
+                f"{row['ok_per_second']:>10.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}  "
+                f"{'consistent' if row['consistent'] else 'INCONSISTENT'}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump({
+                    "options": {key: options[key] for key in ("workers", "operations", "operators", "days", "seed")},
+                    "profiles": results,
+                }, output, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+        production = results.get("production")
+        if production and (production["locked"] or not production["consistent"]):
+            raise CommandError("the production profile lost writes to lock errors or left inconsistent masks or aggregates")
+
+    def run(self, options):
+        call_command("migrate", verbosity=0, interactive=False)
+        operator_ids = [ids.next_id() for _ in range(options["operators"])]
+        Operator.objects.bulk_create([Operator(id=operator_id, operator_name=f"operator {operator_id}")
+                                      for operator_id in operator_ids])
+        today = timezone.now().date()
+        dates = [today + timedelta(days=offset) for offset in range(options["days"])]
+        jobs = [(index, operator_ids, dates, options["operations"], options["seed"])
+                for index in range(options["workers"])]
+        # the writers open their own connections after the fork
+        connections.close_all()
+
+        with multiprocessing.get_context("fork").Pool(options["workers"]) as pool:
+            started = time.perf_counter()
+            outcomes = pool.map(stress_worker, jobs)
+            elapsed = time.perf_counter() - started
+
+        counts = {"ok": 0, "rejected": 0, "locked": 0}
+        latencies = []
+        for worker_latencies, worker_counts in outcomes:
+            latencies += worker_latencies
+            for key, value in worker_counts.items():
+                counts[key] += value
+        summary = summarize(latencies, elapsed)
+        return {
+            "writes": summary["requests"],
+            **counts,
+            "elapsed_seconds": elapsed,
+            "ok_per_second": counts["ok"] / elapsed if elapsed else 0.0,
+            "writes_per_second": summary["throughput_rps"],
+            "p50_ms": summary["p50_ms"],
+            "p95_ms": summary["p95_ms"],
+            "p99_ms": summary["p99_ms"],
+            "consistent": masks_match_bookings() and utilization_matches_masks(),
+        }
+
+
+def stress_worker(job):
+    index, operator_ids, dates, operations, seed = job
+    rng = random.Random(seed * 1000 + index)
+    starts = list(slot_starts())
+    size = slot_minutes()
+    booked = []
+    latencies = []
+    counts = {"ok": 0, "rejected": 0, "locked": 0}
+    for _ in range(operations):
+        booking_date = rng.choice(dates)
+        start = rng.choice(starts)
+        start_time, end_time = to_time(start), to_time(start + size)
+        started = time.perf_counter()
+        try:
+            if booked and rng.random() < 0.3:
+                position = rng.randrange(len(booked))
+                booking = booked[position]
+                if rng.random() < 0.5:
+                    body, code = cancel_booking(booking)
+                    booked.pop(position)
+                else:
+                    body, code = move_booking(booking.booking_id, booking_date, start_time, end_time)
+                    if code == 200:
+                        booking.booking_date, booking.start_time, booking.end_time = booking_date, start_time, end_time
+            else:
+                operator_id = rng.choice(operator_ids)
+                body, code = insert_booking(operator_id, booking_date, start_time, end_time)
+                if code == 200:
+                    booked.append(Booking(
+                        booking_id=int(body["booking_id"]), operator_id=operator_id,
+                        booking_date=booking_date, start_time=start_time, end_time=end_time,
+                    ))
+        except OperationalError as exc:
+            if "locked" not in str(exc):
+                raise
+            counts["locked"] += 1
+        else:
+            counts["ok" if code == 200 else "rejected"] += 1
+        latencies.append(time.perf_counter() - started)
+    connections.close_all()
+    return latencies, counts
+
+
+def masks_match_bookings():
+    # every booked minute belongs to exactly one booking and the other way round
+    masks = {}
+    for booking in Booking.objects.filter(status="booked").iterator():
+        start, end = booking_interval(booking.start_time, booking.end_time)
+        key = (booking.operator_id, booking.booking_date)
+        bits = interval_bits(start, end)
+        if masks.get(key, 0) & bits:
+            return False
+        masks[key] = masks.get(key, 0) | bits
+    for day in OperatorAvailability.objects.iterator():
+        if day.mask != masks.pop((day.operator_id, day.booking_date), 0):
+            return False
+    return not masks
+
+
+def utilization_matches_masks():
+    # the aggregates hold the booked minutes of the masks
+    minutes = {(day.operator_id, day.booking_date): day.mask.bit_count() for day in OperatorAvailability.objects.iterator()}
+    expected = {key: value for key, value in utilization.rollup(minutes).items() if value}
+    stored = {
+        (operator_id, period, start): value
+        for operator_id, period, start, value in OperatorUtilization.objects.exclude(minutes=0).values_list(
+            "operator_id", "period", "period_start", "minutes"
+        )
+    }
+    return stored == expected
@@ -0,0 +1,141 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+# in-process request metrics rendered in the Prometheus text format, each
+# worker process exposes its own series
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class RequestStats:
+    def __init__(self):
+        self.validation = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+
+
+_current = contextvars.ContextVar("service_agency_request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        # labels is a tuple of (name, value) pairs, callers hold the registry lock
+        series = self.series.setdefault(labels, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][i] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            for bound, bucket in zip(self.buckets, series["buckets"]):
+                lines.append(f'{self.name}_bucket{_labels(labels + (("le", _number(bound)),))} {bucket}')
+            lines.append(f'{self.name}_bucket{_labels(labels + (("le", "+Inf"),))} {series["count"]}')
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(series['sum'])}")
+            lines.append(f"{self.name}_count{_labels(labels)} {series['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_labels(labels)} {_number(value)}")
+        return lines
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+_lock = threading.Lock()
+REQUEST_LATENCY = Histogram("agency_request_duration_seconds", "Total request latency.", LATENCY_BUCKETS)
+VALIDATION_TIME = Histogram("agency_validation_duration_seconds", "Time spent in serializer validation per request.", LATENCY_BUCKETS)
+DB_TIME = Histogram("agency_db_duration_seconds", "Time spent executing SQL per request.", LATENCY_BUCKETS)
+DB_QUERIES = Histogram("agency_db_queries", "SQL queries executed per request.", QUERY_BUCKETS)
+RESPONSES = Counter("agency_responses_total", "Responses by endpoint, method and status code.")
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token, stats, endpoint, method, status_code, latency):
+    _current.reset(token)
+    labels = (("endpoint", endpoint), ("method", method))
+    with _lock:
+        REQUEST_LATENCY.observe(labels, latency)
+        VALIDATION_TIME.observe(labels, stats.validation)
+        DB_TIME.observe(labels, stats.db_time)
+        DB_QUERIES.observe(labels, stats.queries)
+        RESPONSES.inc(labels + (("status", status_code),))
+
+
+@contextlib.contextmanager
+def phase(name):
+    # times a block of the current request, e.g. phase("validation")
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            setattr(stats, name, getattr(stats, name) + time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    # database execute wrapper installed on every connection by the app config
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def render(extra=()):
+    with _lock:
+        lines = []
+        for metric in (REQUEST_LATENCY, VALIDATION_TIME, DB_TIME, DB_QUERIES, RESPONSES):
+            lines.extend(metric.render())
+    for metric in extra:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,172 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from . import idempotency, metrics, routers
+
+logger = logging.getLogger("service_agency.requests")
+
+
+class AsyncURLconfMiddleware:
+    # requests that come through the async middleware chain of the ASGI
+    # handler resolve against settings.ASYNC_URLCONF, the same paths served by
+    # the async views. It comes first so that the middleware below resolves
+    # the same view.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.urlconf = settings.ASYNC_URLCONF
+        return await self.get_response(request)
+
+
+class TimingMiddleware:
+    # records latency, serializer validation time, database time and query
+    # count per endpoint, works for both the WSGI and the ASGI handlers
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            latency = time.perf_counter() - started
+        self.finish(request, response, stats, token, latency)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            latency = time.perf_counter() - started
+        self.finish(request, response, stats, token, latency)
+        return response
+
+    def finish(self, request, response, stats, token, latency):
+        match = request.resolver_match
+        endpoint = match.url_name if match and match.url_name else "unmatched"
+        metrics.finish_request(token, stats, endpoint, request.method, response.status_code, latency)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("request", extra={
+                "endpoint": endpoint,
+                "method": request.method,
+                "status": response.status_code,
+                "latency_ms": round(latency * 1000, 3),
+                "validation_ms": round(stats.validation * 1000, 3),
+                "db_ms": round(stats.db_time * 1000, 3),
+                "queries": stats.queries,
+            })
+
+
+def _opted_in(request, attribute):
+    # whether the view of the request lists the request method in the given
+    # class attribute, e.g. replica_methods
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    view_class = getattr(match.func, "view_class", None)
+    return request.method in getattr(view_class, attribute, ())
+
+
+class ReplicaRoutingMiddleware:
+    # sends the reads of a request to the read replica when its view lists the
+    # method in replica_methods. A client that wrote recently carries the pin
+    # cookie and reads from the primary until it expires, so it always sees
+    # its own writes.
+    sync_capable = True
+    async_capable = True
+    pin_cookie = "agency_read_primary"
+    write_methods = ("POST", "PUT", "PATCH", "DELETE")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = routers.use_replica(self.wants_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = routers.use_replica(self.wants_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.reset(token)
+        return self.pin(request, response)
+
+    def wants_replica(self, request):
+        if settings.READ_DATABASE == routers.PRIMARY or self.pin_cookie in request.COOKIES:
+            return False
+        return _opted_in(request, "replica_methods")
+
+    def pin(self, request, response):
+        if request.method in self.write_methods and settings.READ_DATABASE != routers.PRIMARY:
+            response.set_cookie(
+                self.pin_cookie, "1", max_age=settings.READ_PIN_SECONDS, httponly=True, samesite="Lax"
+            )
+        return response
+
+
+class IdempotencyMiddleware:
+    # answers retried writes from the idempotency store when the view lists
+    # the method in idempotent_methods and the request has an Idempotency-Key
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.applies(request):
+            return self.get_response(request)
+        claim, error = idempotency.claim(request)
+        if error:
+            return error
+        return claim.run(request, self.get_response)
+
+    async def __acall__(self, request):
+        if not self.applies(request):
+            return await self.get_response(request)
+        claim, error = idempotency.claim(request)
+        if error:
+            return error
+        return await claim.arun(request, self.get_response)
+
+    def applies(self, request):
+        return idempotency.HEADER in request.headers and _opted_in(request, "idempotent_methods")
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+def build_masks(apps, schema_editor):
+    Booking = apps.get_model("service_agency", "Booking")
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    masks = {}
+    bookings = Booking.objects.filter(status="booked").values_list("operator_id", "booking_date", "start_time")
+    for operator_id, booking_date, start_time in bookings.iterator():
+        key = (operator_id, booking_date)
+        masks[key] = masks.get(key, 0) | (1 << start_time.hour)
+    OperatorAvailability.objects.bulk_create(
+        [
+            OperatorAvailability(operator_id=operator_id, booking_date=booking_date, booked_mask=mask)
+            for (operator_id, booking_date), mask in masks.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperatorAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operator_id', models.CharField(max_length=255)),
+                ('booking_date', models.DateField()),
+                ('booked_mask', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'operator_availability',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='operatoravailability',
+            constraint=models.UniqueConstraint(fields=('operator_id', 'booking_date'), name='operator_day_unique'),
+        ),
+        migrations.RunPython(build_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:56
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def cancel_duplicates(apps, schema_editor):
+    # concurrent bookings could take one slot twice, the earliest booking
+    # keeps it and the later ones are cancelled so the unique index can be
+    # built. The masks of the affected days are rebuilt from what is left.
+    Booking = apps.get_model("service_agency", "Booking")
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    db = schema_editor.connection.alias
+    active = Booking.objects.using(db).filter(status="booked")
+    slots = (
+        active.values("operator_id", "booking_date", "start_time")
+        .annotate(count=Count("booking_id")).filter(count__gt=1)
+    )
+    days = set()
+    for slot in list(slots):
+        duplicates = active.filter(
+            operator_id=slot["operator_id"], booking_date=slot["booking_date"], start_time=slot["start_time"]
+        ).order_by("timestamp", "booking_id")[1:]
+        Booking.objects.using(db).filter(booking_id__in=[booking.booking_id for booking in duplicates]).update(
+            status="cancelled", is_cancelled=True
+        )
+        days.add((slot["operator_id"], slot["booking_date"]))
+    for operator_id, booking_date in days:
+        mask = 0
+        bookings = active.filter(operator_id=operator_id, booking_date=booking_date).values_list("start_time", flat=True)
+        for start_time in bookings:
+            mask |= 1 << start_time.hour
+        OperatorAvailability.objects.using(db).update_or_create(
+            operator_id=operator_id, booking_date=booking_date, defaults={"booked_mask": mask}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0002_operator_availability'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'booked')), fields=('operator_id', 'booking_date', 'start_time'), name='booking_active_slot_unique'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0003_booking_active_slot_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='operator_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['operator_id', 'booking_date', 'start_time', 'status'], name='booking_operator_day_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0004_booking_operator_day_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('status', 'booked')), fields=['booking_date', 'start_time', 'operator_id'], name='booking_slot_operator_idx'),
+        ),
+    ]
@@ -0,0 +1,124 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+# the id scheme of service_agency/ids.py as of this migration, copied so that
+# later changes there do not change what the migration writes
+EPOCH_MS = 1672531200000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_ID = (1 << 63) - 1
+
+
+def compose(timestamp_ms, worker, sequence):
+    return ((timestamp_ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker << SEQUENCE_BITS) | sequence
+
+
+def parse(value):
+    value = str(value)
+    if not (value.isascii() and value.isdigit()) or len(value) > 19:
+        return None
+    value = int(value)
+    return value if value <= MAX_ID else None
+
+
+def _id_factory(taken):
+    # snowflake ids from the row timestamps, so remapped rows keep their
+    # creation order, worker 0 is reserved for this migration
+    sequences = {}
+
+    def new_id(timestamp):
+        ms = max(int(timestamp.timestamp() * 1000), EPOCH_MS)
+        while True:
+            sequence = sequences.get(ms, 0)
+            if sequence > MAX_SEQUENCE:
+                ms += 1
+                continue
+            sequences[ms] = sequence + 1
+            value = compose(ms, 0, sequence)
+            if value not in taken:
+                taken.add(value)
+                return value
+
+    return new_id
+
+
+def to_snowflake_ids(apps, schema_editor):
+    # ids that already fit a signed 64-bit integer are kept, the 24 digit
+    # uuid based ones get a new id and are kept in legacy_id
+    Booking = apps.get_model("service_agency", "Booking")
+    Operator = apps.get_model("service_agency", "Operator")
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    db = schema_editor.connection.alias
+
+    operators = list(Operator.objects.using(db).values_list("id", "timestamp"))
+    new_id = _id_factory({parse(operator_id) for operator_id, _ in operators} - {None})
+    for old_id, timestamp in operators:
+        if parse(old_id) is not None:
+            continue
+        operator_id = str(new_id(timestamp))
+        Operator.objects.using(db).filter(id=old_id).update(id=operator_id, legacy_id=old_id)
+        Booking.objects.using(db).filter(operator_id=old_id).update(operator_id=operator_id)
+        OperatorAvailability.objects.using(db).filter(operator_id=old_id).update(operator_id=operator_id)
+
+    bookings = Booking.objects.using(db).values_list("booking_id", "timestamp").order_by("timestamp")
+    new_id = _id_factory({parse(booking_id) for booking_id, _ in bookings.iterator()} - {None})
+    legacy = [(old_id, timestamp) for old_id, timestamp in bookings.iterator() if parse(old_id) is None]
+    for old_id, timestamp in legacy:
+        Booking.objects.using(db).filter(booking_id=old_id).update(booking_id=str(new_id(timestamp)), legacy_id=old_id)
+
+
+def to_legacy_ids(apps, schema_editor):
+    Booking = apps.get_model("service_agency", "Booking")
+    Operator = apps.get_model("service_agency", "Operator")
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    db = schema_editor.connection.alias
+
+    for operator_id, legacy_id in list(Operator.objects.using(db).exclude(legacy_id=None).values_list("id", "legacy_id")):
+        Operator.objects.using(db).filter(id=operator_id).update(id=legacy_id, legacy_id=None)
+        Booking.objects.using(db).filter(operator_id=operator_id).update(operator_id=legacy_id)
+        OperatorAvailability.objects.using(db).filter(operator_id=operator_id).update(operator_id=legacy_id)
+    for booking_id, legacy_id in list(Booking.objects.using(db).exclude(legacy_id=None).values_list("booking_id", "legacy_id")):
+        Booking.objects.using(db).filter(booking_id=booking_id).update(booking_id=legacy_id, legacy_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0005_booking_slot_operator_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='legacy_id',
+            field=models.CharField(max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='operator',
+            name='legacy_id',
+            field=models.CharField(max_length=255, null=True, unique=True),
+        ),
+        migrations.RunPython(to_snowflake_ids, to_legacy_ids),
+        migrations.AlterField(
+            model_name='booking',
+            name='booking_id',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='operator_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='operator',
+            name='id',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='operatoravailability',
+            name='operator_id',
+            field=models.BigIntegerField(),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+def hours_to_minutes(apps, schema_editor):
+    # bit h of booked_mask covered the minutes [60h, 60h + 60)
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    db = schema_editor.connection.alias
+    days = []
+    for day in OperatorAvailability.objects.using(db).exclude(booked_mask=0).iterator():
+        mask = 0
+        for hour in range(24):
+            if day.booked_mask >> hour & 1:
+                mask |= ((1 << 60) - 1) << (hour * 60)
+        day.booked_minutes = format(mask, "x")
+        days.append(day)
+    OperatorAvailability.objects.using(db).bulk_update(days, ["booked_minutes"], batch_size=1000)
+
+
+def minutes_to_hours(apps, schema_editor):
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    db = schema_editor.connection.alias
+    days = []
+    for day in OperatorAvailability.objects.using(db).exclude(booked_minutes="0").iterator():
+        mask = int(day.booked_minutes, 16)
+        day.booked_mask = sum(1 << hour for hour in range(24) if mask >> (hour * 60) & ((1 << 60) - 1))
+        days.append(day)
+    OperatorAvailability.objects.using(db).bulk_update(days, ["booked_mask"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0006_snowflake_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operatoravailability',
+            name='booked_minutes',
+            field=models.CharField(default='0', max_length=360),
+        ),
+        migrations.RunPython(hours_to_minutes, minutes_to_hours),
+        migrations.RemoveField(
+            model_name='operatoravailability',
+            name='booked_mask',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0007_booked_minutes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingArchive',
+            fields=[
+                ('timestamp', models.DateTimeField()),
+                ('booking_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('legacy_id', models.CharField(max_length=255, null=True, unique=True)),
+                ('operator_id', models.BigIntegerField()),
+                ('status', models.CharField(max_length=100)),
+                ('booking_date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('is_rescheduled', models.BooleanField(default=False)),
+                ('is_cancelled', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'booking_archive',
+                'indexes': [models.Index(fields=['operator_id', 'booking_date'], name='archive_operator_day_idx')],
+            },
+        ),
+    ]
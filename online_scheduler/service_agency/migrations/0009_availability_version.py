@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0008_booking_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operatoravailability',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:30
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicates(apps, schema_editor):
+    # concurrent registrations could create two operators with one name, the
+    # later ones get their id appended so the unique index can be built
+    Operator = apps.get_model("service_agency", "Operator")
+    db = schema_editor.connection.alias
+    names = (
+        Operator.objects.using(db).values("operator_name")
+        .annotate(count=Count("id")).filter(count__gt=1).values_list("operator_name", flat=True)
+    )
+    for name in list(names):
+        duplicates = Operator.objects.using(db).filter(operator_name=name).order_by("timestamp", "id")[1:]
+        for operator in duplicates:
+            suffix = f" ({operator.id})"
+            operator.operator_name = name[:100 - len(suffix)] + suffix
+            operator.save(update_fields=["operator_name"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0009_availability_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='operator',
+            name='operator_name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
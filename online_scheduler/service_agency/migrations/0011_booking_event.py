@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0010_operator_name_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('kind', models.CharField(max_length=20)),
+                ('booking_id', models.BigIntegerField()),
+                ('operator_id', models.BigIntegerField()),
+                ('booking_date', models.DateField()),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('previous_date', models.DateField(null=True)),
+                ('previous_start_time', models.TimeField(null=True)),
+                ('previous_end_time', models.TimeField(null=True)),
+            ],
+            options={
+                'db_table': 'booking_event',
+                'indexes': [models.Index(fields=['operator_id', 'id'], name='booking_event_operator_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:42
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def fill_utilization(apps, schema_editor):
+    # the booked minutes of every availability mask, summed per day, week
+    # starting on Monday and month
+    OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+    OperatorUtilization = apps.get_model("service_agency", "OperatorUtilization")
+    db = schema_editor.connection.alias
+    totals = Counter()
+    rows = OperatorAvailability.objects.using(db).exclude(booked_minutes="0").values_list(
+        "operator_id", "booking_date", "booked_minutes"
+    )
+    for operator_id, day, mask in rows.iterator():
+        minutes = int(mask, 16).bit_count()
+        totals[operator_id, "day", day] += minutes
+        totals[operator_id, "week", day - timedelta(days=day.weekday())] += minutes
+        totals[operator_id, "month", day.replace(day=1)] += minutes
+    OperatorUtilization.objects.using(db).bulk_create([
+        OperatorUtilization(operator_id=operator_id, period=period, period_start=start, minutes=minutes)
+        for (operator_id, period, start), minutes in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service_agency', '0011_booking_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperatorUtilization',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operator_id', models.BigIntegerField()),
+                ('period', models.CharField(max_length=5)),
+                ('period_start', models.DateField()),
+                ('minutes', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'operator_utilization',
+                'indexes': [models.Index(fields=['operator_id', 'period', 'period_start'], name='utilization_operator_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='operatorutilization',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'operator_id'), name='utilization_period_unique'),
+        ),
+        migrations.RunPython(fill_utilization, migrations.RunPython.noop),
+    ]
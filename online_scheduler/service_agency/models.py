@@ -5,8 +5,11 @@ from django.db import models
 
 class Booking(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
-    booking_id = models.CharField(primary_key=True, max_length=255)
-    operator_id = models.CharField(max_length=255)
+    # snowflake ids from ids.py, legacy_id keeps the id of bookings made
+    # before them so that clients can still use it
+    booking_id = models.BigIntegerField(primary_key=True)
+    legacy_id = models.CharField(max_length=255, null=True, unique=True)
+    operator_id = models.BigIntegerField()
     status = models.CharField(max_length=100)
     booking_date = models.DateField()
     start_time = models.TimeField()
@@ -17,14 +20,123 @@ class Booking(models.Model):
     class Meta:
         db_table="booking"
         indexes = [
-            models.Index(fields=["booking_id"], name="booking_id_idx"),
-            models.Index(fields=["operator_id"], name="operator_id_idx")
+            # booking_id is the primary key, lookups by operator, day and slot
+            # are served by this index with status read from the index itself
+            models.Index(fields=["operator_id", "booking_date", "start_time", "status"], name="booking_operator_day_idx"),
+            # inverted index from (day, slot) to the operators booked in it
+            models.Index(
+                fields=["booking_date", "start_time", "operator_id"],
+                condition=models.Q(status="booked"),
+                name="booking_slot_operator_idx",
+            ),
+        ]
+        constraints = [
+            # an operator can hold only one active booking per slot
+            models.UniqueConstraint(
+                fields=["operator_id", "booking_date", "start_time"],
+                condition=models.Q(status="booked"),
+                name="booking_active_slot_unique",
+            )
+        ]
+
+class BookingArchive(models.Model):
+    # cold storage for past and long cancelled bookings, filled by the
+    # archive_bookings command so that the booking table and its indexes only
+    # hold the working set
+    timestamp = models.DateTimeField()
+    booking_id = models.BigIntegerField(primary_key=True)
+    legacy_id = models.CharField(max_length=255, null=True, unique=True)
+    operator_id = models.BigIntegerField()
+    status = models.CharField(max_length=100)
+    booking_date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    is_rescheduled = models.BooleanField(default=False)
+    is_cancelled = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table="booking_archive"
+        indexes = [
+            models.Index(fields=["operator_id", "booking_date"], name="archive_operator_day_idx"),
         ]
 
 class Operator(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
-    id = models.CharField(primary_key=True, max_length=255)
-    operator_name = models.CharField(max_length=100)
+    id = models.BigIntegerField(primary_key=True)
+    legacy_id = models.CharField(max_length=255, null=True, unique=True)
+    operator_name = models.CharField(max_length=100, unique=True)
 
     class Meta:
-        db_table="operator"
\ No newline at end of file
+        db_table="operator"
+
+class OperatorAvailability(models.Model):
+    # one row per operator per day, booked_minutes is the hex form of a
+    # bitmask with bit m set when minute m of the day is booked
+    operator_id = models.BigIntegerField()
+    booking_date = models.DateField()
+    booked_minutes = models.CharField(max_length=360, default="0")
+    # bumped by every change of booked_minutes, the ETag of availability reads
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table="operator_availability"
+        constraints = [
+            models.UniqueConstraint(fields=["operator_id", "booking_date"], name="operator_day_unique")
+        ]
+
+    @property
+    def mask(self):
+        return int(self.booked_minutes, 16)
+
+    @mask.setter
+    def mask(self, value):
+        self.booked_minutes = format(value, "x")
+
+
+class OperatorUtilization(models.Model):
+    # booked minutes of an operator for a day, a week starting on Monday or a
+    # month, kept up to date with the availability masks, see utilization.py.
+    # minutes is signed so that drift fixed by rebuild_utilization can never
+    # block a booking write.
+    operator_id = models.BigIntegerField()
+    # day, week or month
+    period = models.CharField(max_length=5)
+    period_start = models.DateField()
+    minutes = models.IntegerField(default=0)
+
+    class Meta:
+        db_table="operator_utilization"
+        indexes = [
+            # reports of one operator and the updates of a booking write
+            models.Index(fields=["operator_id", "period", "period_start"], name="utilization_operator_idx"),
+        ]
+        constraints = [
+            # reports of every operator for a range of periods
+            models.UniqueConstraint(fields=["period", "period_start", "operator_id"], name="utilization_period_unique")
+        ]
+
+class BookingEvent(models.Model):
+    # transactional outbox of booking changes, written in the transaction of
+    # the change itself and tailed through the change feed. The auto
+    # increment id is the offset consumers resume from.
+    id = models.BigAutoField(primary_key=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    # created, rescheduled or cancelled
+    kind = models.CharField(max_length=20)
+    booking_id = models.BigIntegerField()
+    operator_id = models.BigIntegerField()
+    booking_date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    # the slot a rescheduled booking moved from
+    previous_date = models.DateField(null=True)
+    previous_start_time = models.TimeField(null=True)
+    previous_end_time = models.TimeField(null=True)
+
+    class Meta:
+        db_table="booking_event"
+        indexes = [
+            # feeds of a single operator
+            models.Index(fields=["operator_id", "id"], name="booking_event_operator_idx"),
+        ]
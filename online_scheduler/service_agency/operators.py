@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import status
+
+from . import ids
+from .models import Operator
+
+logger = logging.getLogger(__name__)
+
+# in-process registry of operator ids known to exist, so the existence check
+# of the booking endpoints costs no query once an operator has been seen.
+# Operators are only added, an entry expires after OPERATOR_CACHE_TTL seconds
+# to pick up rows removed by hand. Unknown ids are not remembered, an operator
+# added by another worker is found on its first request.
+
+_lock = threading.Lock()
+_known = OrderedDict()
+
+
+def _fresh(operator_id, now):
+    # callers hold _lock
+    expires = _known.get(operator_id)
+    if expires is None:
+        return False
+    if expires < now:
+        del _known[operator_id]
+        return False
+    _known.move_to_end(operator_id)
+    return True
+
+
+def remember(*operator_ids):
+    expires = time.monotonic() + settings.OPERATOR_CACHE_TTL
+    with _lock:
+        for operator_id in operator_ids:
+            _known[operator_id] = expires
+            _known.move_to_end(operator_id)
+        while len(_known) > settings.OPERATOR_CACHE_SIZE:
+            _known.popitem(last=False)
+
+
+def forget(*operator_ids):
+    with _lock:
+        for operator_id in operator_ids:
+            _known.pop(operator_id, None)
+
+
+def clear():
+    with _lock:
+        _known.clear()
+
+
+def forget_deleted(sender, instance, **kwargs):
+    # post_delete receiver for Operator, see apps.py
+    forget(instance.pk)
+
+
+def exists(operator_id):
+    if operator_id is None:
+        return False
+    with _lock:
+        if _fresh(operator_id, time.monotonic()):
+            return True
+    if not Operator.objects.filter(id=operator_id).exists():
+        return False
+    remember(operator_id)
+    return True
+
+
+async def aexists(operator_id):
+    # exists for the async views
+    if operator_id is None:
+        return False
+    with _lock:
+        if _fresh(operator_id, time.monotonic()):
+            return True
+    if not await Operator.objects.filter(id=operator_id).aexists():
+        return False
+    remember(operator_id)
+    return True
+
+
+def add(operator_name):
+    # registers an operator, returns the response body and status of
+    # AddOperator. The unique index on operator_name rejects an operator that
+    # already exists, also when two registrations race.
+    for attempt in range(ids.ID_ATTEMPTS):
+        operator_id = ids.next_id()
+        try:
+            with transaction.atomic():
+                Operator.objects.create(id=operator_id, operator_name=operator_name)
+            break
+        except IntegrityError:
+            # an id handed out twice is not a duplicate name, try a new one
+            if attempt + 1 < ids.ID_ATTEMPTS and Operator.objects.filter(id=operator_id).exists():
+                logger.warning("operator id %s already taken, retrying with a new one", operator_id)
+                continue
+            return {"sCode": 400, "message": "Operator already exists"}, status.HTTP_400_BAD_REQUEST
+    remember(operator_id)
+    return (
+        {"sCode": 200, "message": "Operator succesfully added in DB", "operator_id": str(operator_id)},
+        status.HTTP_200_OK,
+    )
+
+
+def registered(operator_ids):
+    # the subset of operator_ids that exist, one query for the ids not in the
+    # registry and none when all of them are
+    now = time.monotonic()
+    with _lock:
+        known = {operator_id for operator_id in operator_ids if _fresh(operator_id, now)}
+    unknown = set(operator_ids) - known
+    if unknown:
+        found = set(Operator.objects.filter(id__in=unknown).values_list("id", flat=True))
+        remember(*found)
+        known |= found
+    return known
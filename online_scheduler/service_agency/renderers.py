@@ -0,0 +1,51 @@
+import json
+
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:
+    # without orjson responses are rendered by the stock encoder
+    orjson = None
+
+# the default JSON renderer, backed by orjson when it is installed. It writes
+# the same JSON as the stock renderer: dates and times, decimals, lazy strings
+# and the like go through DRF's encoder, pretty printing and anything orjson
+# refuses (integers beyond 64 bits, lone surrogates) fall back to json.dumps.
+
+_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+_ESCAPES = ((b"\xe2\x80\xa8", b"\\u2028"), (b"\xe2\x80\xa9", b"\\u2029"))
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # like the stock renderer, keep the output a strict javascript subset
+        for raw, escaped in _ESCAPES:
+            if raw in ret:
+                ret = ret.replace(raw, escaped)
+        return ret
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    # lets clients ask for text/event-stream, views answer them with a
+    # streaming response of their own. Errors become a single error event.
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return f"event: error\ndata: {json.dumps(data)}\n\n".encode()
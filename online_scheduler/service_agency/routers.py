@@ -0,0 +1,42 @@
+import contextvars
+
+from django.conf import settings
+
+# reads of views that opt in with replica_methods go to settings.READ_DATABASE,
+# everything else, and every write, goes to the primary. The alias for the
+# current request is set by ReplicaRoutingMiddleware.
+
+PRIMARY = "default"
+
+_read_alias = contextvars.ContextVar("service_agency_read_alias", default=None)
+
+
+def use_replica(enabled):
+    return _read_alias.set(settings.READ_DATABASE if enabled else None)
+
+
+def reset(token):
+    _read_alias.reset(token)
+
+
+def read_alias():
+    # the database reads of the current request go to, None for the primary
+    return _read_alias.get()
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "service_agency":
+            return _read_alias.get() or PRIMARY
+        return None
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # a local replica file is migrated like the primary
+        return True
@@ -1,30 +1,151 @@
 import re
 
+from django.conf import settings
 from rest_framework import serializers
 from datetime import datetime
 
+from . import ids
+from .availability import ALL_SLOTS
+from .utilization import PERIODS
+
+MAX_RANGE_DAYS = 31
+MAX_CANCEL_DAYS = 366
+MAX_REPORT_DAYS = 731
+
 
 def is_valid_phone(obj):
     if not re.search(r"^\+91[\d]{10}$", obj):
         raise serializers.ValidationError("Enter a valid phone number")
 
 
+class IdField(serializers.CharField):
+    # snowflake ids become integers, older ids stay strings for ids.resolve
+    def run_validation(self, data=serializers.empty):
+        value = super().run_validation(data)
+        parsed = ids.parse(value)
+        return value if parsed is None else parsed
+
+
 class BookingDataSerializer(serializers.Serializer):
-    operator_id = serializers.CharField(max_length=225, required=True)
+    operator_id = IdField(max_length=225, required=True)
     start_time = serializers.TimeField(required=True)
     end_time = serializers.TimeField(required=True)
     booking_date = serializers.DateField(required=True)
-        
+
+
 class RescheduleSerializer(serializers.Serializer):
-    booking_id = serializers.CharField(max_length=225, required=True)
+    booking_id = IdField(max_length=225, required=True)
     start_time = serializers.TimeField(required=True)
     end_time = serializers.TimeField(required=True)
     booking_date = serializers.DateField(required=True)
 
+
 class ViewBookingSerializer(serializers.Serializer):
-    operator_id = serializers.CharField(max_length=225, required=True)
+    operator_id = IdField(max_length=225, required=True)
     booking_date = serializers.DateField(required=False)
     view_booked_slots = serializers.BooleanField(required=True)
+    # start_date and end_date select range mode, one entry per day inclusive
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        start_date = data.get("start_date")
+        end_date = data.get("end_date")
+        if bool(start_date) != bool(end_date):
+            raise serializers.ValidationError("start_date and end_date must be given together")
+        if start_date and start_date > end_date:
+            raise serializers.ValidationError("start_date must not be later than end_date")
+        if start_date and (end_date - start_date).days >= MAX_RANGE_DAYS:
+            raise serializers.ValidationError(f"Date range can span at most {MAX_RANGE_DAYS} days")
+        return data
+
 
 class OperatorSerializer(serializers.Serializer):
-    name = serializers.CharField(max_length=225, required=True)
\ No newline at end of file
+    name = serializers.CharField(max_length=225, required=True)
+
+
+class BookingBatchSerializer(serializers.Serializer):
+    bookings = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=500)
+
+
+class AvailableOperatorsSerializer(serializers.Serializer):
+    booking_date = serializers.DateField(required=True)
+    slot = serializers.ChoiceField(choices=ALL_SLOTS, required=True)
+    # with end_slot every slot from slot to end_slot must be free
+    end_slot = serializers.ChoiceField(choices=ALL_SLOTS, required=False)
+    after = serializers.IntegerField(min_value=0, max_value=ids.MAX_ID, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=50)
+
+    def validate(self, data):
+        if "end_slot" in data and ALL_SLOTS.index(data["end_slot"]) < ALL_SLOTS.index(data["slot"]):
+            raise serializers.ValidationError("end_slot must not be earlier than slot")
+        return data
+
+
+class BulkCancelSerializer(serializers.Serializer):
+    operator_id = IdField(max_length=225, required=True)
+    start_date = serializers.DateField(required=True)
+    end_date = serializers.DateField(required=True)
+    # with slot only bookings that overlap slot (to end_slot) on each day are
+    # cancelled, without it every booking of the days
+    slot = serializers.ChoiceField(choices=ALL_SLOTS, required=False)
+    end_slot = serializers.ChoiceField(choices=ALL_SLOTS, required=False)
+
+    def validate(self, data):
+        if data["start_date"] > data["end_date"]:
+            raise serializers.ValidationError("start_date must not be later than end_date")
+        if (data["end_date"] - data["start_date"]).days >= MAX_CANCEL_DAYS:
+            raise serializers.ValidationError(f"Date range can span at most {MAX_CANCEL_DAYS} days")
+        if "end_slot" in data and "slot" not in data:
+            raise serializers.ValidationError("end_slot needs slot")
+        if "end_slot" in data and ALL_SLOTS.index(data["end_slot"]) < ALL_SLOTS.index(data["slot"]):
+            raise serializers.ValidationError("end_slot must not be earlier than slot")
+        return data
+
+
+class BookingFeedSerializer(serializers.Serializer):
+    # offset of the last event the consumer has seen, an event stream resumes
+    # from its Last-Event-ID header instead
+    after = serializers.IntegerField(min_value=0, max_value=ids.MAX_ID, required=False)
+    operator_id = IdField(max_length=225, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+    # long poll, seconds to wait for the next event when there is none yet
+    wait = serializers.IntegerField(min_value=0, max_value=settings.FEED_MAX_WAIT_SECONDS, default=0)
+
+
+class UtilizationReportSerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=PERIODS, default="day")
+    start_date = serializers.DateField(required=True)
+    end_date = serializers.DateField(required=True)
+    operator_id = IdField(max_length=225, required=False)
+    # "<period_start>:<operator_id>" of the last row of the previous page
+    after = serializers.CharField(max_length=64, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=500)
+
+    def validate_after(self, value):
+        period_start, _, operator_id = value.partition(":")
+        try:
+            return datetime.strptime(period_start, "%Y-%m-%d").date(), int(operator_id)
+        except ValueError:
+            raise serializers.ValidationError("Pass the next value of the previous page")
+
+    def validate(self, data):
+        if data["start_date"] > data["end_date"]:
+            raise serializers.ValidationError("start_date must not be later than end_date")
+        if (data["end_date"] - data["start_date"]).days >= MAX_REPORT_DAYS:
+            raise serializers.ValidationError(f"Date range can span at most {MAX_REPORT_DAYS} days")
+        return data
+
+
+class ExportSerializer(serializers.Serializer):
+    # "format" is taken by DRF for renderer selection
+    output = serializers.ChoiceField(choices=["ndjson", "csv"], default="ndjson")
+    operator_id = IdField(max_length=225, required=False)
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=["booked", "cancelled"], required=False)
+    include_archived = serializers.BooleanField(default=False)
+
+
+class BookingLookupSerializer(serializers.Serializer):
+    include_archived = serializers.BooleanField(default=False)
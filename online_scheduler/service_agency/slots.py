@@ -0,0 +1,114 @@
+import functools
+from datetime import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# the slot engine: times of day are integer minutes from midnight and a day of
+# bookings is a bitmask with bit m set when minute m is booked. An interval is
+# a run of set bits, so overlap tests, booking and freeing are single integer
+# operations whatever the slot size, and stored masks stay valid when
+# SLOT_MINUTES changes.
+
+MINUTES_PER_DAY = 24 * 60
+FULL_DAY = (1 << MINUTES_PER_DAY) - 1
+
+
+def check_settings():
+    size = settings.SLOT_MINUTES
+    if size < 1 or MINUTES_PER_DAY % size:
+        raise ImproperlyConfigured("SLOT_MINUTES must divide the 1440 minutes of a day")
+    longest = settings.MAX_BOOKING_MINUTES
+    if longest < size or longest % size:
+        raise ImproperlyConfigured("MAX_BOOKING_MINUTES must be a multiple of SLOT_MINUTES")
+
+
+def slot_minutes():
+    return settings.SLOT_MINUTES
+
+
+def max_booking_minutes():
+    return settings.MAX_BOOKING_MINUTES
+
+
+def to_minute(value):
+    return value.hour * 60 + value.minute
+
+
+def to_time(minute):
+    # the end of the day is stored as 00:00:00 like before
+    return time((minute // 60) % 24, minute % 60)
+
+
+_MINUTE_LABELS = tuple(f"{minute // 60:02d}:{minute % 60:02d}:00" for minute in range(MINUTES_PER_DAY + 1))
+
+
+def booking_interval(start_time, end_time):
+    # (start, end) minutes of a booking, an end time of 00:00:00 is midnight
+    # at the end of the day
+    start = to_minute(start_time)
+    end = to_minute(end_time)
+    if end == 0:
+        end = MINUTES_PER_DAY
+    return start, end
+
+
+def interval_bits(start, end):
+    return ((1 << (end - start)) - 1) << start
+
+
+def runs(mask):
+    # (start, end) of every run of set bits, in order, one step per run
+    offset = 0
+    while mask:
+        skip = (mask & -mask).bit_length() - 1
+        mask >>= skip
+        offset += skip
+        length = (mask ^ (mask + 1)).bit_length() - 1
+        yield offset, offset + length
+        mask >>= length
+        offset += length
+
+
+def slot_starts():
+    return range(0, MINUTES_PER_DAY, slot_minutes())
+
+
+def slot_label(start, end):
+    # slot choices end the day at 00:00:00, free ranges at 24:00:00
+    return f"{_MINUTE_LABELS[start]}-{_MINUTE_LABELS[end % MINUTES_PER_DAY]}"
+
+
+@functools.lru_cache(maxsize=None)
+def _slot_labels(size):
+    return tuple(slot_label(start, start + size) for start in range(0, MINUTES_PER_DAY, size))
+
+
+def all_slots():
+    return list(_slot_labels(slot_minutes()))
+
+
+def parse_slot(slot):
+    start, end = (to_minute(time.fromisoformat(value)) for value in slot.split("-"))
+    return start, end or MINUTES_PER_DAY
+
+
+def booked_slots(mask):
+    # every slot of the grid that holds a booked minute, walking the booked
+    # runs instead of testing every slot of the day
+    size = slot_minutes()
+    labels = _slot_labels(size)
+    slots = []
+    last = -size
+    for start, end in runs(mask):
+        first = max(start - start % size, last + size)
+        for slot in range(first, end, size):
+            slots.append(labels[slot // size])
+            last = slot
+    return slots
+
+
+def free_slots(mask):
+    # runs of free minutes as "start-end" ranges, the last range of the day
+    # ends at 24:00:00
+    return [f"{_MINUTE_LABELS[start]}-{_MINUTE_LABELS[end]}" for start, end in runs(FULL_DAY ^ mask)]
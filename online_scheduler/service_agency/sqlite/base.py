@@ -0,0 +1,38 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# the sqlite3 backend with the two connection options Django 5.1 added, so
+# the production profile in settings keeps working after an upgrade to the
+# stock backend:
+#   init_command      ";" separated PRAGMAs run on every new connection
+#   transaction_mode  DEFERRED, IMMEDIATE or EXCLUSIVE for atomic blocks
+# IMMEDIATE takes the write lock when the transaction begins. A deferred
+# transaction that reads before it writes can not wait for the lock held by
+# another writer, sqlite fails it with "database is locked" at once instead
+# of honouring the busy timeout.
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("init_command", None)
+        mode = params.pop("transaction_mode", None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        init_command = self.settings_dict["OPTIONS"].get("init_command", "")
+        for pragma in init_command.split(";"):
+            if pragma.strip():
+                conn.execute(pragma)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict["OPTIONS"].get("transaction_mode")
+        if mode is None:
+            return super()._start_transaction_under_autocommit()
+        self.cursor().execute(f"BEGIN {mode.upper()}")
@@ -1,3 +1,1735 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time as time_module
+import unittest
+import unittest.mock
+from io import StringIO
+from datetime import date, time, timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import load_backend
+from django.db.models import Q
+from django.http import HttpResponse, QueryDict
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from . import cache as availability_cache
+from . import events, exports, fastpath, ids, operators, routers, utilization
+from .availability import SlotTaken, _swap_mask, etag, mark_booked
+from .middleware import ReplicaRoutingMiddleware
+from .bookings import book, cancel, create_bookings, insert_booking, overlapping, reschedule
+from .archive import prune_events_chunk
+from .benchmarking import file_database, seed, summarize
+from .async_views import AsyncBookingFeed, AsyncCancelBooking, AsyncSlotBooking
+from .management.commands.benchmark import OPERATIONS, Run
+from .management.commands.benchmark import Command as BenchmarkCommand
+from .management.commands.rebuild_utilization import booked_minutes
+from .views import AvailabilityCacheStats, BookingFeed, CancelBooking, SlotBooking
+from .models import Booking, BookingArchive, BookingEvent, Operator, OperatorAvailability, OperatorUtilization
+from .log import JsonFormatter
+from .renderers import FastJSONRenderer
+from .serializer import (AvailableOperatorsSerializer, BookingDataSerializer, BulkCancelSerializer, OperatorSerializer,
+                         ViewBookingSerializer)
+from .slots import (MINUTES_PER_DAY, all_slots, booked_slots, booking_interval, free_slots, interval_bits, parse_slot, runs,
+                    to_time)
+from .slots import check_settings as check_slot_settings
+
+# a SCAN reads a whole table or a whole index, SEARCH lines are index probes
+FULL_SCAN = re.compile(r"\bSCAN (?!CONSTANT ROW)\w+")
+
+
+class AgencySetup:
+    # empty caches and operator registry with operator 1 registered, book()
+    # posts a booking of that operator through the API
+
+    def setUp(self):
+        for alias in {settings.AVAILABILITY_CACHE_ALIAS, settings.IDEMPOTENCY_CACHE_ALIAS}:
+            caches[alias].clear()
+        operators.clear()
+        Operator.objects.create(id=1, operator_name="operator")
+
+    def book(self, booking_date=None, start_time="10:00:00", end_time="11:00:00", operator_id="1", **extra):
+        return self.client.post("/agency/slot_booking", {
+            "operator_id": operator_id,
+            "booking_date": str(booking_date or date.today()),
+            "start_time": start_time,
+            "end_time": end_time,
+        }, content_type="application/json", **extra)
+
+
+class AgencyTestCase(AgencySetup, TestCase):
+    pass
+
+
+class AgencyTransactionTestCase(AgencySetup, TransactionTestCase):
+    # for the async views, whose writes commit on the connection of an
+    # executor thread that can not see the rows of a TestCase transaction
+    pass
+
+
+class MigrationTestCase(TransactionTestCase):
+    # migrates the app back to migrate_from, the test adds rows through the
+    # historical models in self.apps and calls migrate() to run the
+    # migrations up to migrate_to. The latest schema is restored afterwards.
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        self.apps = self.migrate_app(self.migrate_from)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate_app(self, name):
+        target = [("service_agency", name)]
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def migrate(self):
+        self.apps = self.migrate_app(self.migrate_to)
+        return self.apps
+
+
+class SlotBitmaskTests(AgencyTestCase):
+    def day(self, booking_date=None):
+        return OperatorAvailability.objects.get(operator_id=1, booking_date=booking_date or date.today())
+
+    def test_writes_keep_the_day_mask_in_step(self):
+        booking_id = self.book(start_time="10:00:00", end_time="11:00:00").json()["booking_id"]
+        self.book(start_time="13:00:00", end_time="14:00:00")
+        self.assertEqual(self.day().mask, interval_bits(600, 660) | interval_bits(780, 840))
+        self.client.patch("/agency/slot_booking", {
+            "booking_id": booking_id, "booking_date": str(date.today()), "start_time": "15:00:00", "end_time": "16:00:00",
+        }, content_type="application/json")
+        self.assertEqual(self.day().mask, interval_bits(780, 840) | interval_bits(900, 960))
+        version = self.day().version
+        self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        self.assertEqual(self.day().mask, interval_bits(780, 840))
+        # every write bumps the version of the day
+        self.assertGreater(self.day().version, version)
+
+    def test_booked_minutes_are_refused(self):
+        with transaction.atomic():
+            mark_booked(1, date.today(), 600, 660)
+        with self.assertRaises(SlotTaken), transaction.atomic():
+            mark_booked(1, date.today(), 630, 690)
+        self.assertEqual(self.day().mask, interval_bits(600, 660))
+
+    def test_concurrent_change_is_retried(self):
+        mark_booked(1, date.today(), 600, 660)
+        seen = []
+
+        def change(mask):
+            # another writer books 13:00 between our read and our update
+            if not seen:
+                OperatorAvailability.objects.filter(operator_id=1).update(
+                    booked_minutes=format(mask | interval_bits(780, 840), "x")
+                )
+            seen.append(mask)
+            return mask | interval_bits(900, 960)
+
+        _swap_mask(1, date.today(), change)
+        self.assertEqual(seen, [interval_bits(600, 660), interval_bits(600, 660) | interval_bits(780, 840)])
+        self.assertEqual(self.day().mask, interval_bits(600, 660) | interval_bits(780, 840) | interval_bits(900, 960))
+
+    def test_cancel_reads_the_booking_once(self):
+        booking_id = self.book().json()["booking_id"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        self.assertEqual(response.json()["sCode"], 200)
+        reads = [query["sql"] for query in queries if query["sql"].startswith('SELECT') and 'FROM "booking"' in query["sql"]]
+        self.assertEqual(len(reads), 1, reads)
+        self.assertEqual(self.client.delete(f"/agency/cancel_booking/{booking_id}").json()["message"], "Booking already cancelled")
+        self.assertEqual(self.client.delete("/agency/cancel_booking/404").status_code, 404)
+
+
+class BatchBookingTests(AgencyTestCase):
+    def batch(self, bookings):
+        return self.client.post("/agency/slot_booking/batch", {"bookings": bookings}, content_type="application/json")
+
+    def item(self, start_time, end_time, operator_id="1"):
+        return {"operator_id": operator_id, "booking_date": str(date.today()), "start_time": start_time, "end_time": end_time}
+
+    def test_failed_items_do_not_fail_the_batch(self):
+        response = self.batch([
+            self.item("09:00:00", "10:00:00"),
+            self.item("09:00:00", "10:00:00"),
+            {"operator_id": "1", "booking_date": "not a date"},
+            self.item("10:00:00", "11:00:00", operator_id="404"),
+            self.item("10:30:00", "11:30:00"),
+            self.item("11:00:00", "12:00:00"),
+        ])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (2, 4))
+        self.assertEqual([result["index"] for result in body["results"]], list(range(6)))
+        self.assertEqual([result["sCode"] for result in body["results"]], [200, 400, 400, 404, 422, 200])
+        self.assertIn("booking_date", body["results"][2]["message"])
+        self.assertEqual(
+            set(Booking.objects.values_list("booking_id", flat=True)),
+            {int(body["results"][0]["booking_id"]), int(body["results"][5]["booking_id"])},
+        )
+        day = OperatorAvailability.objects.get(operator_id=1, booking_date=date.today())
+        self.assertEqual(day.mask, interval_bits(540, 600) | interval_bits(660, 720))
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        # the first lookup puts the operator in the registry
+        operators.exists(1)
+        queries = []
+        for hours in (range(0, 2), range(2, 10)):
+            with CaptureQueriesContext(connection) as captured:
+                body = self.batch([self.item(f"{hour:02d}:00:00", f"{hour + 1:02d}:00:00") for hour in hours]).json()
+            self.assertEqual(body["created"], len(hours))
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_empty_or_oversized_batches_are_refused(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.batch([self.item("09:00:00", "10:00:00")] * 501).status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+
+class AvailabilityBackfillMigrationTests(MigrationTestCase):
+    migrate_from = "0001_initial"
+    migrate_to = "0002_operator_availability"
+
+    def test_masks_are_built_from_active_bookings(self):
+        Booking = self.apps.get_model("service_agency", "Booking")
+        day = date(2023, 10, 16)
+        for booking_id, hour, booking_status in (("a", 9, "booked"), ("b", 11, "booked"), ("c", 13, "cancelled")):
+            Booking.objects.create(
+                booking_id=booking_id, operator_id="7", booking_date=day,
+                start_time=time(hour), end_time=time(hour + 1), status=booking_status,
+            )
+        apps = self.migrate()
+        OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+        self.assertEqual(
+            list(OperatorAvailability.objects.values_list("operator_id", "booking_date", "booked_mask")),
+            [("7", day, (1 << 9) | (1 << 11))],
+        )
+
+
+class DuplicateSlotMigrationTests(MigrationTestCase):
+    migrate_from = "0002_operator_availability"
+    migrate_to = "0003_booking_active_slot_unique"
+
+    def test_earliest_booking_keeps_the_slot(self):
+        Booking = self.apps.get_model("service_agency", "Booking")
+        OperatorAvailability = self.apps.get_model("service_agency", "OperatorAvailability")
+        day = date(2023, 10, 16)
+        for booking_id, hour in (("1", 9), ("2", 9), ("3", 9), ("4", 11)):
+            Booking.objects.create(
+                booking_id=booking_id, operator_id="7", booking_date=day,
+                start_time=time(hour), end_time=time(hour + 1), status="booked",
+            )
+        # the first booking of the slot is the latest id
+        Booking.objects.filter(booking_id="3").update(timestamp=timezone.now() - timedelta(hours=1))
+        # a stale mask is rebuilt from the bookings left active
+        OperatorAvailability.objects.create(operator_id="7", booking_date=day, booked_mask=1 << 15)
+        apps = self.migrate()
+        Booking = apps.get_model("service_agency", "Booking")
+        OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+        self.assertEqual(
+            dict(Booking.objects.values_list("booking_id", "status")),
+            {"1": "cancelled", "2": "cancelled", "3": "booked", "4": "booked"},
+        )
+        self.assertTrue(Booking.objects.get(booking_id="1").is_cancelled)
+        self.assertEqual(OperatorAvailability.objects.get(operator_id="7").booked_mask, (1 << 9) | (1 << 11))
+
+
+class ActiveSlotTests(AgencyTestCase):
+    def reschedule(self, booking_id, start_time, end_time):
+        return self.client.patch("/agency/slot_booking", {
+            "booking_id": booking_id, "booking_date": str(date.today()), "start_time": start_time, "end_time": end_time,
+        }, content_type="application/json")
+
+    def test_slot_is_booked_once(self):
+        booking_id = self.book().json()["booking_id"]
+        self.assertEqual(self.book().status_code, 400)
+        # a writer that skips the day mask is stopped by the unique index
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Booking.objects.create(
+                booking_id=1, operator_id=1, booking_date=date.today(),
+                start_time=time(10), end_time=time(11), status="booked",
+            )
+        self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        self.assertEqual(self.book().status_code, 200)
+
+    def test_reschedule_into_a_taken_slot_changes_nothing(self):
+        booking_id = self.book().json()["booking_id"]
+        self.book(start_time="13:00:00", end_time="14:00:00")
+        response = self.reschedule(booking_id, "13:00:00", "14:00:00")
+        self.assertEqual(response.status_code, 400)
+        booking = Booking.objects.get(booking_id=booking_id)
+        self.assertEqual((booking.start_time, booking.is_rescheduled), (time(10), False))
+        day = OperatorAvailability.objects.get(operator_id=1, booking_date=date.today())
+        self.assertEqual(day.mask, interval_bits(600, 660) | interval_bits(780, 840))
+        self.assertFalse(BookingEvent.objects.filter(kind="rescheduled").exists())
+
+    def test_reschedule_is_one_conditional_update(self):
+        booking_id = self.book().json()["booking_id"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reschedule(booking_id, "15:00:00", "16:00:00")
+        self.assertEqual(response.json()["sCode"], 200)
+        reads = [query["sql"] for query in queries if query["sql"].startswith("SELECT") and 'FROM "booking"' in query["sql"]]
+        self.assertEqual(reads, [])
+        event = BookingEvent.objects.get(kind="rescheduled")
+        self.assertEqual(
+            (event.operator_id, event.previous_start_time, event.previous_end_time, event.start_time),
+            (1, time(10), time(11), time(15)),
+        )
+        booking = Booking.objects.get(booking_id=booking_id)
+        self.assertEqual((booking.start_time, booking.is_rescheduled), (time(15), True))
+
+    def test_reschedule_reads_the_booking_where_insert_select_cannot_return(self):
+        booking_id = self.book().json()["booking_id"]
+        # Oracle reports can_return_columns_from_insert but has no INSERT ...
+        # SELECT ... RETURNING, the move falls back to reading the booking
+        with unittest.mock.patch.object(connection, "vendor", "oracle"):
+            self.assertFalse(events._returns_from_insert_select())
+        with unittest.mock.patch("service_agency.events._returns_from_insert_select", return_value=False):
+            response = self.reschedule(booking_id, "15:00:00", "16:00:00")
+        self.assertEqual(response.json()["sCode"], 200)
+        event = BookingEvent.objects.get(kind="rescheduled")
+        self.assertEqual(
+            (event.operator_id, event.previous_start_time, event.start_time),
+            (1, time(10), time(15)),
+        )
+
+    def test_reschedule_of_an_inactive_booking_is_not_found(self):
+        booking_id = self.book().json()["booking_id"]
+        self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        self.assertEqual(self.reschedule(booking_id, "15:00:00", "16:00:00").status_code, 404)
+        self.assertEqual(self.reschedule("404", "15:00:00", "16:00:00").status_code, 404)
+        self.assertFalse(BookingEvent.objects.filter(kind="rescheduled").exists())
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is sqlite specific")
+class QueryPlanTests(TestCase):
+    # every hot ORM query of the booking endpoints must be answered through an
+    # index, add the queries of new endpoints to hot_queries
+
+    @classmethod
+    def setUpTestData(cls):
+        day = date(2023, 10, 16)
+        Operator.objects.bulk_create(Operator(id=i, operator_name=f"operator {i}") for i in range(20))
+        Booking.objects.bulk_create(
+            Booking(
+                booking_id=i * 10000 + d * 100 + h,
+                legacy_id=f"{i}-{d}-{h}",
+                operator_id=i,
+                booking_date=day + timedelta(days=d),
+                start_time=time(h),
+                end_time=time((h + 1) % 24),
+                status="cancelled" if h % 5 == 0 else "booked",
+            )
+            for i in range(20) for d in range(10) for h in range(0, 24, 2)
+        )
+        OperatorAvailability.objects.bulk_create(
+            OperatorAvailability(operator_id=i, booking_date=day + timedelta(days=d), booked_minutes="555555")
+            for i in range(20) for d in range(10)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def hot_queries(self):
+        day = date(2023, 10, 17)
+        return {
+            "booking by id": Booking.objects.filter(booking_id=30104),
+            "active booking by id": Booking.objects.filter(booking_id=30104, status="booked"),
+            "booking by legacy id": Booking.objects.filter(legacy_id="3-1-4"),
+            "operator by legacy id": Operator.objects.filter(legacy_id=3),
+            "operator slot": Booking.objects.filter(operator_id=3, booking_date=day, start_time=time(4), status="booked"),
+            "operator day": Booking.objects.filter(operator_id=3, booking_date=day, status="booked"),
+            "operator date range": Booking.objects.filter(
+                operator_id=3, booking_date__range=(day, day + timedelta(days=6)), status="booked"
+            ),
+            "operator bookings in window": overlapping(Booking.objects.filter(
+                operator_id=3, booking_date__range=(day, day + timedelta(days=6)), status="booked"
+            ), 240, 360),
+            "operators booked in window": Booking.objects.filter(
+                booking_date=day, start_time__gte=time(3, 1), start_time__lt=time(6), status="booked"
+            ).filter(Q(end_time__gt=time(4)) | Q(end_time=time(0))).values("operator_id"),
+            "events after offset": BookingEvent.objects.filter(id__gt=40).order_by("id")[:100],
+            "operator events after offset": BookingEvent.objects.filter(id__gt=40, operator_id=3).order_by("id")[:100],
+            "utilization report": OperatorUtilization.objects.filter(
+                period="week", period_start__range=(day, day + timedelta(days=60)), minutes__gt=0,
+            ).filter(Q(period_start__gt=day) | Q(period_start=day, operator_id__gt=3)).order_by("period_start", "operator_id"),
+            "operator utilization report": OperatorUtilization.objects.filter(
+                period="day", period_start__range=(day, day + timedelta(days=60)), operator_id=3,
+            ).order_by("period_start", "operator_id"),
+            "utilization update": OperatorUtilization.objects.filter(
+                operator_id__in=[3], period__in=["day", "week", "month"], period_start__in=[day, date(2023, 10, 16), date(2023, 10, 1)],
+            ),
+            "archived bookings of operators": BookingArchive.objects.filter(operator_id__in=[3, 4], status="booked"),
+            "archived booking by id": BookingArchive.objects.filter(booking_id=30104),
+            "archived booking by legacy id": BookingArchive.objects.filter(legacy_id="3-1-4"),
+            "operator by id": Operator.objects.filter(id=3),
+            "operators by ids": Operator.objects.filter(id__in=[3, 4]),
+            "operator by name": Operator.objects.filter(operator_name="operator 3"),
+            "availability day": OperatorAvailability.objects.filter(operator_id=3, booking_date=day),
+            "availability range": OperatorAvailability.objects.filter(
+                operator_id=3, booking_date__range=(day, day + timedelta(days=13))
+            ),
+            "availability batch": OperatorAvailability.objects.filter(
+                operator_id__in=[3, 4], booking_date__in=[day, day + timedelta(days=1)]
+            ),
+        }
+
+    def test_hot_queries_use_an_index(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                scans = [line for line in plan.splitlines() if FULL_SCAN.search(line)]
+                self.assertFalse(scans, f"full table scan in query plan:\n{plan}")
+
+
+class AvailabilityRangeTests(AgencyTestCase):
+    def view(self, **params):
+        return self.client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "false", **params})
+
+    def test_every_day_of_the_range_is_listed(self):
+        today = date.today()
+        self.book(today)
+        self.book(today + timedelta(days=1), "13:00:00", "14:00:00")
+        self.book(today + timedelta(days=1), "14:00:00", "15:00:00")
+        params = {"start_date": str(today), "end_date": str(today + timedelta(days=2))}
+        body = self.view(**params).json()
+        self.assertEqual(body["days"], [
+            {"booking_date": str(today), "slots": ["00:00:00-10:00:00", "11:00:00-24:00:00"]},
+            {"booking_date": str(today + timedelta(days=1)), "slots": ["00:00:00-13:00:00", "15:00:00-24:00:00"]},
+            {"booking_date": str(today + timedelta(days=2)), "slots": ["00:00:00-24:00:00"]},
+        ])
+        booked = self.view(view_booked_slots="true", **params).json()["days"]
+        self.assertEqual(
+            [day["slots"] for day in booked],
+            [["10:00:00-11:00:00"], ["13:00:00-14:00:00", "14:00:00-15:00:00"], []],
+        )
+
+    def test_queries_do_not_grow_with_the_range(self):
+        operators.exists(1)
+        counts = []
+        for days in (1, 31):
+            with CaptureQueriesContext(connection) as queries:
+                body = self.view(start_date=str(date.today()), end_date=str(date.today() + timedelta(days=days - 1))).json()
+            self.assertEqual(len(body["days"]), days)
+            counts.append(len(queries))
+        self.assertEqual(counts, [1, 1])
+
+    def test_invalid_ranges_are_refused(self):
+        today = date.today()
+        self.assertEqual(self.view(start_date=str(today)).status_code, 400)
+        self.assertEqual(self.view(start_date=str(today), end_date=str(today - timedelta(days=1))).status_code, 400)
+        self.assertEqual(self.view(start_date=str(today), end_date=str(today + timedelta(days=31))).status_code, 400)
+        response = self.view(operator_id="404", start_date=str(today), end_date=str(today))
+        self.assertEqual(response.status_code, 404)
+
+
+class AvailableOperatorsTests(AgencyTestCase):
+    def setUp(self):
+        super().setUp()
+        for operator_id in (2, 3, 4):
+            Operator.objects.create(id=operator_id, operator_name=f"operator {operator_id}")
+
+    def search(self, **params):
+        return self.client.get("/agency/operator/available", {"booking_date": str(date.today()), **params})
+
+    def available(self, **params):
+        return [operator["operator_id"] for operator in self.search(**params).json()["operators"]]
+
+    def test_booked_operators_are_left_out(self):
+        self.book(operator_id="2")
+        self.book(operator_id="3", start_time="09:00:00", end_time="10:00:00")
+        self.book(operator_id="4", start_time="11:00:00", end_time="12:00:00")
+        self.assertEqual(self.available(slot="10:00:00-11:00:00"), ["1", "3", "4"])
+        self.assertEqual(self.available(slot="09:00:00-10:00:00", end_slot="10:00:00-11:00:00"), ["1", "4"])
+        self.assertEqual(self.available(slot="08:00:00-09:00:00"), ["1", "2", "3", "4"])
+        self.assertEqual(self.available(slot="10:00:00-11:00:00", booking_date=str(date.today() + timedelta(days=1))), ["1", "2", "3", "4"])
+
+    def test_pages_follow_the_operator_id(self):
+        self.book(operator_id="2")
+        pages = []
+        params = {"slot": "10:00:00-11:00:00", "limit": 1}
+        while True:
+            body = self.search(**params).json()
+            pages.append([operator["operator_id"] for operator in body["operators"]])
+            if body["next"] is None:
+                break
+            params["after"] = body["next"]
+        self.assertEqual(pages, [["1"], ["3"], ["4"]])
+
+    def test_one_query_per_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(slot="10:00:00-11:00:00", limit=2, after=1)
+        self.assertEqual(len(queries), 1)
+
+    def test_invalid_windows_are_refused(self):
+        self.assertEqual(self.search(slot="10:00:00-11:00:00", end_slot="09:00:00-10:00:00").status_code, 400)
+        self.assertEqual(self.search(slot="10:30:00-11:30:00").status_code, 400)
+
+
+class VersionedCacheTests(AgencyTestCase):
+    def view(self):
+        return self.client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "true"}).json()["slots"]
+
+    def version(self):
+        return availability_cache.get_version(1, date.today())
+
+    def stats(self):
+        return self.client.get("/agency/cache/stats").json()
+
+    def test_every_booking_write_bumps_the_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking_id = self.book().json()["booking_id"]
+        versions = [self.version()]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch("/agency/slot_booking", {
+                "booking_id": booking_id, "booking_date": str(date.today()), "start_time": "15:00:00", "end_time": "16:00:00",
+            }, content_type="application/json")
+        versions.append(self.version())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        versions.append(self.version())
+        self.assertEqual(versions, sorted(set(versions)))
+        # a refused write leaves the version alone
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/agency/cancel_booking/{booking_id}")
+        self.assertEqual(self.version(), versions[-1])
+
+    def test_reads_are_served_from_the_cache_until_a_write(self):
+        before = self.stats()
+        self.assertEqual(self.view(), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.view(), [])
+        after = self.stats()
+        self.assertEqual((after["hits"] - before["hits"], after["misses"] - before["misses"]), (1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book()
+        self.assertEqual(self.view(), ["10:00:00-11:00:00"])
+        self.assertEqual(self.stats()["misses"] - after["misses"], 1)
+
+    def test_lost_version_does_not_revive_old_entries(self):
+        self.view()
+        old = self.version()
+        caches[settings.AVAILABILITY_CACHE_ALIAS].delete(f"availability:version:1:{date.today()}")
+        self.assertNotEqual(self.version(), old)
+
+
+class AsyncViewParityTests(AgencyTransactionTestCase):
+    # the same requests through the WSGI handler (Client) and the ASGI
+    # handler (AsyncClient) on the same paths, the async views must answer
+    # like the sync ones
+
+    def reset(self):
+        for model in (Booking, BookingEvent, OperatorAvailability, OperatorUtilization, Operator):
+            model.objects.all().delete()
+        self.setUp()
+
+    def scenario(self, client):
+        # (status, normalized body, has ETag) of every request
+        call = client if isinstance(client, Client) else AsyncCallWrapper(client)
+        today = date.today()
+        slot = {"operator_id": "1", "booking_date": str(today), "start_time": "10:00:00", "end_time": "11:00:00"}
+        json_body = {"content_type": "application/json"}
+        responses = []
+        booking = call.post("/agency/slot_booking", slot, **json_body)
+        booking_id = booking.json()["booking_id"]
+        responses.append(booking)
+        responses.append(call.post("/agency/slot_booking", slot, **json_body))
+        responses.append(call.post("/agency/slot_booking", {**slot, "operator_id": "404"}, **json_body))
+        responses.append(call.post("/agency/slot_booking", {**slot, "booking_date": "not a date"}, **json_body))
+        responses.append(call.post("/agency/slot_booking", {**slot, "start_time": "10:30:00"}, **json_body))
+        responses.append(call.post("/agency/slot_booking", "{", **json_body))
+        day = call.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "true"})
+        responses.append(day)
+        responses.append(call.get(
+            "/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "true"}, headers={"If-None-Match": day["ETag"]}
+        ))
+        responses.append(call.get("/agency/slot_booking", {"operator_id": "1", "booking_date": str(today + timedelta(days=1))}))
+        responses.append(call.get("/agency/slot_booking", {"operator_id": "404"}))
+        responses.append(call.patch("/agency/slot_booking", {**slot, "booking_id": booking_id, "start_time": "13:00:00", "end_time": "14:00:00"}, **json_body))
+        responses.append(call.patch("/agency/slot_booking", {**slot, "booking_id": "404"}, **json_body))
+        responses.append(call.get("/agency/slot_booking", {
+            "operator_id": "1", "view_booked_slots": "false", "start_date": str(today), "end_date": str(today + timedelta(days=1)),
+        }))
+        responses.append(call.delete(f"/agency/cancel_booking/{booking_id}"))
+        responses.append(call.delete(f"/agency/cancel_booking/{booking_id}"))
+        responses.append(call.delete("/agency/cancel_booking/404"))
+        responses.append(call.post("/agency/operator/add", {"name": "second"}, **json_body))
+        responses.append(call.post("/agency/operator/add", {"name": "second"}, **json_body))
+        responses.append(call.post("/agency/operator/add", {"name": ""}, **json_body))
+        responses.append(call.get("/agency/bookings/events", {"after": 0, "operator_id": "1"}))
+        responses.append(call.get("/agency/bookings/events", {"operator_id": "404"}))
+        responses.append(call.get("/agency/bookings/events", {"limit": 0}))
+        return [
+            (response.status_code, normalized(response.json()) if response.content else None, "ETag" in response)
+            for response in responses
+        ]
+
+    def test_async_views_answer_like_the_sync_views(self):
+        sync = self.scenario(self.client)
+        self.reset()
+        self.assertEqual(self.scenario(self.async_client), sync)
+        self.assertEqual([status for status, _, _ in sync], [
+            200, 400, 404, 400, 422, 400, 200, 304, 412, 404, 200, 404, 200, 200, 404, 404, 200, 400, 400, 200, 404, 400,
+        ])
+
+    def test_asgi_requests_are_served_by_the_async_views(self):
+        call = AsyncCallWrapper(self.async_client)
+        for path, sync_view, async_view in (
+            ("/agency/slot_booking", SlotBooking, AsyncSlotBooking),
+            ("/agency/cancel_booking/1", CancelBooking, AsyncCancelBooking),
+            ("/agency/bookings/events", BookingFeed, AsyncBookingFeed),
+            ("/agency/cache/stats", AvailabilityCacheStats, AvailabilityCacheStats),
+        ):
+            with self.subTest(path):
+                self.assertIs(self.client.get(path).wsgi_request.resolver_match.func.view_class, sync_view)
+                self.assertIs(call.get(path).asgi_request.resolver_match.func.view_class, async_view)
+
+
+class AsyncCallWrapper:
+    # calls an AsyncClient from synchronous test code
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            return await getattr(self.client, method)(*args, **kwargs)
+        return async_to_sync(call)
+
+
+def normalized(body):
+    # the body with the generated ids, offsets and timestamps masked
+    if isinstance(body, list):
+        return [normalized(item) for item in body]
+    if isinstance(body, dict):
+        return {
+            key: "<masked>" if key in {"booking_id", "operator_id", "offset", "cursor", "timestamp"} else normalized(value)
+            for key, value in body.items()
+        }
+    return body
+
+
+class MetricsTests(AgencyTestCase):
+    def sample(self, name, **labels):
+        # the value of one series on the scrape endpoint, 0 when it is absent
+        response = self.client.get("/agency/metrics")
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        wanted = ",".join(f'{label}="{value}"' for label, value in labels.items())
+        for line in response.content.decode().splitlines():
+            if line.startswith(f"{name}{{{wanted}}} "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0
+
+    def test_requests_are_recorded_per_endpoint(self):
+        batch = {"endpoint": "slot-booking-batch", "method": "POST"}
+        before = {
+            "count": self.sample("agency_request_duration_seconds_count", **batch),
+            "validation": self.sample("agency_validation_duration_seconds_count", **batch),
+            "queries": self.sample("agency_db_queries_sum", **batch),
+            "ok": self.sample("agency_responses_total", **batch, status=200),
+            "bad": self.sample("agency_responses_total", **batch, status=400),
+        }
+        item = {"operator_id": "1", "booking_date": str(date.today()), "start_time": "09:00:00", "end_time": "10:00:00"}
+        response = self.client.post("/agency/slot_booking/batch", {"bookings": [item, {**item, "booking_date": "x"}]}, content_type="application/json")
+        self.assertEqual(response.json()["created"], 1)
+        self.client.post("/agency/slot_booking/batch", {"bookings": []}, content_type="application/json")
+        after = {
+            "count": self.sample("agency_request_duration_seconds_count", **batch),
+            "validation": self.sample("agency_validation_duration_seconds_count", **batch),
+            "queries": self.sample("agency_db_queries_sum", **batch),
+            "ok": self.sample("agency_responses_total", **batch, status=200),
+            "bad": self.sample("agency_responses_total", **batch, status=400),
+        }
+        self.assertEqual(after["count"] - before["count"], 2)
+        self.assertEqual(after["validation"] - before["validation"], 2)
+        self.assertGreater(after["queries"], before["queries"])
+        self.assertEqual((after["ok"] - before["ok"], after["bad"] - before["bad"]), (1, 1))
+
+    def test_request_log_is_opt_in(self):
+        logger = logging.getLogger("service_agency.requests")
+        # AGENCY_LOG_LEVEL defaults to WARNING
+        self.assertFalse(logger.isEnabledFor(logging.INFO))
+        with self.assertLogs(logger, "INFO") as logs:
+            self.book(start_time="11:00:00", end_time="12:00:00")
+        entry = json.loads(JsonFormatter().format(logs.records[0]))
+        self.assertEqual(
+            {key: entry[key] for key in ("message", "endpoint", "method", "status")},
+            {"message": "request", "endpoint": "slot-booking", "method": "POST", "status": 200},
+        )
+        self.assertGreater(entry["queries"], 0)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        operators.clear()
+
+    def test_seeded_masks_match_the_bookings(self):
+        operator_ids, dates, booking_ids = seed(random.Random(1), 3, 4, 0.3)
+        self.assertEqual((len(operator_ids), len(dates)), (3, 4))
+        self.assertEqual(Booking.objects.count(), len(booking_ids))
+        self.assertEqual(OperatorAvailability.objects.count(), 12)
+        masks = {}
+        for booking in Booking.objects.all():
+            key = (booking.operator_id, booking.booking_date)
+            masks[key] = masks.get(key, 0) | interval_bits(*booking_interval(booking.start_time, booking.end_time))
+        for day in OperatorAvailability.objects.all():
+            self.assertEqual(day.mask, masks.get((day.operator_id, day.booking_date), 0))
+        # the utilization rows are those a rebuild would write
+        self.assertTrue(OperatorUtilization.objects.exists())
+        self.assertEqual(utilization.replace(operator_ids, booked_minutes(operator_ids)), 0)
+        # the same seed seeds the same bookings
+        self.assertEqual(len(seed(random.Random(1), 3, 4, 0.3)[2]), len(booking_ids))
+
+    def test_every_operation_is_driven_and_timed(self):
+        rng = random.Random(2)
+        run = Run(self.client, rng, *seed(rng, 2, 2, 0.3))
+        mix = dict.fromkeys(OPERATIONS, 1.0)
+        for _ in range(60):
+            run.step(mix)
+        self.assertEqual(set(run.latencies), set(OPERATIONS))
+        self.assertEqual(sum(map(len, run.latencies.values())), 60)
+        for operation, codes in run.status_codes.items():
+            self.assertFalse([code for code in codes if code.startswith("5")], operation)
+        self.assertIn("200", run.status_codes["read"])
+
+    def test_mix_is_checked(self):
+        command = BenchmarkCommand()
+        self.assertEqual(command.parse_mix("read=3, book=1"), {"read": 3.0, "book": 1.0})
+        for mix in ("write=1", "read=x", "read=0"):
+            with self.subTest(mix), self.assertRaises(CommandError):
+                command.parse_mix(mix)
+
+    def test_percentiles_use_the_nearest_rank(self):
+        row = summarize([0.004, 0.001, 0.003, 0.002], 2.0)
+        self.assertEqual(row["requests"], 4)
+        self.assertEqual(row["throughput_rps"], 2.0)
+        self.assertEqual((row["p50_ms"], row["p95_ms"], row["p99_ms"]), (2.0, 4.0, 4.0))
+        self.assertEqual(summarize([], 0)["p99_ms"], 0.0)
+
+
+class ImportBookingsTests(TestCase):
+    def setUp(self):
+        operators.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as output:
+            output.write(text)
+        return path
+
+    def rejects(self, path):
+        with open(path) as rejects:
+            return [json.loads(line) for line in rejects]
+
+    def test_rows_are_imported_and_rejects_written(self):
+        operators_path = self.write("operators.csv", "id,name\n7,seven\nlegacy-8,eight\n,seven\n9,\n")
+        bookings_path = self.write("bookings.jsonl", "\n".join([
+            '{"booking_id": "100", "operator_id": "7", "booking_date": "2023-10-16", "start_time": "09:00:00", "end_time": "10:00:00"}',
+            '{"booking_id": "old-1", "operator_id": "legacy-8", "booking_date": "2023-10-16", "start_time": "09:00:00", "end_time": "10:00:00"}',
+            '{"operator_id": "7", "booking_date": "2023-10-16", "start_time": "09:00:00", "end_time": "10:00:00"}',
+            '{"operator_id": "7", "booking_date": "2023-10-16", "start_time": "09:00:00", "end_time": "10:00:00", "status": "cancelled"}',
+            '{"booking_id": "100", "operator_id": "7", "booking_date": "2023-10-17", "start_time": "09:00:00", "end_time": "10:00:00"}',
+            '{"operator_id": "404", "booking_date": "2023-10-16", "start_time": "09:00:00", "end_time": "10:00:00"}',
+            '{"operator_id": "7", "booking_date": "2023-10-16", "start_time": "11:00:00", "end_time": "13:00:00"}',
+            '{"operator_id": "7", "booking_date": "2023-10-16", "start_time": "12:00:00", "end_time": "13:00:00", "status": "done"}',
+            "not json",
+            "[1]",
+            '{"operator_id": "7", "booking_date": "16/10/2023", "start_time": "09:00:00", "end_time": "10:00:00"}',
+        ]) + "\n")
+        stdout = StringIO()
+        # chunks of two rows, the duplicate id and slot are found across chunks
+        call_command("import_bookings", operators=operators_path, bookings=bookings_path, chunk_size=2, stdout=stdout)
+
+        self.assertEqual(dict(Operator.objects.values_list("operator_name", "legacy_id")), {"seven": None, "eight": "legacy-8"})
+        self.assertEqual(Operator.objects.get(operator_name="seven").id, 7)
+        self.assertEqual(
+            sorted((error["line"], str(error["errors"])) for error in self.rejects(f"{operators_path}.rejects.jsonl")),
+            [(4, "Operator already exists"), (5, str({"name": ["This field is required."]}))],
+        )
+        rejected = sorted(self.rejects(f"{bookings_path}.rejects.jsonl"), key=lambda error: error["line"])
+        self.assertEqual([error["line"] for error in rejected], [3, 5, 6, 7, 8, 9, 10, 11])
+        self.assertEqual(rejected[0]["errors"], "Booking already exists, please slelect some other slot or date")
+        self.assertEqual(rejected[1]["errors"], "Booking id already exists")
+        self.assertEqual(rejected[2]["errors"], "Operator not registered")
+        self.assertEqual(rejected[3]["errors"], "Booking should be for max 1 hour")
+        self.assertIn("status", rejected[4]["errors"])
+        self.assertTrue(rejected[5]["errors"].startswith("invalid JSON"))
+        self.assertEqual(rejected[6]["errors"], "row must be a JSON object")
+        self.assertIn("booking_date", rejected[7]["errors"])
+
+        self.assertEqual(Booking.objects.filter(status="booked").count(), 2)
+        self.assertEqual(Booking.objects.filter(status="cancelled", is_cancelled=True).count(), 1)
+        self.assertTrue(Booking.objects.filter(booking_id=100, operator_id=7).exists())
+        legacy = Booking.objects.get(legacy_id="old-1")
+        self.assertEqual(legacy.operator_id, Operator.objects.get(legacy_id="legacy-8").id)
+        day = OperatorAvailability.objects.get(operator_id=7, booking_date=date(2023, 10, 16))
+        self.assertEqual(day.mask, interval_bits(540, 600))
+        self.assertIn("imported 3 rows, rejected 8 rows", stdout.getvalue())
+        self.assertIn("rows/s", stdout.getvalue())
+
+    def test_format_and_options_are_checked(self):
+        for options in ({}, {"bookings": self.write("bookings.txt", "")}, {"bookings": self.write("b.csv", ""), "chunk_size": 0}):
+            with self.subTest(options), self.assertRaises(CommandError):
+                call_command("import_bookings", stdout=StringIO(), **options)
+
+
+class ExportBookingsTests(AgencyTestCase):
+    def setUp(self):
+        super().setUp()
+        Operator.objects.create(id=2, operator_name="second")
+        today = date.today()
+        self.first = self.book(today).json()["booking_id"]
+        self.second = self.book(today - timedelta(days=1), operator_id="2").json()["booking_id"]
+        self.third = self.book(today - timedelta(days=2), "12:00:00", "13:00:00").json()["booking_id"]
+        self.client.delete(f"/agency/cancel_booking/{self.third}")
+
+    def export(self, **params):
+        response = self.client.get("/agency/bookings/export", params)
+        self.assertTrue(response.streaming)
+        return response, b"".join(response.streaming_content).decode()
+
+    def exported_ids(self, **params):
+        _, body = self.export(**params)
+        return [row["booking_id"] for row in map(json.loads, body.splitlines())]
+
+    def test_filters_select_the_rows(self):
+        self.assertEqual(self.exported_ids(), sorted([self.first, self.second, self.third], key=int))
+        self.assertEqual(self.exported_ids(operator_id="2"), [self.second])
+        self.assertEqual(self.exported_ids(start_date=str(date.today() - timedelta(days=1))), sorted([self.first, self.second], key=int))
+        self.assertEqual(self.exported_ids(end_date=str(date.today() - timedelta(days=1))), sorted([self.second, self.third], key=int))
+        self.assertEqual(self.exported_ids(status="cancelled"), [self.third])
+        self.assertEqual(self.client.get("/agency/bookings/export", {"operator_id": "missing"}).status_code, 404)
+        self.assertEqual(self.client.get("/agency/bookings/export", {"status": "gone"}).status_code, 400)
+
+    def test_ndjson_and_csv_rows(self):
+        response, body = self.export(operator_id="2")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        row = json.loads(body)
+        self.assertEqual(
+            {key: row[key] for key in ("booking_id", "operator_id", "status", "start_time", "is_cancelled")},
+            {"booking_id": self.second, "operator_id": "2", "status": "booked", "start_time": "10:00:00", "is_cancelled": False},
+        )
+        response, body = self.export(output="csv", status="cancelled")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="bookings.csv"')
+        header, line = list(csv.reader(StringIO(body)))
+        self.assertEqual(tuple(header), exports.EXPORT_FIELDS)
+        self.assertEqual(line[:3], [self.third, "1", "cancelled"])
+
+    def test_rows_are_read_in_chunks(self):
+        querysets = exports.export_querysets()
+        self.assertEqual([row[0] for row in exports.iter_rows(querysets, chunk_size=1)], sorted(
+            [int(self.first), int(self.second), int(self.third)]
+        ))
+
+    def test_command_writes_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bookings.csv")
+            stderr = StringIO()
+            call_command("export_bookings", format="csv", output=path, operator="1", chunk_size=1, stderr=stderr)
+            with open(path, newline="") as exported:
+                rows = list(csv.DictReader(exported))
+        self.assertEqual([row["booking_id"] for row in rows], sorted([self.first, self.third], key=int))
+        self.assertIn("exported 2 bookings", stderr.getvalue())
+        stdout = StringIO()
+        call_command("export_bookings", status="booked", stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 2)
+        for options in ({"start_date": "16/10/2023"}, {"operator": "missing"}):
+            with self.subTest(options), self.assertRaises(CommandError):
+                call_command("export_bookings", stdout=StringIO(), **options)
+
+
+class SnowflakeIdTests(SimpleTestCase):
+    def test_ids_grow_and_carry_the_worker(self):
+        generator = ids.Generator(5)
+        values = [generator.next_id() for _ in range(10000)]
+        self.assertEqual(values, sorted(set(values)))
+        self.assertEqual({(value >> ids.SEQUENCE_BITS) & ids.MAX_WORKER for value in values}, {5})
+        self.assertLessEqual(abs(ids.timestamp_ms(values[0]) - time_module.time() * 1000), 1000)
+        with self.assertRaises(ValueError):
+            ids.Generator(ids.MAX_WORKER + 1)
+
+    def test_production_requires_a_worker_directory(self):
+        with override_settings(SQLITE_PRODUCTION=True, ID_WORKER_DIR=""), self.assertRaises(ImproperlyConfigured):
+            ids.check_settings()
+        for production, directory in ((True, "/tmp/workers"), (False, "")):
+            with override_settings(SQLITE_PRODUCTION=production, ID_WORKER_DIR=directory):
+                ids.check_settings()
+
+    @unittest.skipIf(ids.fcntl is None, "file locks need fcntl")
+    def test_live_leases_never_share_a_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, first_lease = ids.lease_worker(directory)
+            second, second_lease = ids.lease_worker(directory)
+            self.assertNotEqual(first, second)
+            # a released worker id can be leased again
+            first_lease.close()
+            third, third_lease = ids.lease_worker(directory)
+            self.assertEqual(third, first)
+            second_lease.close()
+            third_lease.close()
+
+    @unittest.skipIf(ids.fcntl is None, "file locks need fcntl")
+    def test_forked_processes_lease_their_own_worker(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(ID_WORKER_DIR=directory):
+            ids._forget_generator()
+            self.addCleanup(ids._forget_generator)
+            parent = (ids.next_id() >> ids.SEQUENCE_BITS) & ids.MAX_WORKER
+            read, write = os.pipe()
+            pid = os.fork()
+            if not pid:
+                os.close(read)
+                os.write(write, str((ids.next_id() >> ids.SEQUENCE_BITS) & ids.MAX_WORKER).encode())
+                os._exit(0)
+            os.close(write)
+            with os.fdopen(read) as child:
+                child_worker = int(child.read())
+            os.waitpid(pid, 0)
+            self.assertNotEqual(child_worker, parent)
+            # the child's exit did not release the parent's lease
+            self.assertNotEqual(ids.lease_worker(directory)[0], parent)
+
+    def test_parse_accepts_64_bit_decimal_strings(self):
+        self.assertEqual(ids.parse("42"), 42)
+        self.assertEqual(ids.parse(str(ids.MAX_ID)), ids.MAX_ID)
+        for value in (str(ids.MAX_ID + 1), "123456789012345678901234", "-1", "4 2", "٤٢", ""):
+            self.assertIsNone(ids.parse(value), value)
+
+
+class IdCollisionTests(AgencyTestCase):
+    # an id handed out twice is retried with a new one instead of being
+    # reported as a taken slot or a duplicate name
+
+    def test_booking_retries_an_id_in_use(self):
+        taken = int(self.book().json()["booking_id"])
+        fresh = ids.next_id()
+        with unittest.mock.patch("service_agency.ids.next_id", side_effect=[taken, fresh]):
+            response = self.book(start_time="12:00:00", end_time="13:00:00")
+        self.assertEqual(response.json(), {"sCode": 200, "message": "Booking succesfully created", "booking_id": str(fresh)})
+        # a taken slot is still a taken slot
+        self.assertEqual(self.book().json()["message"], "Booking already exists, please slelect some other slot or date")
+
+    def test_operator_retries_an_id_in_use(self):
+        fresh = ids.next_id()
+        with unittest.mock.patch("service_agency.ids.next_id", side_effect=[1, fresh]):
+            response = self.client.post("/agency/operator/add", {"name": "second"}, content_type="application/json")
+        self.assertEqual(response.json()["operator_id"], str(fresh))
+        response = self.client.post("/agency/operator/add", {"name": "second"}, content_type="application/json")
+        self.assertEqual(response.json(), {"sCode": 400, "message": "Operator already exists"})
+
+
+class SnowflakeMigrationTests(MigrationTestCase):
+    migrate_from = "0005_booking_slot_operator_idx"
+    migrate_to = "0006_snowflake_ids"
+
+    def test_legacy_ids_are_remapped_in_creation_order(self):
+        Operator = self.apps.get_model("service_agency", "Operator")
+        Booking = self.apps.get_model("service_agency", "Booking")
+        OperatorAvailability = self.apps.get_model("service_agency", "OperatorAvailability")
+        legacy_operator = "123456789012345678901234"
+        Operator.objects.create(id=legacy_operator, operator_name="legacy")
+        Operator.objects.create(id="42", operator_name="kept")
+        day = date(2023, 10, 16)
+        created = timezone.now() - timedelta(days=30)
+        for index, booking_id in enumerate(("900000000000000000000002", "900000000000000000000001", "77")):
+            Booking.objects.create(
+                booking_id=booking_id, operator_id=legacy_operator if index < 2 else "42", booking_date=day,
+                start_time=time(9 + index), end_time=time(10 + index), status="booked",
+            )
+            Booking.objects.filter(booking_id=booking_id).update(timestamp=created + timedelta(minutes=index))
+        OperatorAvailability.objects.create(operator_id=legacy_operator, booking_date=day, booked_mask=(1 << 9) | (1 << 10))
+
+        apps = self.migrate()
+        Operator = apps.get_model("service_agency", "Operator")
+        Booking = apps.get_model("service_agency", "Booking")
+        OperatorAvailability = apps.get_model("service_agency", "OperatorAvailability")
+        remapped = Operator.objects.get(legacy_id=legacy_operator)
+        self.assertIsNone(Operator.objects.get(id=42).legacy_id)
+        self.assertEqual(OperatorAvailability.objects.get().operator_id, remapped.id)
+        first, second = Booking.objects.filter(operator_id=remapped.id).order_by("booking_id")
+        # the older booking gets the smaller id, both from worker 0
+        self.assertEqual((first.legacy_id, second.legacy_id), ("900000000000000000000002", "900000000000000000000001"))
+        self.assertEqual(ids.timestamp_ms(first.booking_id), int(created.timestamp() * 1000))
+        self.assertEqual((first.booking_id >> ids.SEQUENCE_BITS) & ids.MAX_WORKER, 0)
+        kept = Booking.objects.get(booking_id=77)
+        self.assertEqual((kept.operator_id, kept.legacy_id), (42, None))
+
+
+class SlotEngineTests(AgencyTestCase):
+    def test_runs_and_labels(self):
+        mask = interval_bits(0, 15) | interval_bits(600, 660) | interval_bits(1380, 1440)
+        self.assertEqual(list(runs(mask)), [(0, 15), (600, 660), (1380, 1440)])
+        self.assertEqual(list(runs(0)), [])
+        self.assertEqual(booking_interval(time(23), time(0)), (1380, 1440))
+        self.assertEqual(parse_slot("23:00:00-00:00:00"), (1380, 1440))
+        self.assertEqual(free_slots(mask), ["00:15:00-10:00:00", "11:00:00-23:00:00"])
+        with override_settings(SLOT_MINUTES=15):
+            self.assertEqual(len(all_slots()), 96)
+            self.assertEqual(all_slots()[-1], "23:45:00-00:00:00")
+            # a run that does not follow the grid marks every slot it touches
+            self.assertEqual(booked_slots(interval_bits(600, 620)), ["10:00:00-10:15:00", "10:15:00-10:30:00"])
+
+    def test_grid_settings_are_checked(self):
+        for size, longest in ((7, 60), (15, 50), (30, 15)):
+            with self.subTest(size=size, longest=longest), override_settings(SLOT_MINUTES=size, MAX_BOOKING_MINUTES=longest):
+                with self.assertRaises(ImproperlyConfigured):
+                    check_slot_settings()
+
+    @override_settings(SLOT_MINUTES=15, MAX_BOOKING_MINUTES=120)
+    def test_bookings_on_a_quarter_hour_grid(self):
+        self.assertEqual(self.book(start_time="10:00:00", end_time="10:45:00").status_code, 200)
+        # overlapping intervals conflict, adjacent ones do not
+        self.assertEqual(self.book(start_time="10:30:00", end_time="11:00:00").status_code, 400)
+        self.assertEqual(self.book(start_time="10:45:00", end_time="12:45:00").status_code, 200)
+        self.assertEqual(self.book(start_time="23:45:00", end_time="00:00:00").status_code, 200)
+
+        off_grid = self.book(start_time="13:10:00", end_time="13:25:00")
+        self.assertEqual(off_grid.status_code, 422)
+        self.assertEqual(off_grid.json()["message"], "Booking must start on a 15 minute slot boundary")
+        self.assertEqual(self.book(start_time="13:00:00", end_time="13:20:00").status_code, 422)
+        self.assertEqual(self.book(start_time="13:00:00", end_time="15:15:00").status_code, 422)
+        self.assertEqual(self.book(start_time="13:00:30", end_time="13:15:30").status_code, 422)
+        self.assertEqual(self.book(start_time="14:00:00", end_time="13:00:00").status_code, 412)
+
+        slots = self.client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "true"}).json()["slots"]
+        self.assertEqual(len(slots), 3 + 8 + 1)
+        self.assertEqual((slots[0], slots[-1]), ("10:00:00-10:15:00", "23:45:00-00:00:00"))
+        free = self.client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "false"}).json()["slots"]
+        self.assertEqual(free, ["00:00:00-10:00:00", "12:45:00-23:45:00"])
+
+    def test_default_grid_keeps_the_hourly_messages(self):
+        self.assertEqual(self.book(start_time="10:00:00", end_time="12:00:00").json()["message"], "Booking should be for max 1 hour")
+        self.assertEqual(
+            self.book(start_time="10:30:00", end_time="11:30:00").json()["message"],
+            "Booking must start on a 60 minute slot boundary",
+        )
+
+
+class ArchiveTests(AgencyTestCase):
+    def old_booking(self, booking_id, legacy_id=None, start_time=time(9), status="booked"):
+        return Booking.objects.create(
+            booking_id=booking_id, legacy_id=legacy_id, operator_id=1, status=status,
+            booking_date=date.today() - timedelta(days=400), start_time=start_time,
+            end_time=time(start_time.hour + 1), is_cancelled=status == "cancelled",
+        )
+
+    def test_archive_round_trip(self):
+        hot = self.book().json()["booking_id"]
+        moved = [self.old_booking(101), self.old_booking(102, "old-2", time(10)), self.old_booking(103, status="cancelled")]
+        expected = {booking.booking_id: booking for booking in moved}
+        stdout = StringIO()
+        call_command("archive_bookings", older_than_days=180, chunk_size=2, stdout=stdout)
+
+        self.assertIn("archived 3 bookings in 2 chunks", stdout.getvalue())
+        self.assertEqual([str(booking_id) for booking_id in Booking.objects.values_list("booking_id", flat=True)], [hot])
+        for archived in BookingArchive.objects.all():
+            booking = expected.pop(archived.booking_id)
+            for field in ("timestamp", "legacy_id", "operator_id", "status", "booking_date", "start_time", "end_time", "is_cancelled"):
+                self.assertEqual(getattr(archived, field), getattr(booking, field), field)
+        self.assertEqual(expected, {})
+
+        self.assertEqual(self.client.get("/agency/booking/102").status_code, 404)
+        detail = self.client.get("/agency/booking/102", {"include_archived": "true"}).json()["booking"]
+        self.assertEqual((detail["archived"], detail["start_time"]), (True, "10:00:00"))
+        self.assertEqual(sum(queryset.count() for queryset in exports.export_querysets(include_archived=True)), 4)
+
+        # a second run finds nothing left to move
+        stdout = StringIO()
+        call_command("archive_bookings", older_than_days=180, stdout=stdout)
+        self.assertIn("archived 0 bookings in 0 chunks", stdout.getvalue())
+
+    def test_chunk_with_an_archived_id_is_not_deleted(self):
+        self.old_booking(101)
+        call_command("archive_bookings", older_than_days=180, stdout=StringIO())
+        # the same booking_id shows up in the hot table again, e.g. restored
+        # from a backup, next to a booking that could be moved
+        self.old_booking(100, start_time=time(8))
+        self.old_booking(101)
+        with self.assertRaisesMessage(CommandError, "already archived: 101"):
+            call_command("archive_bookings", older_than_days=180, stdout=StringIO())
+        self.assertEqual(sorted(Booking.objects.values_list("booking_id", flat=True)), [100, 101])
+        self.assertEqual(list(BookingArchive.objects.values_list("booking_id", flat=True)), [101])
+
+    def test_import_does_not_reuse_archived_ids(self):
+        self.old_booking(101, "old-1")
+        call_command("archive_bookings", older_than_days=180, stdout=StringIO())
+        payload = {"operator_id": "1", "booking_date": str(date.today()), "start_time": "10:00:00", "end_time": "11:00:00"}
+        results = create_bookings([
+            {**payload, "booking_id": "101"},
+            {**payload, "booking_id": "old-1"},
+            {**payload, "booking_id": "102"},
+        ], keep_ids=True)
+        self.assertEqual(
+            [(result["sCode"], result["message"]) for result in results[:2]],
+            [(400, "Booking id already exists")] * 2,
+        )
+        self.assertEqual(results[2]["sCode"], 200)
+        self.assertEqual(list(Booking.objects.values_list("booking_id", flat=True)), [102])
+
+    def test_import_adds_no_events(self):
+        payload = {"operator_id": "1", "booking_date": str(date.today()), "start_time": "10:00:00", "end_time": "11:00:00"}
+        results = create_bookings([
+            {**payload, "booking_id": "103"},
+            {**payload, "booking_id": "old-2", "status": "cancelled"},
+        ], keep_ids=True)
+        self.assertEqual([result["sCode"] for result in results], [200, 200])
+        self.assertFalse(BookingEvent.objects.exists())
+        # the batch endpoint books new bookings and announces them
+        results = create_bookings([{**payload, "start_time": "11:00:00", "end_time": "12:00:00"}])
+        self.assertEqual(
+            list(BookingEvent.objects.values_list("kind", "booking_id")),
+            [("created", int(results[0]["booking_id"]))],
+        )
+
+
+@override_settings(READ_DATABASE="replica")
+class ReplicaAvailabilityTests(AgencyTestCase):
+    # the test database as primary and a migrated sqlite file as replica,
+    # the replica is brought up to date by copying rows into it
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings["replica"] = {
+            **connections["default"].settings_dict, "NAME": os.path.join(directory.name, "replica.sqlite3"),
+        }
+        self.addCleanup(self.drop_replica)
+        call_command("migrate", database="replica", verbosity=0)
+        Operator.objects.using("replica").create(id=1, operator_name="operator")
+
+    def drop_replica(self):
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+
+    def sync(self):
+        OperatorAvailability.objects.using("replica").all().delete()
+        OperatorAvailability.objects.using("replica").bulk_create(OperatorAvailability.objects.using("default").all())
+
+    def booked(self, client, **extra):
+        return client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "true"}, **extra)
+
+    def test_single_day_reads_follow_the_replica(self):
+        self.assertEqual(self.book().status_code, 200)
+        reader = Client()
+
+        # the replica has not seen the booking yet, the read neither goes to
+        # the primary nor caches the old slots under the new write
+        with CaptureQueriesContext(connection) as primary:
+            lagging = self.booked(reader)
+        self.assertEqual(len(primary), 0)
+        self.assertEqual(lagging.json()["slots"], [])
+        self.assertEqual(lagging["ETag"], etag(date.today(), 0, True))
+
+        self.sync()
+        current = self.booked(reader, HTTP_IF_NONE_MATCH=lagging["ETag"])
+        self.assertEqual(current.status_code, 200)
+        self.assertEqual(current.json()["slots"], ["10:00:00-11:00:00"])
+        self.assertEqual(current["ETag"], etag(date.today(), 1, True))
+        self.assertEqual(self.booked(reader, HTTP_IF_NONE_MATCH=current["ETag"]).status_code, 304)
+
+        # the client that booked is pinned to the primary
+        self.assertEqual(self.booked(self.client).json()["slots"], ["10:00:00-11:00:00"])
+
+
+@override_settings(READ_DATABASE="replica")
+class ReadReplicaRoutingTests(SimpleTestCase):
+    # routing decisions only, run against two sqlite files with
+    # DATABASE_REPLICA_NAME to see it end to end
+
+    def route(self, request):
+        seen = {}
+
+        def get_response(request):
+            seen["alias"] = routers.read_alias()
+            seen["read"] = router.db_for_read(Booking)
+            seen["write"] = router.db_for_write(Booking)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return seen, response
+
+    def test_availability_reads_go_to_the_replica(self):
+        seen, response = self.route(RequestFactory().get("/agency/slot_booking"))
+        self.assertEqual(seen, {"alias": "replica", "read": "replica", "write": "default"})
+        self.assertNotIn(ReplicaRoutingMiddleware.pin_cookie, response.cookies)
+        self.assertIsNone(routers.read_alias())
+
+    def test_views_without_replica_methods_read_the_primary(self):
+        seen, _ = self.route(RequestFactory().get("/agency/cache/stats"))
+        self.assertEqual(seen["read"], "default")
+        seen, _ = self.route(RequestFactory().get("/not/a/path"))
+        self.assertEqual(seen["read"], "default")
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        seen, response = self.route(RequestFactory().post("/agency/slot_booking"))
+        self.assertEqual(seen["read"], "default")
+        cookie = response.cookies[ReplicaRoutingMiddleware.pin_cookie]
+        self.assertEqual(cookie["max-age"], settings.READ_PIN_SECONDS)
+
+        request = RequestFactory().get("/agency/slot_booking")
+        request.COOKIES[ReplicaRoutingMiddleware.pin_cookie] = cookie.value
+        seen, _ = self.route(request)
+        self.assertEqual(seen["read"], "default")
+
+    def test_other_apps_are_not_routed(self):
+        token = routers.use_replica(True)
+        try:
+            self.assertIsNone(routers.ReadReplicaRouter().db_for_read(ContentType))
+        finally:
+            routers.reset(token)
+
+    @override_settings(READ_DATABASE="default")
+    def test_no_replica_configured(self):
+        seen, response = self.route(RequestFactory().get("/agency/slot_booking"))
+        self.assertEqual(seen["read"], "default")
+        seen, response = self.route(RequestFactory().post("/agency/slot_booking"))
+        self.assertNotIn(ReplicaRoutingMiddleware.pin_cookie, response.cookies)
+
+
+class ProductionSqliteTests(SimpleTestCase):
+    def test_profile_sets_pragmas_and_takes_the_write_lock_up_front(self):
+        profile = settings.SQLITE_PRODUCTION_PROFILE
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "production.sqlite3")
+            database = {**connection.settings_dict, "NAME": path, **profile}
+            wrapper = load_backend(profile["ENGINE"]).DatabaseWrapper(database, "production")
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], int(settings.SQLITE_BUSY_TIMEOUT * 1000))
+
+                # an atomic block holds the write lock before its first write
+                wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+                other = sqlite3.connect(path, timeout=0)
+                with self.assertRaisesRegex(sqlite3.OperationalError, "locked"):
+                    other.execute("CREATE TABLE probe (id integer)")
+                other.close()
+                wrapper.rollback()
+                wrapper.set_autocommit(True)
+            finally:
+                wrapper.close()
+
+
+class IdempotencyKeyTests(AgencyTestCase):
+    def book_with_key(self, key, **times):
+        return self.book(headers={"Idempotency-Key": key}, **times)
+
+    def test_retry_is_answered_from_the_store(self):
+        first = self.book_with_key("retry")
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            retry = self.book_with_key("retry")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.book_with_key("reused")
+        response = self.book_with_key("reused", start_time="12:00:00", end_time="13:00:00")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+
+class AvailabilityCoalescingTests(SimpleTestCase):
+    def setUp(self):
+        caches[settings.AVAILABILITY_CACHE_ALIAS].clear()
+
+    def concurrent_reads(self, readers=8):
+        computations = []
+        results = []
+
+        def compute():
+            computations.append(1)
+            time_module.sleep(0.2)
+            return ["10:00:00-11:00:00"]
+
+        def read():
+            results.append(availability_cache.get_slots(1, date(2023, 10, 16), True, compute))
+
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [["10:00:00-11:00:00"]] * readers)
+        return len(computations)
+
+    def test_identical_misses_share_one_computation(self):
+        for mode in ("process", "cache"):
+            with self.subTest(mode=mode), override_settings(AVAILABILITY_COALESCE=mode):
+                caches[settings.AVAILABILITY_CACHE_ALIAS].clear()
+                self.assertEqual(self.concurrent_reads(), 1)
+
+    @override_settings(AVAILABILITY_COALESCE="off")
+    def test_coalescing_can_be_turned_off(self):
+        self.assertEqual(self.concurrent_reads(), 8)
+
+
+class AvailabilityETagTests(AgencyTestCase):
+
+    def test_unchanged_day_is_answered_with_304(self):
+        first = self.client.get("/agency/slot_booking", {"operator_id": "1"})
+        self.assertEqual(first.status_code, 200)
+        # the operator comes from the registry, the slots and their version
+        # from the cache
+        with self.assertNumQueries(0):
+            again = self.client.get("/agency/slot_booking", {"operator_id": "1"}, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+        self.assertEqual(again["ETag"], first["ETag"])
+
+    def test_booking_writes_change_the_etag(self):
+        first = self.client.get("/agency/slot_booking", {"operator_id": "1"})
+        # the cached slot list is invalidated once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book()
+        response = self.client.get("/agency/slot_booking", {"operator_id": "1"}, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertNotIn("10:00:00-11:00:00", " ".join(response.json()["slots"]))
+
+
+class OperatorRegistryTests(TestCase):
+    def setUp(self):
+        operators.clear()
+
+    def test_known_operators_are_checked_without_queries(self):
+        Operator.objects.create(id=1, operator_name="operator")
+        self.assertTrue(operators.exists(1))
+        with self.assertNumQueries(0):
+            self.assertTrue(operators.exists(1))
+            self.assertEqual(operators.registered([1]), {1})
+        # unknown ids are looked up every time
+        self.assertFalse(operators.exists(2))
+        Operator.objects.create(id=2, operator_name="other")
+        self.assertTrue(operators.exists(2))
+
+    def test_deleted_operators_are_forgotten(self):
+        operator = Operator.objects.create(id=1, operator_name="operator")
+        self.assertTrue(operators.exists(1))
+        operator.delete()
+        self.assertFalse(operators.exists(1))
+
+    def test_duplicate_names_are_rejected_by_the_unique_index(self):
+        response = self.client.post("/agency/operator/add", {"name": "operator"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        # the new operator is registered without a query
+        with self.assertNumQueries(0):
+            self.assertTrue(operators.exists(int(response.json()["operator_id"])))
+        response = self.client.post("/agency/operator/add", {"name": "operator"}, content_type="application/json")
+        self.assertEqual(response.json(), {"sCode": 400, "message": "Operator already exists"})
+        self.assertEqual(Operator.objects.count(), 1)
+
+    def test_unknown_operator_availability_is_404(self):
+        response = self.client.get("/agency/slot_booking", {"operator_id": "404"})
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkCancelTests(AgencyTestCase):
+    def setUp(self):
+        super().setUp()
+        Operator.objects.create(id=2, operator_name="other")
+        self.day = date.today() + timedelta(days=1)
+        self.ids = {}
+        for operator_id in (1, 2):
+            for offset in range(3):
+                for hour in (9, 10, 11):
+                    body, code = insert_booking(operator_id, self.day + timedelta(days=offset), time(hour), time(hour + 1))
+                    self.ids[operator_id, offset, hour] = body["booking_id"]
+
+    def cancel(self, body):
+        return self.client.post("/agency/bookings/cancel", {"operator_id": "1", **body}, content_type="application/json")
+
+    def test_window_cancels_overlapping_bookings_and_frees_their_minutes(self):
+        response = self.cancel({
+            "start_date": str(self.day), "end_date": str(self.day + timedelta(days=1)),
+            "slot": "10:00:00-11:00:00", "end_slot": "11:00:00-12:00:00",
+        })
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["cancelled"], 4)
+        self.assertEqual(body["by_date"], {str(self.day): 2, str(self.day + timedelta(days=1)): 2})
+        self.assertEqual(
+            set(body["booking_ids"]),
+            {self.ids[1, offset, hour] for offset in (0, 1) for hour in (10, 11)},
+        )
+        self.assertEqual(Booking.objects.filter(status="booked").count(), 14)
+        # only the 09:00 booking is left in the masks of the two days
+        nine = ((1 << 60) - 1) << 540
+        for offset in (0, 1):
+            day = OperatorAvailability.objects.get(operator_id=1, booking_date=self.day + timedelta(days=offset))
+            self.assertEqual(day.mask, nine)
+        # a second run finds nothing left to cancel
+        self.assertEqual(self.cancel({"start_date": str(self.day), "end_date": str(self.day), "slot": "10:00:00-11:00:00"}).json()["cancelled"], 0)
+
+    def test_without_slots_whole_days_are_cancelled(self):
+        body = self.cancel({"start_date": str(self.day), "end_date": str(self.day + timedelta(days=2))}).json()
+        self.assertEqual(body["cancelled"], 9)
+        self.assertFalse(Booking.objects.filter(operator_id=1, status="booked").exists())
+        self.assertEqual(Booking.objects.filter(operator_id=2, status="booked").count(), 9)
+        self.assertEqual({day.mask for day in OperatorAvailability.objects.filter(operator_id=1)}, {0})
+
+    def test_more_bookings_than_sqlite_binds_in_one_statement(self):
+        # a year of quarter hour bookings is past the 32766 bound variables
+        # an IN list of the cancelled ids could use
+        first = self.day + timedelta(days=10)
+        Booking.objects.bulk_create([
+            Booking(booking_id=10 ** 6 + index, operator_id=1, status="booked",
+                    booking_date=first + timedelta(days=index // 96),
+                    start_time=to_time(index % 96 * 15), end_time=to_time((index % 96 + 1) * 15 % MINUTES_PER_DAY))
+            for index in range(33000)
+        ], batch_size=2000)
+        with CaptureQueriesContext(connection) as queries:
+            body = self.cancel({"start_date": str(first), "end_date": str(first + timedelta(days=365))}).json()
+        self.assertEqual(body["cancelled"], 33000)
+        self.assertEqual(body["by_date"][str(first)], 96)
+        self.assertEqual(body["booking_ids"][:2], [str(10 ** 6), str(10 ** 6 + 1)])
+        self.assertFalse(Booking.objects.filter(operator_id=1, status="booked", booking_date__gte=first).exists())
+        self.assertEqual(BookingEvent.objects.filter(kind="cancelled").count(), 33000)
+        self.assertFalse([query["sql"][:100] for query in queries if query["sql"].startswith("UPDATE") and " IN (" in query["sql"]])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.cancel({"start_date": str(self.day), "end_date": str(self.day - timedelta(days=1))}).status_code, 400)
+        self.assertEqual(self.cancel({"start_date": str(self.day), "end_date": str(self.day), "end_slot": "10:00:00-11:00:00"}).status_code, 400)
+        response = self.client.post("/agency/bookings/cancel", {
+            "operator_id": "404", "start_date": str(self.day), "end_date": str(self.day),
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+
+class FastPathTests(SimpleTestCase):
+    def assertSameAsSerializer(self, serializer_class, data, fast=True):
+        serializer = serializer_class(data=data)
+        result = fastpath.validate(serializer_class, data)
+        if fast:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(result, serializer.validated_data)
+        elif result is not None:
+            # the fast path may only accept what the serializer accepts
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(result, serializer.validated_data)
+
+    def test_validators_match_the_serializers(self):
+        booking = {"operator_id": "1234", "booking_date": "2023-10-16", "start_time": "10:00:00", "end_time": "11:00:00"}
+        self.assertSameAsSerializer(BookingDataSerializer, booking)
+        self.assertSameAsSerializer(BookingDataSerializer, {**booking, "operator_id": "legacy-id"})
+        self.assertSameAsSerializer(ViewBookingSerializer, QueryDict("operator_id=1&view_booked_slots=true"))
+        # an absent boolean of a query string is False
+        self.assertSameAsSerializer(ViewBookingSerializer, QueryDict("operator_id=1&start_date=2023-10-01&end_date=2023-10-31"))
+        self.assertSameAsSerializer(AvailableOperatorsSerializer, QueryDict("booking_date=2023-10-16&slot=10:00:00-11:00:00&limit=5"))
+        self.assertSameAsSerializer(BulkCancelSerializer, {"operator_id": "1", "start_date": "2023-10-16", "end_date": "2023-10-16"})
+        for odd in (
+            {**booking, "start_time": "10:00"},
+            {**booking, "start_time": "25:00:00"},
+            {**booking, "booking_date": "2023-02-30"},
+            {**booking, "operator_id": " 1234 "},
+            {**booking, "operator_id": 1234},
+            {**booking, "end_time": None},
+            {key: value for key, value in booking.items() if key != "end_time"},
+            ["not", "a", "dict"],
+        ):
+            self.assertSameAsSerializer(BookingDataSerializer, odd, fast=False)
+        for odd in ("operator_id=1&view_booked_slots=maybe", "operator_id=1&start_date=2023-10-02&end_date=2023-10-01",
+                    "operator_id=&view_booked_slots=true"):
+            self.assertIsNone(fastpath.validate(ViewBookingSerializer, QueryDict(odd)))
+        self.assertIsNone(fastpath.validate(AvailableOperatorsSerializer, QueryDict("booking_date=2023-10-16&slot=10:00:00-11:00:00&limit=501")))
+
+    def test_renderer_matches_the_stock_renderer(self):
+        for body in (
+            {"sCode": 200, "booking_date": date(2023, 10, 16), "slots": ["10:00:00-11:00:00"]},
+            {"at": time(10, 0, 0, 123456), "lazy": gettext_lazy("Booking"), 1: "int key"},
+            {"text": "line\u2028separator \u00e9", "big": 2 ** 70},
+            [],
+            None,
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(FastJSONRenderer().render(body), JSONRenderer().render(body))
+        self.assertEqual(
+            FastJSONRenderer().render({"a": 1}, "application/json; indent=4"),
+            JSONRenderer().render({"a": 1}, "application/json; indent=4"),
+        )
+
+
+class AsyncAddOperatorTests(AgencyTransactionTestCase):
+    # OperatorSerializer is not compiled by the fast path, the async view
+    # must validate it with the serializer
+
+    async def test_operator_is_added(self):
+        with self.assertRaises(ImproperlyConfigured):
+            fastpath.compiled(OperatorSerializer)
+        response = await self.async_client.post("/agency/operator/add", {"name": "new operator"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        operator_id = response.json()["operator_id"]
+        self.assertTrue(await Operator.objects.filter(id=operator_id, operator_name="new operator").aexists())
+
+        response = await self.async_client.post("/agency/operator/add", {"name": "new operator"}, content_type="application/json")
+        self.assertEqual(response.json(), {"sCode": 400, "message": "Operator already exists"})
+        response = await self.async_client.post("/agency/operator/add", {"name": ""}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("name", response.json())
+
+
+class AsyncOverlapTests(SimpleTestCase):
+    # a production profile sqlite file, whose writers queue for the write lock
+    databases = {"default"}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "overlap.sqlite3")
+        database = file_database("production", self.path)
+        database.__enter__()
+        self.addCleanup(database.__exit__, None, None, None)
+        call_command("migrate", verbosity=0)
+        for alias in {settings.AVAILABILITY_CACHE_ALIAS, settings.IDEMPOTENCY_CACHE_ALIAS}:
+            caches[alias].clear()
+        operators.clear()
+        Operator.objects.create(id=1, operator_name="operator")
+
+    def test_reads_are_answered_while_a_write_waits_for_the_lock(self):
+        # another process holds the write lock, the booking waits for it in
+        # an executor thread while the availability read goes ahead
+        holder = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        holder.execute("BEGIN IMMEDIATE")
+        threading.Timer(0.5, holder.commit).start()
+        finished = {}
+
+        async def timed(name, request):
+            response = await request
+            finished[name] = time_module.monotonic()
+            return response
+
+        async def scenario():
+            client = self.async_client
+            slot = {"operator_id": "1", "booking_date": str(date.today()), "start_time": "10:00:00", "end_time": "11:00:00"}
+            return await asyncio.gather(
+                timed("write", client.post("/agency/slot_booking", slot, content_type="application/json")),
+                timed("read", client.get("/agency/slot_booking", {"operator_id": "1", "view_booked_slots": "false"})),
+            )
+
+        started = time_module.monotonic()
+        written, read = async_to_sync(scenario)()
+        holder.close()
+        self.assertEqual((written.status_code, read.status_code), (200, 200))
+        self.assertEqual(read.json()["slots"], ["00:00:00-24:00:00"])
+        self.assertGreaterEqual(finished["write"] - started, 0.5)
+        self.assertLess(finished["read"] - started, 0.4)
+
+
+@unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "sqlite_stress forks its writers")
+class SqliteStressTests(SimpleTestCase):
+    # sqlite_stress migrates its own sqlite files and forks writer processes
+    databases = {"default"}
+
+    def test_production_profile_loses_no_writes_to_lock_errors(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "stress.json")
+        call_command("sqlite_stress", workers=2, operations=30, operators=1, days=2,
+                     profile="production", output=path, stdout=StringIO())
+        with open(path) as output:
+            production = json.load(output)["profiles"]["production"]
+        self.assertEqual(production["writes"], 60)
+        self.assertEqual(production["locked"], 0)
+        self.assertEqual(production["ok"] + production["rejected"], 60)
+        self.assertTrue(production["consistent"])
+
+
+class BookingFeedTests(AgencyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = str(date.today())
+
+    def feed(self, **params):
+        return self.client.get("/agency/bookings/events", params).json()
+
+    def test_writes_are_tailed_in_commit_order(self):
+        booking_id = self.book(self.day, "10:00:00", "11:00:00").json()["booking_id"]
+        # a rejected write leaves no event behind
+        self.assertEqual(self.book(self.day, "10:00:00", "11:00:00").status_code, 400)
+        self.client.patch("/agency/slot_booking", {
+            "booking_id": booking_id, "booking_date": self.day, "start_time": "12:00:00", "end_time": "13:00:00",
+        }, content_type="application/json")
+        self.client.delete(f"/agency/cancel_booking/{booking_id}")
+
+        feed = self.feed()
+        self.assertEqual([event["kind"] for event in feed["events"]], ["created", "rescheduled", "cancelled"])
+        self.assertEqual({event["booking_id"] for event in feed["events"]}, {booking_id})
+        moved = feed["events"][1]
+        self.assertEqual((moved["start_time"], moved["previous"]["start_time"]), ("12:00:00", "10:00:00"))
+        self.assertEqual(feed["cursor"], feed["events"][-1]["offset"])
+
+        # consumers resume from their cursor
+        second = self.feed(after=feed["events"][0]["offset"], limit=1)
+        self.assertEqual([event["kind"] for event in second["events"]], ["rescheduled"])
+        self.assertEqual(self.feed(after=feed["cursor"]), {
+            "sCode": 200, "message": "Booking events", "events": [], "cursor": feed["cursor"],
+        })
+        self.assertEqual(self.client.get("/agency/bookings/events", {"operator_id": "404"}).status_code, 404)
+
+    def test_event_stream_resumes_from_last_event_id(self):
+        self.book(self.day, "10:00:00", "11:00:00")
+        self.book(self.day, "11:00:00", "12:00:00")
+        first = BookingEvent.objects.order_by("id").first()
+        response = self.client.get("/agency/bookings/events", headers={
+            "Accept": "text/event-stream", "Last-Event-ID": str(first.id),
+        })
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b"retry: 1000\n\n")
+        self.assertTrue(next(chunks).startswith(f"id: {first.id + 1}\nevent: created\n".encode()))
+        response.close()
+
+    @override_settings(FEED_SYNC_STREAM_SECONDS=1, FEED_STREAM_SECONDS=300, FEED_HEARTBEAT_SECONDS=0.2)
+    def test_wsgi_event_stream_ends_before_holding_a_worker_long(self):
+        response = self.client.get("/agency/bookings/events", headers={"Accept": "text/event-stream"})
+        started = time_module.monotonic()
+        chunks = list(response.streaming_content)
+        self.assertLess(time_module.monotonic() - started, 3)
+        self.assertEqual(chunks[0], b"retry: 1000\n\n")
+        self.assertIn(b": keep-alive\n\n", chunks)
+
+    def test_old_events_are_pruned(self):
+        self.book(self.day, "10:00:00", "11:00:00")
+        self.book(self.day, "11:00:00", "12:00:00")
+        BookingEvent.objects.filter(id=BookingEvent.objects.order_by("id").first().id).update(
+            timestamp=timezone.now() - timedelta(days=30)
+        )
+        self.assertEqual(prune_events_chunk(timezone.now() - timedelta(days=7)), 1)
+        self.assertEqual(prune_events_chunk(timezone.now() - timedelta(days=7)), 0)
+        self.assertEqual(BookingEvent.objects.count(), 1)
+
+
+class UtilizationTests(AgencyTestCase):
+    def setUp(self):
+        super().setUp()
+        # a Sunday, and a Thursday and Friday of one week across two months
+        self.sunday, self.thursday, self.friday = date(2030, 1, 6), date(2030, 1, 31), date(2030, 2, 1)
+
+    def report(self, **params):
+        return self.client.get("/agency/reports/utilization", {"operator_id": "1", **params}).json()
+
+    def minutes(self, period):
+        return {
+            str(start): minutes
+            for start, minutes in OperatorUtilization.objects.filter(period=period, minutes__gt=0).values_list("period_start", "minutes")
+        }
+
+    def test_writes_keep_the_aggregates_in_step_with_the_bookings(self):
+        moved = self.book(self.sunday, "10:00:00", "11:00:00").json()["booking_id"]
+        self.book(self.sunday, "11:00:00", "12:00:00")
+        cancelled = self.book(self.thursday, "09:00:00", "10:00:00").json()["booking_id"]
+        self.client.post("/agency/slot_booking/batch", {"bookings": [
+            {"operator_id": "1", "booking_date": str(self.friday), "start_time": "09:00:00", "end_time": "10:00:00"},
+            {"operator_id": "1", "booking_date": str(self.friday), "start_time": "10:00:00", "end_time": "11:00:00"},
+        ]}, content_type="application/json")
+        self.client.patch("/agency/slot_booking", {
+            "booking_id": moved, "booking_date": str(self.thursday), "start_time": "14:00:00", "end_time": "15:00:00",
+        }, content_type="application/json")
+        self.client.delete(f"/agency/cancel_booking/{cancelled}")
+        self.client.post("/agency/bookings/cancel", {
+            "operator_id": "1", "start_date": str(self.friday), "end_date": str(self.friday), "slot": "10:00:00-11:00:00",
+        }, content_type="application/json")
+
+        self.assertEqual(self.minutes("day"), {"2030-01-06": 60, "2030-01-31": 60, "2030-02-01": 60})
+        self.assertEqual(self.minutes("week"), {"2029-12-31": 60, "2030-01-28": 120})
+        self.assertEqual(self.minutes("month"), {"2030-01-01": 120, "2030-02-01": 60})
+        # a rebuild from the bookings finds nothing to correct
+        self.assertEqual(utilization.replace([1], booked_minutes([1])), 0)
+
+    def test_report_pages_through_the_periods(self):
+        self.book(self.sunday, "10:00:00", "11:00:00")
+        self.book(self.thursday, "10:00:00", "11:00:00")
+        self.book(self.thursday, "11:00:00", "12:00:00")
+        report = self.report(period="month", start_date="2030-01-15", end_date="2030-02-28")
+        self.assertEqual(report["rows"], [{
+            "operator_id": "1", "period_start": "2030-01-01", "booked_minutes": 180, "booked_hours": 3.0, "booked_slots": 3,
+        }])
+        first = self.report(start_date="2030-01-01", end_date="2030-01-31", limit=1)
+        self.assertEqual([row["period_start"] for row in first["rows"]], ["2030-01-06"])
+        second = self.report(start_date="2030-01-01", end_date="2030-01-31", limit=1, after=first["next"])
+        self.assertEqual([row["booked_minutes"] for row in second["rows"]], [120])
+        self.assertIsNone(second["next"])
+        self.assertEqual(self.client.get("/agency/reports/utilization", {"start_date": "2030-01-02", "end_date": "2030-01-01"}).status_code, 400)
+
+    def test_add_creates_and_adds_to_rows_in_one_statement(self):
+        # the week and month rows exist already, e.g. inserted by a
+        # concurrent first booking, the day row does not
+        OperatorUtilization.objects.create(operator_id=1, period="week", period_start=date(2029, 12, 31), minutes=60)
+        OperatorUtilization.objects.create(operator_id=1, period="month", period_start=date(2030, 1, 1), minutes=60)
+        with self.assertNumQueries(1):
+            utilization.add({(1, self.sunday): 30})
+        self.assertEqual(self.minutes("day"), {"2030-01-06": 30})
+        self.assertEqual(self.minutes("week"), {"2029-12-31": 90})
+        self.assertEqual(self.minutes("month"), {"2030-01-01": 90})
+
+    def test_every_write_updates_the_rows_once(self):
+        def utilization_writes(call):
+            with CaptureQueriesContext(connection) as queries:
+                body, code = call()
+            self.assertEqual(code, 200, body)
+            return len(queries), len([query for query in queries if "operator_utilization" in query["sql"]]), body
+
+        payload = {"operator_id": "1", "start_time": time(10), "end_time": time(11)}
+        insert_booking(1, self.thursday, time(9), time(10))
+        insert_booking(1, self.friday, time(11), time(12))
+        # the operator is in the registry as it is after its first request
+        operators.remember(1)
+        count, writes, body = utilization_writes(lambda: book({**payload, "booking_date": self.thursday}))
+        self.assertEqual((count, writes), (7, 1))
+        booking_id = body["booking_id"]
+        # a move within the day frees and books with one swap of the mask,
+        # the booked minutes do not change
+        count, writes, _ = utilization_writes(lambda: reschedule(
+            {"booking_id": booking_id, "booking_date": self.thursday, "start_time": time(14), "end_time": time(15)}
+        ))
+        self.assertEqual((count, writes), (6, 0))
+        # a move to the next day changes both days with one statement
+        count, writes, _ = utilization_writes(lambda: reschedule(
+            {"booking_id": booking_id, "booking_date": self.friday, "start_time": time(9), "end_time": time(10)}
+        ))
+        self.assertEqual((count, writes), (9, 1))
+        count, writes, _ = utilization_writes(lambda: cancel(booking_id))
+        self.assertEqual((count, writes), (8, 1))
+
+        self.assertEqual(self.minutes("day"), {"2030-01-31": 60, "2030-02-01": 60})
+        self.assertEqual(self.minutes("week"), {"2030-01-28": 120})
+        self.assertEqual(self.minutes("month"), {"2030-01-01": 60, "2030-02-01": 60})
+        self.assertEqual(utilization.replace([1], booked_minutes([1])), 0)
+
+    def test_rebuild_corrects_drift(self):
+        self.book(self.sunday, "10:00:00", "11:00:00")
+        OperatorUtilization.objects.filter(period="week").update(minutes=5)
+        OperatorUtilization.objects.create(operator_id=1, period="day", period_start=self.friday, minutes=60)
+        output = StringIO()
+        call_command("rebuild_utilization", "--dry-run", stdout=output)
+        self.assertIn("would correct 2 utilization rows", output.getvalue())
+        call_command("rebuild_utilization", stdout=StringIO())
+        self.assertEqual(self.minutes("week"), {"2029-12-31": 60})
+        self.assertEqual(self.minutes("day"), {"2030-01-06": 60})
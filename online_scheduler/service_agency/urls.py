@@ -1,8 +1,34 @@
 from django.urls import include, path
-from .views import (SlotBooking, CancelBooking, AddOperator)
+from .views import (SlotBooking, SlotBookingBatch, CancelBooking, AddOperator, AvailableOperators,
+                    AvailabilityCacheStats, Metrics, ExportBookings, BookingDetail, BulkCancelBookings,
+                    BookingFeed, UtilizationReport)
+from .async_views import AsyncSlotBooking, AsyncCancelBooking, AsyncAddOperator, AsyncBookingFeed
 
 urlpatterns = [
     path('slot_booking', SlotBooking.as_view(), name="slot-booking"),
+    path('slot_booking/batch', SlotBookingBatch.as_view(), name="slot-booking-batch"),
     path('cancel_booking/<str:booking_id>', CancelBooking.as_view(), name="cancel_booking"),
+    path('booking/<str:booking_id>', BookingDetail.as_view(), name="booking-detail"),
+    path('bookings/cancel', BulkCancelBookings.as_view(), name="bulk-cancel-bookings"),
+    path('bookings/events', BookingFeed.as_view(), name="booking-events"),
+    path('bookings/export', ExportBookings.as_view(), name="export-bookings"),
     path('operator/add', AddOperator.as_view(), name="add-operator"),
-]
\ No newline at end of file
+    path('operator/available', AvailableOperators.as_view(), name="available-operators"),
+    path('reports/utilization', UtilizationReport.as_view(), name="utilization-report"),
+    path('cache/stats', AvailabilityCacheStats.as_view(), name="availability-cache-stats"),
+    path('metrics', Metrics.as_view(), name="metrics"),
+]
+
+# the same paths for requests served by the ASGI handler, with the async
+# handler where there is one, see settings.ASYNC_URLCONF
+ASYNC_VIEWS = {
+    "slot-booking": AsyncSlotBooking,
+    "cancel_booking": AsyncCancelBooking,
+    "add-operator": AsyncAddOperator,
+    "booking-events": AsyncBookingFeed,
+}
+async_urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name].as_view(), name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in urlpatterns
+]
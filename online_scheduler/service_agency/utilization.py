@@ -0,0 +1,116 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+
+from .models import OperatorUtilization
+
+# booked minutes per operator and day, week and month in the
+# operator_utilization table, so that reports never scan the booking table.
+# Every change of an availability mask adds its difference in booked minutes
+# here in the same transaction, rebuild_utilization recomputes the rows from
+# the bookings.
+
+PERIODS = ("day", "week", "month")
+
+
+def period_start(period, day):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def rollup(minutes):
+    # {(operator_id, date): minutes} to {(operator_id, period, period_start): minutes}
+    totals = Counter()
+    for (operator_id, day), value in minutes.items():
+        for period in PERIODS:
+            totals[operator_id, period, period_start(period, day)] += value
+    return totals
+
+
+def add(deltas):
+    # adds {(operator_id, date): minutes} to the rows of the days, weeks and
+    # months, must run inside the transaction that changed the masks. One
+    # INSERT ... ON CONFLICT DO UPDATE per chunk adds to existing rows and
+    # creates missing ones, so two writers creating the same row can not
+    # fail on the unique constraint.
+    totals = [(key, value) for key, value in rollup(deltas).items() if value]
+    if not totals:
+        return
+    if not connection.features.supports_update_conflicts_with_target:
+        _add_rows(dict(totals))
+        return
+    fields = [OperatorUtilization._meta.get_field(name) for name in ("operator_id", "period", "period_start", "minutes")]
+    table = connection.ops.quote_name(OperatorUtilization._meta.db_table)
+    minutes = connection.ops.quote_name(fields[-1].column)
+    conflict = ", ".join(
+        connection.ops.quote_name(OperatorUtilization._meta.get_field(name).column)
+        for name in ("period", "period_start", "operator_id")
+    )
+    with connection.cursor() as cursor:
+        for offset in range(0, len(totals), 500):
+            chunk = totals[offset:offset + 500]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(connection.ops.quote_name(field.column) for field in fields)}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {minutes} = {table}.{minutes} + excluded.{minutes}",
+                [
+                    field.get_db_prep_value(value, connection)
+                    for key, total in chunk
+                    for field, value in zip(fields, (*key, total))
+                ],
+            )
+
+
+def _add_rows(totals):
+    # add for backends without ON CONFLICT, the rows are read and written
+    # back and a concurrent insert of the same row is retried once
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                rows = OperatorUtilization.objects.select_for_update().filter(
+                    operator_id__in={operator_id for operator_id, _, _ in totals},
+                    period__in={period for _, period, _ in totals},
+                    period_start__in={start for _, _, start in totals},
+                )
+                existing = {(row.operator_id, row.period, row.period_start): row for row in rows}
+                changed = []
+                created = []
+                for (operator_id, period, start), value in totals.items():
+                    row = existing.get((operator_id, period, start))
+                    if row is None:
+                        created.append(OperatorUtilization(
+                            operator_id=operator_id, period=period, period_start=start, minutes=value,
+                        ))
+                    else:
+                        row.minutes += value
+                        changed.append(row)
+                OperatorUtilization.objects.bulk_update(changed, ["minutes"], batch_size=500)
+                OperatorUtilization.objects.bulk_create(created, batch_size=500)
+            return
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+def replace(operator_ids, minutes):
+    # swaps every row of the operators for the totals of
+    # {(operator_id, date): minutes}, used by rebuild_utilization. Returns how
+    # many stored rows differed from the rebuilt ones.
+    totals = {key: value for key, value in rollup(minutes).items() if value}
+    stored = {
+        (operator_id, period, start): value
+        for operator_id, period, start, value in OperatorUtilization.objects.filter(
+            operator_id__in=operator_ids
+        ).exclude(minutes=0).values_list("operator_id", "period", "period_start", "minutes")
+    }
+    drift = sum(1 for key in stored.keys() | totals.keys() if stored.get(key) != totals.get(key))
+    OperatorUtilization.objects.filter(operator_id__in=operator_ids).delete()
+    OperatorUtilization.objects.bulk_create([
+        OperatorUtilization(operator_id=operator_id, period=period, period_start=start, minutes=value)
+        for (operator_id, period, start), value in totals.items()
+    ], batch_size=500)
+    return drift
@@ -1,48 +1,212 @@
-
-import uuid
-from datetime import datetime
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.http import parse_etags
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
 from drf_spectacular.types import OpenApiTypes
-from drf_spectacular.utils import OpenApiExample, extend_schema
+from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from .serializer import BookingDataSerializer, RescheduleSerializer, ViewBookingSerializer, OperatorSerializer
-from .models import Booking, Operator
-
-ALL_SLOTS = [
-    "00:00:00-01:00:00",
-    "01:00:00-02:00:00",
-    "02:00:00-03:00:00",
-    "03:00:00-04:00:00",
-    "04:00:00-05:00:00",
-    "05:00:00-06:00:00",
-    "06:00:00-07:00:00",
-    "07:00:00-08:00:00",
-    "08:00:00-09:00:00",
-    "09:00:00-10:00:00",
-    "10:00:00-11:00:00",
-    "11:00:00-12:00:00",
-    "12:00:00-13:00:00",
-    "13:00:00-14:00:00",
-    "14:00:00-15:00:00",
-    "15:00:00-16:00:00",
-    "16:00:00-17:00:00",
-    "17:00:00-18:00:00",
-    "18:00:00-19:00:00",
-    "19:00:00-20:00:00",
-    "20:00:00-21:00:00",
-    "21:00:00-22:00:00",
-    "22:00:00-23:00:00",
-    "23:00:00-00:00:00",
-]
+from .serializer import (BookingDataSerializer, RescheduleSerializer, ViewBookingSerializer, OperatorSerializer,
+                         BookingBatchSerializer, AvailableOperatorsSerializer, ExportSerializer,
+                         BookingLookupSerializer, BulkCancelSerializer, BookingFeedSerializer,
+                         UtilizationReportSerializer)
+from .models import Booking, BookingArchive, Operator, OperatorUtilization
+from . import cache as availability_cache
+from . import events, exports, fastpath, idempotency, ids, metrics, operators, routers, utilization
+from .bookings import book, cancel, cancel_bookings, create_bookings, overlapping, reschedule
+from .availability import aget_day, aget_masks, etag, get_day, get_masks
+from .renderers import EventStreamRenderer
+from .slots import booked_slots, free_slots, parse_slot, slot_minutes
+
+
+# write endpoints list their methods in idempotent_methods, see idempotency.py
+IDEMPOTENCY_KEY = OpenApiParameter(
+    idempotency.HEADER,
+    OpenApiTypes.STR,
+    OpenApiParameter.HEADER,
+    description="Retries with the same key get the response of the first request instead of writing again",
+)
+
+IF_NONE_MATCH = OpenApiParameter(
+    "If-None-Match",
+    OpenApiTypes.STR,
+    OpenApiParameter.HEADER,
+    description="ETag of an earlier single day response, answered with 304 while the day is unchanged",
+)
+LAST_EVENT_ID = OpenApiParameter(
+    "Last-Event-ID",
+    OpenApiTypes.INT,
+    OpenApiParameter.HEADER,
+    description="offset of the last event received, sent by EventSource clients when they reconnect",
+)
+
+
+
+def etag_matches(if_none_match, current):
+    # weak comparison as If-None-Match asks for, "*" matches any version
+    if not if_none_match:
+        return False
+    tags = {tag.removeprefix("W/") for tag in parse_etags(if_none_match)}
+    return "*" in tags or current in tags
+
+
+def validated(serializer_class, data):
+    # well formed requests of the hot endpoints are checked by the compiled
+    # validators of fastpath.py, the serializer handles the rest and raises
+    # the usual 400
+    with metrics.phase("validation"):
+        fast = fastpath.validate(serializer_class, data)
+        if fast is not None:
+            return fast
+        serializer = serializer_class(data=data)
+        valid = serializer.is_valid()
+    if not valid:
+        serializer_error = serializer.errors
+        raise ValidationError(serializer_error)
+    return serializer.validated_data
+
+def view_slots(data, if_none_match):
+    # the availability answer of SlotBooking.get as (body, status, headers),
+    # body is None for a 304. aview_slots is the same for the async view.
+    booking_date, error = _slots_date(data)
+    if error:
+        return error
+    operator_id = ids.resolve(Operator, data["operator_id"])
+
+    # check if operator exists
+    if not operators.exists(operator_id):
+        return _OPERATOR_NOT_REGISTERED
+    slots_for = booked_slots if data["view_booked_slots"] else free_slots
+
+    if booking_date is None:
+        # masks of all days are read with one query
+        masks = get_masks(operator_id, data["start_date"], data["end_date"])
+        return _range_answer(data, operator_id, masks, slots_for)
+
+    # booked slots of the day are kept as a bitmask on a single row, the
+    # slot lists built from it are cached with the row's version until the
+    # next booking write. A read from the replica keys the cache on the
+    # version of the replica's row, which it reads anyway, so a lagging
+    # replica never caches its older slots under the version of the newest
+    # write.
+    read_alias = routers.read_alias()
+    if read_alias not in (None, routers.PRIMARY):
+        row_version, mask = get_day(operator_id, booking_date, using=read_alias)
+        version, slots = availability_cache.get_slots_at(
+            operator_id, booking_date, row_version, data["view_booked_slots"], lambda: (row_version, slots_for(mask))
+        )
+    else:
+        def compute_slots():
+            # for the avl slots continuous free slots are merged into one range
+            version, mask = get_day(operator_id, booking_date, using=routers.PRIMARY)
+            return version, slots_for(mask)
+
+        version, slots = availability_cache.get_slots(operator_id, booking_date, data["view_booked_slots"], compute_slots)
+    return _day_answer(data, operator_id, booking_date, version, slots, if_none_match)
+
+
+async def aview_slots(data, if_none_match):
+    # view_slots with the async ORM and cache API
+    booking_date, error = _slots_date(data)
+    if error:
+        return error
+    operator_id = await ids.aresolve(Operator, data["operator_id"])
+    if not await operators.aexists(operator_id):
+        return _OPERATOR_NOT_REGISTERED
+    slots_for = booked_slots if data["view_booked_slots"] else free_slots
+
+    if booking_date is None:
+        masks = await aget_masks(operator_id, data["start_date"], data["end_date"])
+        return _range_answer(data, operator_id, masks, slots_for)
+
+    read_alias = routers.read_alias()
+    if read_alias not in (None, routers.PRIMARY):
+        row_version, mask = await aget_day(operator_id, booking_date, using=read_alias)
+
+        async def replica_slots():
+            return row_version, slots_for(mask)
+
+        version, slots = await availability_cache.aget_slots_at(
+            operator_id, booking_date, row_version, data["view_booked_slots"], replica_slots
+        )
+    else:
+        async def compute_slots():
+            version, mask = await aget_day(operator_id, booking_date, using=routers.PRIMARY)
+            return version, slots_for(mask)
+
+        version, slots = await availability_cache.aget_slots(
+            operator_id, booking_date, data["view_booked_slots"], compute_slots
+        )
+    return _day_answer(data, operator_id, booking_date, version, slots, if_none_match)
+
+
+_OPERATOR_NOT_REGISTERED = ({"sCode": 404, "message": "Operator not registered",}, status.HTTP_404_NOT_FOUND, None)
+
+
+def _slots_date(data):
+    # the day asked for and None, None for range mode, or the error answer
+    # range mode, future dates are allowed so that calendars can be shown
+    if data.get("start_date"):
+        return None, None
+    # if user doesnot give date then by default todays date will be taken
+    booking_date = data.get("booking_date") or timezone.now().date()
+    # check if the booking date future date
+    if booking_date > timezone.now().date():
+        return None, ({"sCode": 412, "message": "Future date not allowed",}, status.HTTP_412_PRECONDITION_FAILED, None)
+    return booking_date, None
+
+
+def _range_answer(data, operator_id, masks, slots_for):
+    start_date, end_date = data["start_date"], data["end_date"]
+    days = [{"booking_date": day, "slots": slots_for(mask)} for day, mask in masks]
+    body = {"sCode": 200, "message": f"Bookings from {start_date} to {end_date} for {operator_id}", "days": days}
+    return body, status.HTTP_200_OK, None
+
+
+def _day_answer(data, operator_id, booking_date, version, slots, if_none_match):
+    # polling clients send back the ETag and get an empty 304 while the
+    # day is unchanged
+    day_etag = etag(booking_date, version, data["view_booked_slots"])
+    if etag_matches(if_none_match, day_etag):
+        return None, status.HTTP_304_NOT_MODIFIED, {"ETag": day_etag}
+    body = {"sCode": 200, "message": f"Bookings for {booking_date} for {operator_id}", "booking_date": booking_date, "slots": slots}
+    return body, status.HTTP_200_OK, {"ETag": day_etag}
+
+
+def feed_operator(data):
+    # the operator the booking feed is narrowed to and None, or None and
+    # the 404 body and status
+    if "operator_id" not in data:
+        return None, None
+    operator_id = ids.resolve(Operator, data["operator_id"])
+    if not operators.exists(operator_id):
+        return None, ({"sCode": 404, "message": "Operator not registered"}, status.HTTP_404_NOT_FOUND)
+    return operator_id, None
+
+
+async def afeed_operator(data):
+    # feed_operator for the async view
+    if "operator_id" not in data:
+        return None, None
+    operator_id = await ids.aresolve(Operator, data["operator_id"])
+    if not await operators.aexists(operator_id):
+        return None, ({"sCode": 404, "message": "Operator not registered"}, status.HTTP_404_NOT_FOUND)
+    return operator_id, None
 
 
 class SlotBooking(APIView):
+    # availability reads may be served by the read replica, see routers.py
+    replica_methods = ("GET",)
+    idempotent_methods = ("POST", "PATCH")
+
     @extend_schema(
         request=BookingDataSerializer,
+        parameters=[IDEMPOTENCY_KEY],
         responses={
             200: OpenApiTypes.OBJECT,
             400: OpenApiTypes.OBJECT,
@@ -101,91 +265,12 @@ class SlotBooking(APIView):
         ],
     )
     def post(self, request):
-        serializer = BookingDataSerializer(data=request.data)
-        if not serializer.is_valid():
-            serializer_error = serializer.errors
-            raise ValidationError(serializer_error)
-        data = serializer.validated_data
-        operator_id = data["operator_id"]
-        booking_date = data["booking_date"]
-        booking_start_time = data["start_time"]
-        booking_end_time = data["end_time"]
-
-        #check if operator exits
-
-        operator_info = Operator.objects.filter(id=operator_id)
-
-        if not operator_info:
-            return Response(
-            {"sCode": 404, "message": "Operator not registered",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
-
-        t1 = datetime.strptime(str(booking_start_time), "%H:%M:%S")
-        print('Start time:', t1.time())
-
-        t2 = datetime.strptime(str(booking_end_time), "%H:%M:%S")
-        print('End time:', t2.time(), type(booking_end_time))
-        
-        # to check if start time should be end time
-        if t1 > t2:
-           if not (str(t1.time()) == "23:00:00" and str(t2.time()) == "00:00:00"):
-            return Response(
-                {"sCode": 412, "message": "Start time must be earlier than end time",},
-                status=status.HTTP_412_PRECONDITION_FAILED,
-                )
-        
-        # get difference
-        delta = t2 - t1
-
-        sec = delta.total_seconds()
-        print('difference in seconds:', sec)
-
-        min = sec / 60
-        print('difference in minutes:', min)
-
-        if str(t1.time()) == "23:00:00" and str(t2.time()) == "00:00:00":
-            min = 60
-
-        # to check if the slot that is being booked is for 1 hour
-        if min != 60:
-            return Response(
-            {"sCode": 422, "message": "Booking should be for max 1 hour",},
-            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            )
-
-        #check if operator has any booking for that date and time slot 
-
-        booking_info = Booking.objects.filter(operator_id=operator_id, booking_date=booking_date, start_time=booking_start_time, end_time = booking_end_time)
-
-        if booking_info:
-            return Response(
-            {"sCode": 400, "message": "Booking already exists, please slelect some other slot or date",},
-            status=status.HTTP_400_BAD_REQUEST,
-            )
-        
-        booking_id = str(uuid.uuid4().int)
-        booking_id = booking_id[:24]
-
-        params = {
-            "booking_id": booking_id,
-            "operator_id" : operator_id,
-            "booking_date": booking_date,
-            "start_time": booking_start_time,
-            "end_time": booking_end_time,
-            "status": "booked"
-        }
-
-        # add booking to DB
-        Booking.objects.create(**params)
-
-        return Response(
-            {"sCode": 200, "message": "Booking succesfully created", "booking_id": booking_id},
-            status=status.HTTP_200_OK,
-        )
+        data = validated(BookingDataSerializer, request.data)
+        return Response(*book(data))
 
     @extend_schema(
         request=RescheduleSerializer,
+        parameters=[IDEMPOTENCY_KEY],
         responses={
             200: OpenApiTypes.OBJECT,
             400: OpenApiTypes.OBJECT,
@@ -245,97 +330,14 @@ class SlotBooking(APIView):
     )
     def patch(self, request):
         # to reschedule booking
-        serializer = RescheduleSerializer(data=request.data)
-        if not serializer.is_valid():
-            serializer_error = serializer.errors
-            raise ValidationError(serializer_error)
-        data = serializer.validated_data
-        booking_id = data["booking_id"]
-        booking_date = data["booking_date"]
-        booking_start_time = data["start_time"]
-        booking_end_time = data["end_time"]
-
-        #check if booking exists
-
-        booking_info = Booking.objects.filter(booking_id=booking_id)
-
-        if not booking_info:
-            return Response(
-            {"sCode": 404, "message": "Booking doesnot exists",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
-
-        booking_info = booking_info.exclude(status="cancelled")
-
-        if not booking_info:
-            return Response(
-            {"sCode": 404, "message": "Booking doesnot exists",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
-
-        t1 = datetime.strptime(str(booking_start_time), "%H:%M:%S")
-        print('Start time:', t1.time())
-
-        t2 = datetime.strptime(str(booking_end_time), "%H:%M:%S")
-        print('End time:', t2.time(), type(booking_end_time))
-
-        # check if start time is before end time 
-        if t1 > t2:
-           if not (str(t1.time()) == "23:00:00" and str(t2.time()) == "00:00:00"):
-            return Response(
-                {"sCode": 412, "message": "Start time must be earlier than end time",},
-                status=status.HTTP_412_PRECONDITION_FAILED,
-                ) 
-        
-        # get difference
-        delta = t2 - t1
-
-        sec = delta.total_seconds()
-        print('difference in seconds:', sec)
-
-        min = sec / 60
-        print('difference in minutes:', min)
-
-        if str(t1.time()) == "23:00:00" and str(t2.time()) == "00:00:00":
-            min = 60
-
-        # check if the slot is for 1 hour
-        if min != 60:
-            return Response(
-            {"sCode": 422, "message": "Booking should be for 1 hour",},
-            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            )
-
-        #check if there is a booking with select time slot and date
-        operator_id = booking_info.first().operator_id
-
-        info = Booking.objects.filter(operator_id = operator_id, start_time = booking_start_time, end_time = booking_end_time, booking_date=booking_date)
-
-        # if the slot is already booked ask user to choose other slot
-        if info:
-           return Response(
-            {"sCode": 400, "message": "Please select some other slot or date"},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
-        # update booking info 
-
-        booking_info.update(
-            start_time = booking_start_time,
-            end_time = booking_end_time,
-            booking_date=booking_date,
-            is_rescheduled = True
-        )
-
-
-        return Response(
-            {"sCode": 200, "message": "Booking rescheduled successfully"},
-            status=status.HTTP_200_OK,
-        )
+        data = validated(RescheduleSerializer, request.data)
+        return Response(*reschedule(data))
 
     @extend_schema(
-        parameters = [ViewBookingSerializer],
+        parameters = [ViewBookingSerializer, IF_NONE_MATCH],
         responses={
             200: OpenApiTypes.OBJECT,
+            304: None,
             412: OpenApiTypes.OBJECT,
             404: OpenApiTypes.OBJECT,
         },
@@ -350,6 +352,17 @@ class SlotBooking(APIView):
                 response_only=True,
                 status_codes=["200"],
             ),
+            OpenApiExample(
+                "SUCCESS RANGE",
+                description="view slots for operator for every date from start_date to end_date",
+                value={
+                    "sCode": 200,
+                    "message": "Bookings from <start_date> to <end_date> for <operator_id>",
+                    "days": [{"booking_date": "<booking_date>", "slots": ["00:00:00-24:00:00"]}],
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
             OpenApiExample(
                 "ERROR",
                 description="ERROR",
@@ -374,74 +387,72 @@ class SlotBooking(APIView):
     )
     def get(self, request):
         # to view bookings of operator
-        serializer = ViewBookingSerializer(data=request.GET)
-        if not serializer.is_valid():
-            serializer_error = serializer.errors
-            raise ValidationError(serializer_error)
-        data = serializer.validated_data
-        operator_id = data["operator_id"]
-        booking_date = data.get("booking_date")
-        view_booked_slots = data["view_booked_slots"]
-
-        booked_slots = []
-        avl_slots = ALL_SLOTS.copy()
-        slots = []
-
-        # if user doesnot give date then by default todays date will be taken 
-        if not booking_date:
-            booking_date = timezone.now().date()
-        # check if the booking date future date
-        if booking_date > timezone.now().date():
-            return Response(
-            {"sCode": 412, "message": "Future date not allowed",},
-            status=status.HTTP_412_PRECONDITION_FAILED,
-            )
+        data = validated(ViewBookingSerializer, request.GET)
+        body, code, headers = view_slots(data, request.headers.get("If-None-Match"))
+        return Response(body, status=code, headers=headers)
 
-        # check if operator exists in DB
 
-        operator_info = Operator.objects.get(id=operator_id)
+class SlotBookingBatch(APIView):
+    idempotent_methods = ("POST",)
 
-        if not operator_info:
-            return Response(
-            {"sCode": 404, "message": "Operator not registered",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
+    @extend_schema(
+        request=BookingBatchSerializer,
+        parameters=[IDEMPOTENCY_KEY],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "REQUEST",
+                description="Bookings to create, each item takes the same fields as slot_booking",
+                value={
+                    "bookings": [
+                        {"operator_id": "<operator_id>", "booking_date": "2023-10-16", "start_time": "10:00:00", "end_time": "11:00:00"},
+                        {"operator_id": "<operator_id>", "booking_date": "2023-10-16", "start_time": "11:00:00", "end_time": "12:00:00"},
+                    ],
+                },
+                request_only=True,
+            ),
+            OpenApiExample(
+                "SUCCESS",
+                description="Result for every booking in the batch, in request order",
+                value={
+                    "sCode": 200,
+                    "message": "Batch processed",
+                    "created": 1,
+                    "failed": 1,
+                    "results": [
+                        {"index": 0, "sCode": 200, "message": "Booking succesfully created", "booking_id": "<booking_id>"},
+                        {"index": 1, "sCode": 400, "message": "Booking already exists, please slelect some other slot or date"},
+                    ],
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+        ],
+    )
+    def post(self, request):
+        # book many slots at once, a failed item does not fail the batch
+        serializer = BookingBatchSerializer(data=request.data)
+        with metrics.phase("validation"):
+            valid = serializer.is_valid()
+        if not valid:
+            serializer_error = serializer.errors
+            raise ValidationError(serializer_error)
+        results = create_bookings(serializer.validated_data["bookings"])
+        created = sum(1 for result in results if result["sCode"] == 200)
 
-        # fetch booking data for the operator
-        booking_info = Booking.objects.filter(operator_id = operator_id, booking_date = booking_date, status = "booked")
-
-        for booking in booking_info:
-            booking_slot = str(booking.start_time) + "-" + str(booking.end_time)
-            booked_slots.append(booking_slot)
-            avl_slots.remove(booking_slot)
-        
-        # for the avl slots below function will merge continuous slots 
-        if not view_booked_slots:
-            n = len(avl_slots)
-            split_slot = avl_slots[0].split('-')
-            start_time = split_slot[0]
-            end_time = split_slot[1]
-            for i in range(1, n):
-                split_slot = avl_slots[i].split('-')
-                start_time_i = split_slot[0]
-                end_time_i = split_slot[1]
-                if end_time != start_time_i:
-                    slots.append(str(start_time) + "-" + str(end_time))
-                    start_time = start_time_i
-                end_time = end_time_i
-            if end_time == "00:00:00":
-                end_time = "24:00:00"
-            slots.append(str(start_time) + "-" + str(end_time))
-        else:
-            slots = booked_slots
-                
         return Response(
-            {"sCode": 200, "message": f"Bookings for {booking_date} for {operator_id}", "booking_date": booking_date, "slots": slots},
+            {"sCode": 200, "message": "Batch processed", "created": created, "failed": len(results) - created, "results": results},
             status=status.HTTP_200_OK,
         )
-       
-class CancelBooking(APIView):  
+
+class CancelBooking(APIView):
+    idempotent_methods = ("DELETE",)
+
     @extend_schema(
+        parameters=[IDEMPOTENCY_KEY],
         responses={
             200: OpenApiTypes.OBJECT,
             404: OpenApiTypes.OBJECT,
@@ -481,39 +492,164 @@ class CancelBooking(APIView):
         ],
     )
     def delete(self, request, booking_id):
+        # to cancel the booking
+        return Response(*cancel(booking_id))
 
-        # to cancel the booking 
 
-        # check if the booking exist in DB
-        booking_info = Booking.objects.filter(booking_id=booking_id)
+class BulkCancelBookings(APIView):
+    idempotent_methods = ("POST",)
 
-        if not booking_info:
-            return Response(
-            {"sCode": 404, "message": "Booking doesnot exists",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
+    @extend_schema(
+        request=BulkCancelSerializer,
+        parameters=[IDEMPOTENCY_KEY],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "REQUEST",
+                description="Cancel the operator's bookings overlapping 10:00 to 12:00 on every day of the range, "
+                            "leave out slot and end_slot to cancel whole days",
+                value={
+                    "operator_id": "<operator_id>",
+                    "start_date": "2023-10-16",
+                    "end_date": "2023-10-20",
+                    "slot": "10:00:00-11:00:00",
+                    "end_slot": "11:00:00-12:00:00",
+                },
+                request_only=True,
+            ),
+            OpenApiExample(
+                "SUCCESS",
+                description="Cancelled bookings, their ids and the count per day",
+                value={
+                    "sCode": 200,
+                    "message": "Bookings cancelled",
+                    "cancelled": 2,
+                    "booking_ids": ["<booking_id>", "<booking_id>"],
+                    "by_date": {"2023-10-16": 1, "2023-10-18": 1},
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+            OpenApiExample(
+                "ERROR",
+                description="ERROR",
+                value={
+                    "sCode": 404,
+                    "message": "Operator not registered",
+                },
+                response_only=True,
+                status_codes=["404"],
+            ),
+        ],
+    )
+    def post(self, request):
+        # cancel every active booking of an operator in a date range, with
+        # slot and end_slot only those overlapping that window of each day
+        data = validated(BulkCancelSerializer, request.data)
+        operator_id = ids.resolve(Operator, data["operator_id"])
 
-        # check if booking is already cancelled
-        if booking_info.first().status == "cancelled":
+        if not operators.exists(operator_id):
             return Response(
-            {"sCode": 412, "message": "Booking already cancelled",},
-            status=status.HTTP_404_NOT_FOUND,
-        )
+                {"sCode": 404, "message": "Operator not registered"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
 
-        # update booking info
-        booking_info.update(
-            is_cancelled = True,
-            status="cancelled"
-        )
+        start = end = None
+        if "slot" in data:
+            start, _ = parse_slot(data["slot"])
+            _, end = parse_slot(data.get("end_slot", data["slot"]))
+
+        cancelled = cancel_bookings(operator_id, data["start_date"], data["end_date"], start, end)
+        by_date = {}
+        for _, booking_date in cancelled:
+            by_date[str(booking_date)] = by_date.get(str(booking_date), 0) + 1
 
         return Response(
-            {"sCode": 200, "message": "Booking cancelled successfully"},
+            {
+                "sCode": 200,
+                "message": "Bookings cancelled",
+                "cancelled": len(cancelled),
+                "booking_ids": [str(booking_id) for booking_id, _ in cancelled],
+                "by_date": by_date,
+            },
             status=status.HTTP_200_OK,
         )
 
+
+class BookingDetail(APIView):
+    replica_methods = ("GET",)
+
+    @extend_schema(
+        parameters = [BookingLookupSerializer],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="archived is true for bookings moved to the archive",
+                value={
+                    "sCode": 200,
+                    "message": "Booking details",
+                    "booking": {
+                        "booking_id": "<booking_id>", "operator_id": "<operator_id>", "status": "booked",
+                        "booking_date": "2023-10-16", "start_time": "10:00:00", "end_time": "11:00:00",
+                        "is_rescheduled": False, "is_cancelled": False, "timestamp": "2023-10-16T09:41:00Z",
+                        "archived": False,
+                    },
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+            OpenApiExample(
+                "ERROR",
+                description="ERROR",
+                value={"sCode": 404, "message": "Booking doesnot exists"},
+                response_only=True,
+                status_codes=["404"],
+            ),
+        ],
+    )
+    def get(self, request, booking_id):
+        # the booking table first, the archive only when asked for
+        serializer = BookingLookupSerializer(data=request.GET)
+        with metrics.phase("validation"):
+            valid = serializer.is_valid()
+        if not valid:
+            serializer_error = serializer.errors
+            raise ValidationError(serializer_error)
+        models = [Booking, BookingArchive] if serializer.validated_data["include_archived"] else [Booking]
+
+        for model in models:
+            booking = model.objects.filter(booking_id=ids.resolve(model, booking_id)).values(*exports.EXPORT_FIELDS).first()
+            if booking:
+                booking.update(
+                    booking_id=str(booking["booking_id"]),
+                    operator_id=str(booking["operator_id"]),
+                    archived=model is BookingArchive,
+                )
+                return Response(
+                    {"sCode": 200, "message": "Booking details", "booking": booking},
+                    status=status.HTTP_200_OK,
+                )
+
+        return Response(
+            {"sCode": 404, "message": "Booking doesnot exists",},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+
 class AddOperator(APIView):
+    idempotent_methods = ("POST",)
+
     @extend_schema(
     request=OperatorSerializer,
+    parameters=[IDEMPOTENCY_KEY],
     responses={
         200: OpenApiTypes.OBJECT,
         400: OpenApiTypes.OBJECT,
@@ -541,27 +677,369 @@ class AddOperator(APIView):
     def post(self, request):
         # add operator info in DB
         serializer = OperatorSerializer(data=request.data)
-        if not serializer.is_valid():
+        with metrics.phase("validation"):
+            valid = serializer.is_valid()
+        if not valid:
+            serializer_error = serializer.errors
+            raise ValidationError(serializer_error)
+        return Response(*operators.add(serializer.validated_data["name"]))
+
+
+class AvailableOperators(APIView):
+    replica_methods = ("GET",)
+
+    @extend_schema(
+        parameters = [AvailableOperatorsSerializer],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="operators free for the whole slot window, ordered by operator_id",
+                value={
+                    "sCode": 200,
+                    "message": "Operators available on <booking_date> for <slot>",
+                    "operators": [{"operator_id": "<operator_id>", "operator_name": "<operator_name>"}],
+                    "next": "<operator_id to pass as after for the next page>",
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+        ],
+    )
+    def get(self, request):
+        # to find the operators that are free for a slot or a slot window
+        data = validated(AvailableOperatorsSerializer, request.GET)
+        booking_date = data["booking_date"]
+        first_slot = data["slot"]
+        last_slot = data.get("end_slot", first_slot)
+        limit = data["limit"]
+
+        # operators with an active booking that overlaps the window come from
+        # the booking_slot_operator_idx index, the answer is the set
+        # difference
+        start, _ = parse_slot(first_slot)
+        _, end = parse_slot(last_slot)
+        booked = overlapping(
+            Booking.objects.filter(booking_date=booking_date, status="booked"), start, end
+        ).values("operator_id")
+        available = Operator.objects.exclude(id__in=booked).order_by("id")
+        if data.get("after"):
+            available = available.filter(id__gt=data["after"])
+
+        page = list(available.values_list("id", "operator_name")[:limit + 1])
+        next_after = str(page[limit - 1][0]) if len(page) > limit else None
+
+        window = first_slot if first_slot == last_slot else f"{first_slot.split('-')[0]}-{last_slot.split('-')[1]}"
+        return Response(
+            {
+                "sCode": 200,
+                "message": f"Operators available on {booking_date} for {window}",
+                "operators": [{"operator_id": str(operator_id), "operator_name": name} for operator_id, name in page[:limit]],
+                "next": next_after,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class UtilizationReport(APIView):
+    replica_methods = ("GET",)
+
+    @extend_schema(
+        parameters=[UtilizationReportSerializer],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="Booked time per operator and week, ordered by week and operator",
+                value={
+                    "sCode": 200,
+                    "message": "Utilization by week from 2023-10-02 to 2023-10-15",
+                    "period": "week",
+                    "rows": [
+                        {"operator_id": "<operator_id>", "period_start": "2023-10-02", "booked_minutes": 1260,
+                         "booked_hours": 21.0, "booked_slots": 21},
+                        {"operator_id": "<operator_id>", "period_start": "2023-10-09", "booked_minutes": 480,
+                         "booked_hours": 8.0, "booked_slots": 8},
+                    ],
+                    "next": "<value to pass as after for the next page>",
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+            OpenApiExample(
+                "ERROR",
+                description="ERROR",
+                value={
+                    "sCode": 404,
+                    "message": "Operator not registered",
+                },
+                response_only=True,
+                status_codes=["404"],
+            ),
+        ],
+    )
+    def get(self, request):
+        # booked time per operator and day, week or month, read from the
+        # operator_utilization table only
+        serializer = UtilizationReportSerializer(data=request.GET)
+        with metrics.phase("validation"):
+            valid = serializer.is_valid()
+        if not valid:
             serializer_error = serializer.errors
             raise ValidationError(serializer_error)
         data = serializer.validated_data
-        operator_name = data["name"]
-        # check if operator already exisit in DB
-        operator_info = Operator.objects.filter(operator_name = operator_name)
+        period = data["period"]
+        limit = data["limit"]
+
+        # a week or month is reported when it starts in the range or the
+        # range starts inside it
+        rows = OperatorUtilization.objects.filter(
+            period=period,
+            period_start__range=(utilization.period_start(period, data["start_date"]), data["end_date"]),
+            minutes__gt=0,
+        )
+        if "operator_id" in data:
+            operator_id = ids.resolve(Operator, data["operator_id"])
+            if not operators.exists(operator_id):
+                return Response(
+                    {"sCode": 404, "message": "Operator not registered"},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            rows = rows.filter(operator_id=operator_id)
+        if "after" in data:
+            after_start, after_operator = data["after"]
+            rows = rows.filter(
+                Q(period_start__gt=after_start) | Q(period_start=after_start, operator_id__gt=after_operator)
+            )
+
+        # one row more than the page tells whether there is a next page
+        page = list(rows.order_by("period_start", "operator_id").values_list(
+            "operator_id", "period_start", "minutes"
+        )[:limit + 1])
+        next_after = f"{page[limit - 1][1]}:{page[limit - 1][0]}" if len(page) > limit else None
+        size = slot_minutes()
+        return Response(
+            {
+                "sCode": 200,
+                "message": f"Utilization by {period} from {data['start_date']} to {data['end_date']}",
+                "period": period,
+                "rows": [
+                    {
+                        "operator_id": str(operator_id),
+                        "period_start": period_start,
+                        "booked_minutes": minutes,
+                        "booked_hours": round(minutes / 60, 2),
+                        "booked_slots": minutes // size,
+                    }
+                    for operator_id, period_start, minutes in page[:limit]
+                ],
+                "next": next_after,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+def feed_offset(after, last_event_id):
+    # the after parameter, else the Last-Event-ID of a reconnecting stream
+    if after is not None:
+        return after
+    if not last_event_id:
+        return 0
+    offset = ids.parse(last_event_id.strip())
+    if offset is None:
+        raise ValidationError({"Last-Event-ID": ["A valid integer is required."]})
+    return offset
+
+
+def event_stream_response(stream):
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    # proxies must pass events on as they come
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class BookingFeed(APIView):
+    # clients asking for text/event-stream get Server-Sent Events
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
+
+    @extend_schema(
+        parameters=[BookingFeedSerializer, LAST_EVENT_ID],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT,
+            404: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="Events after the given offset in commit order, pass cursor as after to continue",
+                value={
+                    "sCode": 200,
+                    "message": "Booking events",
+                    "events": [
+                        {
+                            "offset": 41,
+                            "kind": "rescheduled",
+                            "booking_id": "<booking_id>",
+                            "operator_id": "<operator_id>",
+                            "booking_date": "2023-10-17",
+                            "start_time": "11:00:00",
+                            "end_time": "12:00:00",
+                            "timestamp": "2023-10-16T09:30:00+00:00",
+                            "previous": {"booking_date": "2023-10-16", "start_time": "10:00:00", "end_time": "11:00:00"},
+                        },
+                        {
+                            "offset": 42,
+                            "kind": "cancelled",
+                            "booking_id": "<booking_id>",
+                            "operator_id": "<operator_id>",
+                            "booking_date": "2023-10-18",
+                            "start_time": "09:00:00",
+                            "end_time": "10:00:00",
+                            "timestamp": "2023-10-16T09:31:00+00:00",
+                        },
+                    ],
+                    "cursor": 42,
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+            OpenApiExample(
+                "ERROR",
+                description="ERROR",
+                value={
+                    "sCode": 404,
+                    "message": "Operator not registered",
+                },
+                response_only=True,
+                status_codes=["404"],
+            ),
+        ],
+    )
+    def get(self, request):
+        # tail the booking change events of every operator or of one, with
+        # wait as a long poll
+        data = validated(BookingFeedSerializer, request.GET)
+        after = feed_offset(data.get("after"), request.headers.get("Last-Event-ID"))
+        operator_id, error = feed_operator(data)
+        if error:
+            return Response(*error)
+
+        if request.accepted_renderer.format == EventStreamRenderer.format:
+            return event_stream_response(events.stream(after, operator_id, data["limit"]))
+
+        found = events.read(after, operator_id, data["limit"], data["wait"])
+        return Response(
+            {
+                "sCode": 200,
+                "message": "Booking events",
+                "events": [events.as_dict(event) for event in found],
+                "cursor": found[-1].id if found else after,
+            },
+            status=status.HTTP_200_OK,
+        )
 
-        if operator_info:
-            return Response({"sCode": 400, "message": "Operator already exists"}, status=status.HTTP_400_BAD_REQUEST)
 
-        id = str(uuid.uuid4().int)
-        operator_id = id[:24]
-        params = {
-            "id": operator_id,
-            "operator_name" : operator_name
-        }
-        Operator.objects.create(**params)
+class ExportBookings(APIView):
+    replica_methods = ("GET",)
 
+    @extend_schema(
+        parameters = [ExportSerializer],
+        responses={
+            (200, "application/x-ndjson"): OpenApiTypes.STR,
+            (200, "text/csv"): OpenApiTypes.STR,
+            400: OpenApiTypes.OBJECT,
+        },
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="one JSON object per booking and line",
+                value='{"booking_id": "<booking_id>", "operator_id": "<operator_id>", "status": "booked", '
+                      '"booking_date": "2023-10-16", "start_time": "10:00:00", "end_time": "11:00:00", '
+                      '"is_rescheduled": false, "is_cancelled": false, "timestamp": "2023-10-16 09:41:00+00:00"}',
+                response_only=True,
+                status_codes=["200"],
+            ),
+        ],
+    )
+    def get(self, request):
+        # stream bookings in fixed size chunks, memory stays flat for any result size
+        serializer = ExportSerializer(data=request.GET)
+        with metrics.phase("validation"):
+            valid = serializer.is_valid()
+        if not valid:
+            serializer_error = serializer.errors
+            raise ValidationError(serializer_error)
+        data = serializer.validated_data
+        operator_id = None
+        if "operator_id" in data:
+            operator_id = ids.resolve(Operator, data["operator_id"])
+            if operator_id is None:
+                return Response(
+                {"sCode": 404, "message": "Operator not registered",},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        lines, content_type = exports.FORMATS[data["output"]]
+        bookings = exports.export_querysets(
+            operator_id=operator_id,
+            include_archived=data["include_archived"],
+            start_date=data.get("start_date"),
+            end_date=data.get("end_date"),
+            status=data.get("status"),
+        )
+        # rows are read while the response streams, after the middleware
+        # has finished, so the read database is fixed here
+        bookings = [queryset.using(routers.read_alias()) for queryset in bookings]
+        response = StreamingHttpResponse(lines(exports.iter_rows(bookings)), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="bookings.{data["output"]}"'
+        return response
+
+
+class AvailabilityCacheStats(APIView):
+    @extend_schema(
+        responses={200: OpenApiTypes.OBJECT},
+        examples=[
+            OpenApiExample(
+                "SUCCESS",
+                description="hit, miss and coalesced counters of the availability cache in this worker process",
+                value={
+                    "sCode": 200,
+                    "message": "Availability cache statistics",
+                    "hits": 90,
+                    "misses": 8,
+                    "coalesced": 2,
+                    "hit_ratio": 0.9,
+                },
+                response_only=True,
+                status_codes=["200"],
+            ),
+        ],
+    )
+    def get(self, request):
         return Response(
-            {"sCode": 200, "message": "Operator succesfully added in DB", "operator_id": operator_id},
+            {"sCode": 200, "message": "Availability cache statistics", **availability_cache.stats()},
             status=status.HTTP_200_OK,
         )
 
+
+class Metrics(View):
+    # Prometheus scrape endpoint, the text format is rendered without DRF
+    # content negotiation
+    def get(self, request):
+        cache_stats = availability_cache.stats()
+        cache_lookups = metrics.Counter("agency_availability_cache_lookups_total", "Availability cache lookups by result.")
+        cache_lookups.inc((("result", "hit"),), cache_stats["hits"])
+        cache_lookups.inc((("result", "miss"),), cache_stats["misses"])
+        cache_lookups.inc((("result", "coalesced"),), cache_stats["coalesced"])
+        idempotent = metrics.Counter("agency_idempotent_requests_total", "Requests with an Idempotency-Key by outcome.")
+        for outcome, value in idempotency.stats().items():
+            idempotent.inc((("outcome", outcome),), value)
+        return HttpResponse(metrics.render(extra=[cache_lookups, idempotent]), content_type="text/plain; version=0.0.4; charset=utf-8")